@@ -24,7 +24,7 @@ VERSION = '0.0.11'
 REQUIRED = [
     'loguru',
     'psutil',
-    'pyee',
+    'pyee>=9',
     'requests',
     'xmltodict'
 ]
@@ -32,6 +32,8 @@ REQUIRED = [
 # What packages are optional?
 EXTRAS = {
     # 'fancy feature': ['django'],
+    'lxml': ['lxml'],
+    'watchdog': ['watchdog'],
 }
 
 # The rest you shouldn't have to touch too much :)
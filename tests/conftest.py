@@ -0,0 +1,69 @@
+import sqlite3
+import itertools
+
+import pytest
+
+from wxhook import Bot
+from wxhook.fake import FakeWxHelper
+
+ports = itertools.count(28600)
+
+
+class Connection(sqlite3.Connection):
+    """记录执行过的SQL"""
+    statements: list
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("WXHOOK_STATE_DIR", str(tmp_path / "state"))
+
+
+@pytest.fixture
+def fake():
+    fake = FakeWxHelper().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def server_port():
+    return next(ports)
+
+
+@pytest.fixture
+def make_bot(fake):
+    bots = []
+
+    def make(**kwargs):
+        bot = Bot(inject=False, remote_port=fake.port, server_port=next(ports), **kwargs)
+        bots.append(bot)
+        return bot
+
+    yield make
+    for bot in bots:
+        bot.exit()
+
+
+@pytest.fixture
+def database(fake):
+    """用内存SQLite模拟wxhelper的/api/getDBInfo和/api/execSql，句柄固定为1"""
+    connection = sqlite3.connect(":memory:", check_same_thread=False, factory=Connection)
+    create_sql = "CREATE TABLE MSG (localId INTEGER, createTime INTEGER, content TEXT)"
+    connection.execute(create_sql)
+    fake.responses["/api/getDBInfo"] = [{
+        "databaseName": "MSG0.db",
+        "handle": 1,
+        "tables": [{"name": "MSG", "tableName": "MSG", "sql": create_sql, "rootpage": "2"}],
+    }]
+    connection.statements = []
+
+    def exec_sql(payload):
+        connection.statements.append(payload["sql"])
+        cursor = connection.execute(payload["sql"])
+        rows = [[str(value) for value in row] for row in cursor.fetchall()]
+        return {"code": 1, "msg": "success", "data": [[column[0] for column in cursor.description]] + rows}
+
+    fake.responses["/api/execSql"] = exec_sql
+    yield connection
+    connection.close()
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from wxhook.aio import AsyncBot, AsyncHTTPTransport
+
+
+class FlakyServer:
+    """每个连接处理close_after个请求后直接断开，模拟wxhelper关闭空闲的keep-alive连接"""
+
+    def __init__(self, close_after: int = 2):
+        self.close_after = close_after
+        self.hits = []
+        self.server = None
+        self.port = None
+
+    async def handle(self, reader, writer):
+        for _ in range(self.close_after):
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            length = [line for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")]
+            await reader.readexactly(int(length[0].split(b":")[1]) if length else 0)
+            self.hits.append(head.split()[1].decode())
+            if len(self.hits) % self.close_after == 0:
+                break
+            body = b'{"code": 1, "msg": "success", "data": null}'
+            writer.write(b"HTTP/1.1 200 OK\r\nConnection: keep-alive\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+            await writer.drain()
+        writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def test_non_idempotent_call_is_not_resent_on_a_dropped_connection(server_port):
+    async def main():
+        async with FlakyServer() as server:
+            bot = AsyncBot(inject=False, remote_port=server.port, server_port=server_port)
+            assert (await bot.send_text("a", "1")).code == 1
+            # 复用的连接在请求写出后被断开，服务端可能已处理，不能重发
+            with pytest.raises(asyncio.IncompleteReadError):
+                await bot.send_text("a", "2")
+            assert server.hits == ["/api/sendTextMsg", "/api/sendTextMsg"]
+            assert bot.transport.report()["/api/sendTextMsg"]["errors"] == 1
+            await bot.transport.close()
+
+    asyncio.run(main())
+
+
+def test_idempotent_call_is_retried_on_a_new_connection(server_port):
+    async def main():
+        async with FlakyServer() as server:
+            bot = AsyncBot(inject=False, remote_port=server.port, server_port=server_port)
+            assert (await bot.check_login()).code == 1
+            assert (await bot.check_login()).code == 1
+            assert server.hits == ["/api/checkLogin"] * 3
+            assert bot.transport.report()["/api/checkLogin"]["errors"] == 0
+            await bot.transport.close()
+
+    asyncio.run(main())
+
+
+def test_idempotent_call_gives_up_after_retries():
+    async def main():
+        transport = AsyncHTTPTransport(retries=2, backoff=0)
+        async with FlakyServer(close_after=1) as server:
+            with pytest.raises(asyncio.IncompleteReadError):
+                await transport.request(f"http://127.0.0.1:{server.port}", "/api/checkLogin")
+            assert server.hits == ["/api/checkLogin"] * 3
+            report = transport.report()["/api/checkLogin"]
+            assert report["errors"] == 3 and report["retries"] == 2
+        await transport.close()
+
+    asyncio.run(main())
+
+
+def test_calls_against_the_fake_wxhelper(fake, server_port):
+    async def main():
+        bot = AsyncBot(inject=False, remote_port=fake.port, server_port=server_port)
+        assert (await bot.check_login()).code == 1
+        await bot.send_text("filehelper", "hello")
+        await bot.transport.close()
+
+    asyncio.run(main())
+    assert fake.calls["/api/checkLogin"] == 1 and fake.calls["/api/sendTextMsg"] == 1
@@ -0,0 +1,83 @@
+import time
+import threading
+
+from wxhook.dedup import Deduplicator
+from wxhook.dispatch import ShardedDispatcher
+from wxhook.model import Event
+
+
+def event(msg_id, **kwargs):
+    return Event.from_dict({"type": 1, "msgId": msg_id, "fromUser": "a", **kwargs})
+
+
+def test_disabled_by_default(make_bot):
+    assert make_bot().deduplicator is None
+
+
+def test_duplicates_are_suppressed(make_bot):
+    bot = make_bot(deduplicator=True)
+    got = []
+    bot.handle(1)(lambda bot, event: got.append(event.msgId))
+    for msg_id in (1, 2, 1, 3, 2):
+        bot.process_event({"type": 1, "msgId": msg_id, "fromUser": "a"})
+    assert got == [1, 2, 3]
+    assert bot.deduplicator.stats()["suppressed"] == 2
+
+
+def test_events_dropped_by_the_dispatcher_can_be_redelivered(make_bot):
+    bot = make_bot(deduplicator=True, dispatcher=ShardedDispatcher(shards=1, max_pending=1))
+    gate = threading.Event()
+    got = []
+
+    @bot.handle(1)
+    def on_message(bot, event):
+        gate.wait()
+        got.append(event.msgId)
+
+    # 1执行中，2排队后被3挤掉
+    for msg_id in (1, 2, 3):
+        bot.process_event({"type": 1, "msgId": msg_id, "fromUser": "a"})
+        time.sleep(0.05)
+    gate.set()
+    time.sleep(0.2)
+    bot.process_event({"type": 1, "msgId": 2, "fromUser": "a"})
+    bot.process_event({"type": 1, "msgId": 3, "fromUser": "a"})
+    bot.dispatcher.close()
+    assert got == [1, 3, 2]
+
+
+def test_bloom_filter_keeps_evicted_keys():
+    deduplicator = Deduplicator(capacity=2, bloom=True, bloom_capacity=100)
+    assert [deduplicator.seen(event(msg_id)) for msg_id in (1, 2, 3, 4)] == [False] * 4
+    # 1已从recent淘汰，只保留在布隆过滤器中
+    assert deduplicator.stats()["size"] == 3
+    assert deduplicator.seen(event(1))
+
+
+def test_forget_only_reverts_keys_still_in_recent():
+    deduplicator = Deduplicator(capacity=1, bloom=True, bloom_capacity=100)
+    deduplicator.seen(event(1))
+    deduplicator.forget(event(1))
+    assert not deduplicator.seen(event(1))
+    deduplicator.seen(event(2))
+    deduplicator.seen(event(3))
+    deduplicator.seen(event(4))
+    deduplicator.forget(event(2))
+    assert deduplicator.seen(event(2))
+
+
+def test_window_expires_keys_without_bloom():
+    deduplicator = Deduplicator(window=0.05)
+    deduplicator.seen(event(1))
+    assert deduplicator.seen(event(1))
+    time.sleep(0.1)
+    assert not deduplicator.seen(event(1))
+
+
+def test_events_without_msg_id_use_sequence_then_content():
+    deduplicator = Deduplicator()
+    assert not deduplicator.seen(event(None, msgSequence=7))
+    assert deduplicator.seen(event(None, msgSequence=7))
+    assert not deduplicator.seen(event(None, content="hi", createTime=1))
+    assert deduplicator.seen(event(None, content="hi", createTime=1))
+    assert not deduplicator.seen(event(None, content="hi", createTime=2))
@@ -0,0 +1,84 @@
+import time
+import threading
+
+import pytest
+
+from wxhook.dispatch import ShardedDispatcher
+from wxhook.server import OVERFLOW_BLOCK
+
+
+def test_events_of_one_key_run_in_order():
+    dispatcher = ShardedDispatcher(shards=4)
+    seen = {}
+    lock = threading.Lock()
+
+    def handle(key, index):
+        with lock:
+            seen.setdefault(key, []).append(index)
+
+    for index in range(50):
+        for key in ("a", "b", "c"):
+            dispatcher.submit(key, handle, key, index)
+    dispatcher.close()
+    assert seen == {key: list(range(50)) for key in ("a", "b", "c")}
+
+
+def test_drop_oldest_calls_on_drop():
+    dispatcher = ShardedDispatcher(shards=1, max_pending=2)
+    gate = threading.Event()
+    dropped = []
+    dispatcher.submit("a", gate.wait)
+    time.sleep(0.1)
+    for index in range(4):
+        dispatcher.submit("a", lambda index: None, index, on_drop=dropped.append)
+    gate.set()
+    dispatcher.close()
+    assert dropped == [0, 1]
+    assert dispatcher.stats()[0]["dropped"] == 2
+
+
+def test_depths_group_pending_events():
+    dispatcher = ShardedDispatcher(shards=1)
+    gate = threading.Event()
+    for key in ("1:a", "1:b", "2:a"):
+        dispatcher.submit(key, gate.wait)
+        dispatcher.submit(key, lambda: None)
+    time.sleep(0.1)
+    # 第一个事件正在执行，不计入积压
+    assert dispatcher.depths(lambda key: key.split(":")[0]) == {"1": 3, "2": 2}
+    gate.set()
+    dispatcher.close()
+
+
+def test_close_wakes_a_blocked_submitter():
+    dispatcher = ShardedDispatcher(shards=1, queue_size=1, overflow=OVERFLOW_BLOCK)
+    gate = threading.Event()
+    dispatcher.submit("a", gate.wait)
+    time.sleep(0.1)
+    dispatcher.submit("a", lambda: None)
+    errors = []
+
+    def submit():
+        try:
+            dispatcher.submit("a", lambda: None)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    time.sleep(0.1)
+    closer = threading.Thread(target=dispatcher.close)
+    closer.start()
+    thread.join(2)
+    assert not thread.is_alive() and len(errors) == 1
+    gate.set()
+    closer.join(2)
+    with pytest.raises(RuntimeError):
+        dispatcher.submit("a", lambda: None)
+
+
+def test_queue_limits_must_be_positive():
+    with pytest.raises(ValueError):
+        ShardedDispatcher(queue_size=0)
+    with pytest.raises(ValueError):
+        ShardedDispatcher(max_pending=0)
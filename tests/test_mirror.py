@@ -0,0 +1,28 @@
+from wxhook.mirror import DatabaseMirror
+
+
+def test_incremental_sync_keeps_rows_with_the_watermark_key(make_bot, database, tmp_path):
+    database.executemany("INSERT INTO MSG VALUES (?, ?, ?)", [(index, 100 + index // 4, f"m{index}") for index in range(10)])
+    bot = make_bot()
+    mirror = DatabaseMirror(bot, str(tmp_path / "mirror.db"), ["MSG"], batch_size=3, key="createTime")
+    assert mirror.sync()[0].rows == 10
+    assert mirror.get_watermark("MSG") == (102, 10)
+
+    # 新行的createTime等于当前水位，按(键, rowid)分页不会漏掉
+    database.executemany("INSERT INTO MSG VALUES (?, ?, ?)", [(index, 102, f"n{index}") for index in range(10, 13)])
+    report = mirror.sync()[0]
+    assert report.rows == 3
+    assert report.watermark == 102
+    assert mirror.execute("SELECT count(*) FROM MSG") == [(13,)]
+    assert mirror.sync()[0].rows == 0
+
+
+def test_watermark_survives_reopen(make_bot, database, tmp_path):
+    database.executemany("INSERT INTO MSG VALUES (?, ?, ?)", [(index, index, "x") for index in range(5)])
+    bot = make_bot()
+    path = str(tmp_path / "mirror.db")
+    DatabaseMirror(bot, path, ["MSG"], batch_size=2).sync()
+    database.execute("INSERT INTO MSG VALUES (5, 5, 'y')")
+    mirror = DatabaseMirror(bot, path, ["MSG"], batch_size=2)
+    assert mirror.sync()[0].rows == 1
+    assert mirror.execute("SELECT count(*) FROM MSG") == [(6,)]
@@ -0,0 +1,95 @@
+import time
+import threading
+
+import pytest
+
+from wxhook.outbox import Outbox, PRIORITY_HIGH
+
+
+class Sender:
+
+    def __init__(self, fail: bool = False):
+        self.sent = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def send_text(self, wxid, msg):
+        if self.fail:
+            raise RuntimeError("send failed")
+        with self.lock:
+            self.sent.append((wxid, msg))
+        return msg
+
+    def send_image(self, wxid, image_path):
+        with self.lock:
+            self.sent.append((wxid, image_path))
+        return image_path
+
+
+def test_text_is_sent_without_waiting_for_the_window():
+    sender = Sender()
+    outbox = Outbox(sender, coalesce_window=5)
+    start = time.monotonic()
+    assert outbox.send_text("a", "hello").result(timeout=2) == "hello"
+    assert time.monotonic() - start < 1
+    outbox.close()
+
+
+def test_texts_queued_behind_the_rate_limit_are_merged_up_to_the_cap():
+    sender = Sender()
+    outbox = Outbox(sender, per_recipient_rate=5, per_recipient_burst=1, coalesce_window=5, max_coalesce_length=5)
+    outbox.send_text("a", "first").result(timeout=2)
+    futures = [outbox.send_text("a", value) for value in ("b", "c", "d", "e")]
+    for future in futures:
+        future.result(timeout=5)
+    assert sender.sent == [("a", "first"), ("a", "b\nc\nd"), ("a", "e")]
+    assert outbox.stats()["coalesced"] == 2
+    outbox.close()
+
+
+def test_non_text_closes_the_merge_window():
+    sender = Sender()
+    outbox = Outbox(sender, per_recipient_rate=20, per_recipient_burst=1)
+    outbox.send_text("a", "x").result(timeout=2)
+    futures = [outbox.send_text("a", "t1"), outbox.send_image("a", "img"), outbox.send_text("a", "t2")]
+    for future in futures:
+        future.result(timeout=5)
+    assert sender.sent[1:] == [("a", "t1"), ("a", "img"), ("a", "t2")]
+    outbox.close()
+
+
+def test_high_priority_is_sent_first_and_recipients_do_not_block_each_other():
+    sender = Sender()
+    outbox = Outbox(sender, per_recipient_rate=1, per_recipient_burst=1, coalesce_window=0)
+    outbox.send_text("a", "a1").result(timeout=2)
+    outbox.send_text("a", "a2")
+    outbox.send_text("a", "a3", priority=PRIORITY_HIGH)
+    start = time.monotonic()
+    outbox.send_text("b", "b1").result(timeout=2)
+    assert time.monotonic() - start < 0.5
+    assert sender.sent == [("a", "a1"), ("b", "b1")]
+    outbox.close(timeout=3)
+    assert sender.sent[2] == ("a", "a3")
+
+
+def test_failed_sends_are_counted_and_raised():
+    outbox = Outbox(Sender(fail=True))
+    with pytest.raises(RuntimeError):
+        outbox.send_text("a", "x").result(timeout=2)
+    outbox.close()
+    assert outbox.stats()["failed"] == 1
+
+
+def test_close_timeout_fails_the_backlog():
+    sender = Sender()
+    outbox = Outbox(sender, per_recipient_rate=0.1, per_recipient_burst=1, coalesce_window=0)
+    futures = [outbox.send_text("a", str(index)) for index in range(3)]
+    start = time.monotonic()
+    outbox.close(timeout=0.3)
+    assert time.monotonic() - start < 2
+    assert futures[0].result(timeout=1) == "0"
+    for future in futures[1:]:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
+    with pytest.raises(RuntimeError):
+        outbox.send_text("a", "late")
@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def messages(database):
+    # 每4行createTime相同，批次边界会落在相同键值中间
+    database.executemany("INSERT INTO MSG VALUES (?, ?, ?)", [(index, 100 + index // 4, f"m{index}") for index in range(10)])
+    return database
+
+
+def test_cursor_pages_by_rowid(make_bot, messages):
+    bot = make_bot()
+    rows = list(bot.query(None, "SELECT localId, content FROM MSG", batch_size=3))
+    assert rows == [(index, f"m{index}") for index in range(10)]
+    assert all("LIMIT 3" in sql for sql in messages.statements)
+    assert len(messages.statements) == 4
+
+
+def test_cursor_pages_by_duplicate_key_without_losing_rows(make_bot, messages):
+    bot = make_bot()
+    rows = list(bot.query(None, "SELECT * FROM MSG WHERE localId >= 1", batch_size=3, key="createTime"))
+    assert [row[0] for row in rows] == list(range(1, 10))
+
+
+def test_cursor_columnar(make_bot, messages):
+    bot = make_bot()
+    batches = list(bot.query(None, "SELECT localId FROM MSG", batch_size=4).columnar())
+    assert [batch["localId"] for batch in batches] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_unpageable_query_resolves_handle_from_table(make_bot, messages):
+    bot = make_bot()
+    assert list(bot.query(None, "SELECT count(*) FROM MSG")) == [("10",)]
+    assert messages.statements == ["SELECT count(*) FROM MSG"]
+
+
+def test_qualified_table_names(make_bot, messages):
+    bot = make_bot()
+    assert len(list(bot.query(None, 'SELECT * FROM main."MSG"', batch_size=4))) == 10
+    assert bot.schema.find_table("MSG0.db.MSG")[0] == 1
+    with pytest.raises(KeyError):
+        bot.query(None, "SELECT * FROM missing.TABLE1")
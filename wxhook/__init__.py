@@ -1,3 +1,4 @@
 from .core import Bot
+from .aio import AsyncBot
 
 version = "0.0.11"
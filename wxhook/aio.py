@@ -0,0 +1,651 @@
+import os
+import json
+import time
+import typing
+import asyncio
+import inspect
+import traceback
+from urllib.parse import urlsplit
+
+from pyee.asyncio import AsyncIOEventEmitter
+
+from .logger import logger
+from .blob import loads_event
+from .events import ALL_MESSAGE
+from .transport import IDEMPOTENT_APIS, LatencyStats
+from .webhook import WebhookForwarder
+from .model import Columns, Event, Account, Contact, ContactDetail, Room, RoomMembers, Table, DB, Response
+from .utils import WeChatManager, open_wechat, fake_wechat_version
+
+
+class AsyncHTTPTransport:
+    """基于asyncio流的wxhelper HTTP客户端，维护keep-alive连接池"""
+
+    def __init__(
+        self,
+        pool_size: int = 64,
+        connect_timeout: float = 3,
+        read_timeout: float = 30,
+        retries: int = 2,
+        backoff: float = 0.1,
+        idle_timeout: float = 60,
+        idempotent_apis: typing.Iterable[str] = IDEMPOTENT_APIS
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.idempotent_apis = frozenset(idempotent_apis)
+        self.stats: typing.Dict[str, LatencyStats] = {}
+        self._idle: typing.Dict[typing.Tuple[str, int], typing.List[tuple]] = {}
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+
+    async def acquire(self, host: str, port: int) -> typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        idle = self._idle.setdefault((host, port), [])
+        now = time.monotonic()
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used <= self.idle_timeout and not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+        return reader, writer, False
+
+    def release(self, host: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        idle = self._idle.setdefault((host, port), [])
+        if len(idle) < self.pool_size:
+            idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    @staticmethod
+    async def read_response(reader: asyncio.StreamReader) -> typing.Tuple[int, bytes, bool]:
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readuntil(b"\r\n")
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, body, keep_alive
+
+    async def send(self, host: str, port: int, api: str, body: bytes, idempotent: bool = False) -> typing.Tuple[int, bytes]:
+        """发送请求，复用的连接失效时只有请求尚未写出或接口幂等才换新连接重发，避免重复发送消息"""
+        head = (
+            f"POST {api} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n"
+        ).encode("latin-1")
+        while True:
+            reader, writer, reused = await self.acquire(host, port)
+            written = False
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                written = True
+                status, data, keep_alive = await asyncio.wait_for(self.read_response(reader), self.read_timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # 复用的连接可能已被服务端关闭；请求已写出时服务端可能已经处理，非幂等接口不能重发
+                if reused and (idempotent or not written):
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.release(host, port, reader, writer)
+            else:
+                writer.close()
+            return status, data
+
+    async def request(self, base_url: str, api: str, **kwargs) -> dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+        url = urlsplit(base_url)
+        body = b"" if kwargs.get("json") is None else json.dumps(kwargs["json"]).encode("utf-8")
+        stats = self.stats.setdefault(api, LatencyStats())
+        idempotent = api in self.idempotent_apis
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    _, data = await self.send(url.hostname, url.port or 80, api, body, idempotent)
+                result = json.loads(data)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                retry = attempt + 1 < attempts
+                stats.add_error(retry)
+                if not retry:
+                    raise
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+            except Exception:
+                stats.add_error()
+                raise
+            else:
+                stats.add(time.perf_counter() - start)
+                return result
+
+    def report(self) -> typing.Dict[str, dict]:
+        """各接口调用次数、错误数及耗时分位数"""
+        return {api: stats.to_dict() for api, stats in list(self.stats.items())}
+
+    async def close(self) -> None:
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncBot:
+    """基于asyncio的机器人，接口均为协程，事件由asyncio流服务接收"""
+
+    def __init__(
+        self,
+        on_login: typing.Optional[typing.Callable[["AsyncBot", Event], typing.Any]] = None,
+        on_before_message: typing.Optional[typing.Callable[["AsyncBot", Event], typing.Any]] = None,
+        on_after_message: typing.Optional[typing.Callable[["AsyncBot", Event], typing.Any]] = None,
+        on_start: typing.Optional[typing.Callable[["AsyncBot"], typing.Any]] = None,
+        on_stop: typing.Optional[typing.Callable[["AsyncBot"], typing.Any]] = None,
+        faked_version: typing.Optional[str] = None,
+        transport: typing.Optional[AsyncHTTPTransport] = None,
+        inject: bool = True,
+        remote_port: typing.Optional[int] = None,
+        server_port: typing.Optional[int] = None
+    ):
+        self.version = "3.9.5.81"
+        self.server_host = "127.0.0.1"
+        self.remote_host = "127.0.0.1"
+        self.on_start = on_start
+        self.on_login = on_login
+        self.on_before_message = on_before_message
+        self.on_after_message = on_after_message
+        self.on_stop = on_stop
+        self.faked_version = faked_version
+        self.event_emitter = AsyncIOEventEmitter()
+        self.wechat_manager = WeChatManager()
+        # registered表示本实例在登记表中有条目，退出时只释放自己登记的端口
+        self.remote_port, self.server_port, self.registered = self.wechat_manager.resolve_ports(remote_port, server_port)
+        self.BASE_URL = f"http://{self.remote_host}:{self.remote_port}"
+        self.transport = transport or AsyncHTTPTransport()
+        self.info: typing.Optional[Account] = None
+        self.server: typing.Optional[asyncio.AbstractServer] = None
+        self.webhook_url = None
+        self.webhook_forwarder: typing.Optional[WebhookForwarder] = None
+        self.logged_in = False
+        # 在事件循环中首次登录时创建，兼容Python 3.8的事件循环绑定
+        self.login_lock: typing.Optional[asyncio.Lock] = None
+        self.DATA_SAVE_PATH = None
+        self.WXHELPER_PATH = None
+        self.FILE_SAVE_PATH = None
+        self.IMAGE_SAVE_PATH = None
+        self.VIDEO_SAVE_PATH = None
+
+        # inject为False时不启动/注入微信，直接连接remote_port上已运行的wxhelper(或测试替身)
+        self.process = open_wechat(self.remote_port) if inject else None
+
+        if self.faked_version is not None and self.process is not None:
+            if fake_wechat_version(self.process.pid, self.version, faked_version) == 0:
+                logger.success(f"wechat version faked: {self.version} -> {faked_version}")
+            else:
+                logger.error(f"wechat version fake failed.")
+
+        logger.info(f"API Server at 0.0.0.0:{self.remote_port}")
+        if self.process is not None:
+            self.wechat_manager.add(self.process.pid, self.remote_port, self.server_port)
+            self.registered = True
+
+    @staticmethod
+    async def call_hook_func(func: typing.Callable, *args, **kwargs) -> typing.Any:
+        if callable(func):
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+    async def login(self, event: Event) -> None:
+        """首个事件到达时获取账号信息，完成前其他事件等待，handler运行时保存路径均已设置"""
+        if self.login_lock is None:
+            self.login_lock = asyncio.Lock()
+        async with self.login_lock:
+            if self.logged_in:
+                return
+            await self.init_bot(self, event)
+            self.logged_in = True
+
+    async def init_bot(self, bot: "AsyncBot", event: Event) -> None:
+        self.info = await self.get_self_info()
+        self.DATA_SAVE_PATH = self.info.dataSavePath
+        self.WXHELPER_PATH = os.path.join(self.DATA_SAVE_PATH, "wxhelper")
+        self.FILE_SAVE_PATH = os.path.join(self.WXHELPER_PATH, "file")
+        self.IMAGE_SAVE_PATH = os.path.join(self.WXHELPER_PATH, "image")
+        self.VIDEO_SAVE_PATH = os.path.join(self.WXHELPER_PATH, "video")
+        await self.call_hook_func(self.on_login, bot, event)
+
+    def set_webhook_url(self, webhook_url: str, **kwargs) -> None:
+        """设置消息回调地址，事件由后台线程批量转发，参数见WebhookForwarder"""
+        if self.webhook_forwarder is not None:
+            self.webhook_forwarder.close()
+        self.webhook_url = webhook_url
+        self.webhook_forwarder = WebhookForwarder(webhook_url, **kwargs)
+
+    def webhook(self, event: dict) -> None:
+        if self.webhook_forwarder is not None:
+            self.webhook_forwarder.put(event)
+
+    async def call_api(self, api: str, **kwargs) -> dict:
+        return await self.transport.request(self.BASE_URL, api, **kwargs)
+
+    async def hook_sync_msg(
+        self,
+        ip: str,
+        port: int,
+        enable_http: int = 0,
+        url: str = "http://127.0.0.1:8000",
+        timeout: int = 30
+    ) -> Response:
+        """hook同步消息"""
+        data = {
+            "port": port,
+            "ip": ip,
+            "enableHttp": enable_http,
+            "url": url,
+            "timeout": timeout
+        }
+        return Response.from_dict(await self.call_api("/api/hookSyncMsg", json=data))
+
+    async def unhook_sync_msg(self) -> Response:
+        """取消hook同步消息"""
+        return Response.from_dict(await self.call_api("/api/unhookSyncMsg"))
+
+    async def hook_log(self) -> Response:
+        """hook日志"""
+        return Response.from_dict(await self.call_api("/api/hookLog"))
+
+    async def unhook_log(self) -> Response:
+        """取消hook日志"""
+        return Response.from_dict(await self.call_api("/api/unhookLog"))
+
+    async def check_login(self) -> Response:
+        """检查登录状态"""
+        return Response.from_dict(await self.call_api("/api/checkLogin"))
+
+    async def get_self_info(self) -> Account:
+        """获取用户信息"""
+        return Account.from_dict((await self.call_api("/api/userInfo"))["data"])
+
+    async def send_text(self, wxid: str, msg: str) -> Response:
+        """发送文本消息"""
+        data = {
+            "wxid": wxid,
+            "msg": msg
+        }
+        return Response.from_dict(await self.call_api("/api/sendTextMsg", json=data))
+
+    async def send_image(self, wxid: str, image_path: str) -> Response:
+        """发送图片消息"""
+        data = {
+            "wxid": wxid,
+            "imagePath": image_path
+        }
+        return Response.from_dict(await self.call_api("/api/sendImagesMsg", json=data))
+
+    async def send_emotion(self, wxid: str, file_path: str) -> Response:
+        """发送表情消息"""
+        data = {
+            "wxid": wxid,
+            "filePath": file_path
+        }
+        return Response.from_dict(await self.call_api("/api/sendCustomEmotion", json=data))
+
+    async def send_file(self, wxid: str, file_path: str) -> Response:
+        """发送文件消息"""
+        data = {
+            "wxid": wxid,
+            "filePath": file_path
+        }
+        return Response.from_dict(await self.call_api("/api/sendFileMsg", json=data))
+
+    async def send_applet(
+        self,
+        wxid: str,
+        waid_contact: str,
+        waid: str,
+        applet_wxid: str,
+        json_param: str,
+        head_img_url: str,
+        main_img: str,
+        index_page: str
+    ) -> Response:
+        """发送小程序消息"""
+        data = {
+            "wxid": wxid,
+            "waidConcat": waid_contact,
+            "waid": waid,
+            "appletWxid": applet_wxid,
+            "jsonParam": json_param,
+            "headImgUrl": head_img_url,
+            "mainImg": main_img,
+            "indexPage": index_page
+        }
+        return Response.from_dict(await self.call_api("/api/sendApplet", json=data))
+
+    async def send_room_at(self, room_id: str, wxids: typing.List[str], msg: str) -> Response:
+        """发送群@消息"""
+        data = {
+            "chatRoomId": room_id,
+            "wxids": ",".join(wxids),
+            "msg": msg
+        }
+        return Response.from_dict(await self.call_api("/api/sendAtText", json=data))
+
+    async def send_pat(self, room_id: str, wxid: str) -> Response:
+        """发送拍一拍消息"""
+        data = {
+            "receiver": room_id,
+            "wxid": wxid
+        }
+        return Response.from_dict(await self.call_api("/api/sendPatMsg", json=data))
+
+    async def get_contacts(self, columnar: bool = False) -> typing.Union[typing.List[Contact], Columns]:
+        """获取联系人列表，columnar为True时返回列式存储的Columns"""
+        items = (await self.call_api("/api/getContactList"))["data"]
+        if columnar:
+            return Columns(Contact, items)
+        return [Contact.from_dict(item) for item in items]
+
+    async def get_contact(self, wxid: str) -> ContactDetail:
+        """获取联系人详情"""
+        data = {
+            "wxid": wxid
+        }
+        return ContactDetail.from_dict((await self.call_api("/api/getContactProfile", json=data))["data"])
+
+    async def create_room(self, member_ids: typing.List[str]) -> Response:
+        """创建群聊"""
+        data = {
+            "memberIds": ",".join(member_ids)
+        }
+        return Response.from_dict(await self.call_api("/api/createChatRoom", json=data))
+
+    async def quit_room(self, room_id: str) -> Response:
+        """退出群聊"""
+        data = {
+            "chatRoomId": room_id
+        }
+        return Response.from_dict(await self.call_api("/api/quitChatRoom", json=data))
+
+    async def get_room(self, room_id: str) -> Room:
+        """获取群详情"""
+        data = {
+            "chatRoomId": room_id
+        }
+        return Room.from_dict((await self.call_api("/api/getChatRoomDetailInfo", json=data))["data"])
+
+    async def get_room_members(self, room_id: str) -> RoomMembers:
+        """获取群成员列表"""
+        data = {
+            "chatRoomId": room_id
+        }
+        return RoomMembers.from_dict((await self.call_api("/api/getMemberFromChatRoom", json=data))["data"])
+
+    async def add_room_member(self, room_id: str, member_ids: typing.List[str]) -> Response:
+        """添加群成员"""
+        data = {
+            "chatRoomId": room_id,
+            "memberIds": ",".join(member_ids)
+        }
+        return Response.from_dict(await self.call_api("/api/addMemberToChatRoom", json=data))
+
+    async def delete_room_member(self, room_id: str, member_ids: typing.List[str]) -> Response:
+        """删除群成员"""
+        data = {
+            "chatRoomId": room_id,
+            "memberIds": ",".join(member_ids)
+        }
+        return Response.from_dict(await self.call_api("/api/delMemberFromChatRoom", json=data))
+
+    async def invite_room_member(self, room_id: str, member_ids: typing.List[str]) -> Response:
+        """邀请群成员"""
+        data = {
+            "chatRoomId": room_id,
+            "memberIds": ",".join(member_ids)
+        }
+        return Response.from_dict(await self.call_api("/api/InviteMemberToChatRoom", json=data))
+
+    async def modify_member_nickname(self, room_id: str, wxid: str, nickname: str) -> Response:
+        """修改群成员昵称"""
+        data = {
+            "chatRoomId": room_id,
+            "wxid": wxid,
+            "nickName": nickname
+        }
+        return Response.from_dict(await self.call_api("/api/modifyNickname", json=data))
+
+    async def top_msg(self, msg_id: int) -> Response:
+        """设置群置顶消息"""
+        data = {
+            "msgId": msg_id
+        }
+        return Response.from_dict(await self.call_api("/api/topMsg", json=data))
+
+    async def remove_top_msg(self, room_id: str, msg_id: int) -> Response:
+        """移除群置顶消息"""
+        data = {
+            "chatRoomId": room_id,
+            "msgId": msg_id
+        }
+        return Response.from_dict(await self.call_api("/api/removeTopMsg", json=data))
+
+    async def forward_msg(self, msg_id: int, wxid: str) -> Response:
+        """转发消息"""
+        data = {
+            "msgId": msg_id,
+            "wxid": wxid
+        }
+        return Response.from_dict(await self.call_api("/api/forwardMsg", json=data))
+
+    async def get_sns_first_page(self) -> Response:
+        """获取朋友圈首页"""
+        return Response.from_dict(await self.call_api("/api/getSNSFirstPage"))
+
+    async def get_sns_next_page(self, sns_id: int) -> Response:
+        """获取朋友圈下一页"""
+        data = {
+            "snsId": sns_id
+        }
+        return Response.from_dict(await self.call_api("/api/getSNSNextPage", json=data))
+
+    async def collect_msg(self, msg_id: int) -> Response:
+        """收藏消息"""
+        data = {
+            "msgId": msg_id
+        }
+        return Response.from_dict(await self.call_api("/api/addFavFromMsg", json=data))
+
+    async def collect_image(self, wxid: str, image_path: str) -> Response:
+        """收藏图片"""
+        data = {
+            "wxid": wxid,
+            "imagePath": image_path
+        }
+        return Response.from_dict(await self.call_api("/api/addFavFromImage", json=data))
+
+    async def download_attachment(self, msg_id: int) -> Response:
+        """下载附件"""
+        data = {
+            "msgId": msg_id
+        }
+        return Response.from_dict(await self.call_api("/api/downloadAttach", json=data))
+
+    async def forward_public_msg(
+        self,
+        wxid: str,
+        app_name: str,
+        username: str,
+        title: str,
+        url: str,
+        thumb_url: str,
+        digest: str
+    ) -> Response:
+        """转发公众号消息"""
+        data = {
+            "wxid": wxid,
+            "appName": app_name,
+            "userName": username,
+            "title": title,
+            "url": url,
+            "thumbUrl": thumb_url,
+            "digest": digest,
+        }
+        return Response.from_dict(await self.call_api("/api/forwardPublicMsg", json=data))
+
+    async def forward_public_msg_by_msg_id(self, wxid: str, msg_id: int) -> Response:
+        """转发公众号消息通过消息ID"""
+        data = {
+            "wxid": wxid,
+            "msg_id": msg_id
+        }
+        return Response.from_dict(await self.call_api("/api/forwardPublicMsgByMsgId", json=data))
+
+    async def decode_image(self, file_path: str, store_dir: str) -> Response:
+        """解码图片"""
+        data = {
+            "filePath": file_path,
+            "storeDir": store_dir
+        }
+        return Response.from_dict(await self.call_api("/api/decodeImage", json=data))
+
+    async def get_voice_by_msg_id(self, msg_id: int, store_dir: str) -> Response:
+        """获取语音通过消息ID"""
+        data = {
+            "msgId": msg_id,
+            "storeDir": store_dir
+        }
+        return Response.from_dict(await self.call_api("/api/getVoiceByMsgId", json=data))
+
+    async def ocr(self, image_path: str) -> Response:
+        """图片文本识别"""
+        data = {
+            "imagePath": image_path
+        }
+        return Response.from_dict(await self.call_api("/api/ocr", json=data))
+
+    async def get_db_info(self) -> typing.List[DB]:
+        """获取数据库句柄"""
+        return [
+            DB(databaseName=item["databaseName"], handle=item["handle"], tables=[
+                Table.from_dict(sub_item)
+                for sub_item in item["tables"]
+            ])
+            for item in await self.call_api("/api/getDBInfo")
+        ]
+
+    async def exec_sql(self, db_handle: int, sql: str) -> Response:
+        """执行SQL命令"""
+        data = {
+            "dbHandle": db_handle,
+            "sql": sql
+        }
+        return Response.from_dict(await self.call_api("/api/execSql", json=data))
+
+    async def test(self) -> Response:
+        """测试"""
+        return Response.from_dict(await self.call_api("/api/test"))
+
+    async def on_event(self, raw_data: bytes) -> None:
+        try:
+            data = loads_event(raw_data)
+            event = Event.from_dict(data)
+            logger.debug(event)
+            await self.call_hook_func(self.on_before_message, self, event)
+            if not self.logged_in:
+                await self.login(event)
+            self.event_emitter.emit(str(ALL_MESSAGE), self, event)
+            self.event_emitter.emit(str(event.type), self, event)
+            await self.call_hook_func(self.on_after_message, self, event)
+            self.webhook(data)
+        except Exception:
+            logger.error(traceback.format_exc())
+            logger.error(raw_data)
+
+    def handle(self, events: typing.Union[typing.List[str], str, None] = None, once: bool = False) -> typing.Callable[[typing.Callable], None]:
+        def wrapper(func):
+            listen = self.event_emitter.on if not once else self.event_emitter.once
+            if not events:
+                listen(str(ALL_MESSAGE), func)
+            else:
+                for event in events if isinstance(events, list) else [events]:
+                    listen(str(event), func)
+
+        return wrapper
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                data = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                data = e.partial
+            await self.on_event(data)
+            writer.write("200 OK".encode())
+            await writer.drain()
+        except Exception:
+            logger.error(traceback.format_exc())
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.server_host, self.server_port, limit=64 * 1024 * 1024
+        )
+        logger.info(f"Listening Server at {self.server_host}:{self.server_port}")
+        await self.call_hook_func(self.on_start, self)
+        await self.hook_sync_msg(self.server_host, self.server_port)
+
+    async def exit(self) -> None:
+        await self.call_hook_func(self.on_stop, self)
+        if self.server is not None:
+            self.server.close()
+        await self.transport.close()
+        if self.webhook_forwarder is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.webhook_forwarder.close, 5)
+        if self.process is not None:
+            self.process.terminate()
+        if self.registered:
+            self.wechat_manager.release(self.remote_port)
+
+    async def serve(self) -> None:
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.exit()
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, SystemExit):
+            pass
@@ -0,0 +1,193 @@
+import json
+import queue
+import typing
+import sqlite3
+import threading
+import traceback
+
+from .logger import logger
+from .events import TEXT_MESSAGE
+from .model import Event
+
+COLUMNS = ("msgId", "msgSequence", "fromUser", "toUser", "type", "createTime", "content", "displayFullContent", "signature")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        msgId INTEGER,
+        msgSequence INTEGER,
+        fromUser TEXT,
+        toUser TEXT,
+        type INTEGER,
+        createTime INTEGER,
+        content TEXT,
+        displayFullContent TEXT,
+        signature TEXT,
+        extra TEXT
+    )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_msg_id ON messages (msgId)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_from_user ON messages (fromUser, createTime)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_to_user ON messages (toUser, createTime)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_create_time ON messages (createTime)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_type ON messages (type)",
+]
+
+# trigram分词支持中文子串检索(SQLite 3.34+)，不可用时退回默认分词
+FTS_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id'{tokenize})"
+
+FTS_SCHEMA = [
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages WHEN new.type = {TEXT_MESSAGE}
+    BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+
+class MessageArchive:
+    """本地消息归档，由独立写线程批量提交到SQLite(WAL)，支持按会话查询历史和全文检索"""
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.5, queue_size: int = 100000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.counters = {"queued": 0, "written": 0, "commits": 0, "dropped": 0, "errors": 0}
+        self.lock = threading.Lock()
+        self.counters_lock = threading.Lock()
+        self.writer = self.connect()
+        self.reader = self.connect()
+        for statement in SCHEMA:
+            self.writer.execute(statement)
+        self.fts = self.trigram = False
+        for tokenize in (", tokenize='trigram'", ""):
+            try:
+                self.writer.execute(FTS_TABLE.format(tokenize=tokenize))
+            except sqlite3.OperationalError:
+                continue
+            for statement in FTS_SCHEMA:
+                self.writer.execute(statement)
+            self.fts = True
+            self.trigram = bool(tokenize)
+            break
+        else:
+            logger.warning("sqlite fts5 is not available, full text search falls back to LIKE")
+        self.writer.commit()
+        self.closed = False
+        self.thread = threading.Thread(target=self.worker, name="wxhook-archive", daemon=True)
+        self.thread.start()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @staticmethod
+    def to_row(event: Event) -> tuple:
+        return tuple(event.raw(column) for column in COLUMNS) + (
+            json.dumps(event.extra, ensure_ascii=False) if event.extra else None,
+        )
+
+    def put(self, event: Event) -> None:
+        try:
+            self.queue.put_nowait(self.to_row(event))
+            self.count("queued")
+        except queue.Full:
+            self.count("dropped")
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.counters_lock:
+            self.counters[name] += value
+
+    def collect(self) -> typing.List[tuple]:
+        try:
+            row = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        rows = [] if row is None else [row]
+        while len(rows) < self.batch_size:
+            try:
+                row = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def worker(self) -> None:
+        placeholders = ", ".join("?" * (len(COLUMNS) + 1))
+        statement = f"INSERT OR IGNORE INTO messages ({', '.join(COLUMNS)}, extra) VALUES ({placeholders})"
+        while not (self.closed and self.queue.empty()):
+            rows = self.collect()
+            if not rows:
+                continue
+            try:
+                with self.writer:
+                    self.writer.executemany(statement, rows)
+                self.count("written", len(rows))
+                self.count("commits")
+            except Exception:
+                logger.error(traceback.format_exc())
+                self.count("errors")
+        # 写连接只由写线程使用，写完队列中的消息后由写线程自己关闭
+        self.writer.close()
+
+    def fetch(self, sql: str, parameters: typing.Sequence) -> typing.List[Event]:
+        with self.lock:
+            cursor = self.reader.execute(sql, parameters)
+            names = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        events = []
+        for row in rows:
+            data = dict(zip(names, row))
+            extra = data.pop("extra", None)
+            if extra:
+                data.update(json.loads(extra))
+            events.append(Event.from_dict(data))
+        return events
+
+    def history(self, chat: str, limit: int = 50, before: typing.Optional[int] = None) -> typing.List[Event]:
+        """某个会话最近的消息(收到的和自己发出的)，按时间倒序，before为createTime上限"""
+        sql = f"SELECT {', '.join(COLUMNS)}, extra FROM messages WHERE (fromUser = ? OR toUser = ?)"
+        parameters = [chat, chat]
+        if before is not None:
+            sql += " AND createTime < ?"
+            parameters.append(before)
+        sql += " ORDER BY createTime DESC LIMIT ?"
+        parameters.append(limit)
+        return self.fetch(sql, parameters)
+
+    def search(self, text: str, chat: typing.Optional[str] = None, limit: int = 50) -> typing.List[Event]:
+        """全文检索文本消息"""
+        columns = ", ".join(f"m.{column}" for column in COLUMNS)
+        if self.fts and (len(text) >= 3 or not self.trigram):
+            sql = f"SELECT {columns}, m.extra FROM messages_fts f JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?"
+            parameters = ['"' + text.replace('"', '""') + '"']
+        else:
+            sql = f"SELECT {columns}, m.extra FROM messages m WHERE m.type = {TEXT_MESSAGE} AND m.content LIKE ?"
+            parameters = [f"%{text}%"]
+        if chat is not None:
+            sql += " AND (m.fromUser = ? OR m.toUser = ?)"
+            parameters.extend((chat, chat))
+        sql += " ORDER BY m.createTime DESC LIMIT ?"
+        parameters.append(limit)
+        return self.fetch(sql, parameters)
+
+    def stats(self) -> dict:
+        with self.counters_lock:
+            stats = dict(self.counters)
+        stats["depth"] = self.queue.qsize()
+        return stats
+
+    def close(self, timeout: typing.Optional[float] = None) -> None:
+        self.closed = True
+        # 队列已满时不放入结束标记，写线程在closed后清空队列即退出
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning(f"message archive still writing {self.queue.qsize()} queued messages")
+        with self.lock:
+            self.reader.close()
@@ -0,0 +1,131 @@
+import sys
+import time
+import socket
+import typing
+import argparse
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from .logger import logger
+from .core import Bot
+from .model import Event
+from .events import TEXT_MESSAGE
+from .fake import FakeWxHelper
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: typing.List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def bench_events(bot: Bot, fake: FakeWxHelper, count: int, rate: typing.Optional[float], concurrency: int) -> dict:
+    latencies: typing.List[float] = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    @bot.handle(TEXT_MESSAGE)
+    def on_message(bot: Bot, event: Event) -> None:
+        latency = time.perf_counter() - event.extra["benchTime"]
+        with lock:
+            latencies.append(latency)
+            if len(latencies) >= count:
+                done.set()
+
+    def make_event(index: int) -> typing.Callable[[], dict]:
+        return lambda: {
+            "type": TEXT_MESSAGE,
+            "msgId": index + 1,
+            "fromUser": f"wxid_contact{index % 100}",
+            "toUser": "wxid_fake",
+            "content": f"benchmark message {index}",
+            "createTime": int(time.time()),
+            "benchTime": time.perf_counter(),
+        }
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    tracemalloc.start()
+    result = fake.replay((make_event(index) for index in range(count)), rate=rate, concurrency=concurrency)
+    done.wait(timeout=max(10.0, count / 100))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    seconds = result["seconds"]
+    return {
+        "events": len(latencies),
+        "errors": result["errors"],
+        "events_per_second": len(latencies) / seconds if seconds else 0.0,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "ack_p50_ms": percentile(result["acks"], 50) * 1000,
+        "ack_p99_ms": percentile(result["acks"], 99) * 1000,
+        "traced_memory_kb": current // 1024,
+        "traced_peak_kb": peak // 1024,
+        "rss_growth_kb": (process.memory_info().rss - rss_before) // 1024,
+    }
+
+
+def bench_call_api(bot: Bot, count: int, threads: int) -> dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda index: bot.send_text(f"wxid_contact{index % 100}", "benchmark"), range(count)))
+    seconds = time.perf_counter() - start
+    stats = bot.transport.report().get("/api/sendTextMsg", {})
+    return {
+        "calls": count,
+        "calls_per_second": count / seconds if seconds else 0.0,
+        "latency_p50_ms": stats.get("p50", 0.0) * 1000,
+        "latency_p99_ms": stats.get("p99", 0.0) * 1000,
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    fake = FakeWxHelper(latency=args.latency).start()
+    bot = Bot(inject=False, remote_port=fake.port, server_port=free_port())
+    thread = threading.Thread(target=bot.run, kwargs={"workers": args.workers}, daemon=True)
+    thread.start()
+    while bot.server is None:
+        time.sleep(0.01)
+    try:
+        return {
+            "events": bench_events(bot, fake, args.events, args.rate, args.concurrency),
+            "call_api": bench_call_api(bot, args.calls, args.threads),
+            "server": bot.server.stats(),
+        }
+    finally:
+        bot.server.shutdown()
+        bot.exit()
+        fake.stop()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="wxhook benchmark against a fake wxhelper")
+    parser.add_argument("--events", type=int, default=5000, help="number of pushed events")
+    parser.add_argument("--rate", type=float, default=None, help="events per second, unlimited by default")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent push connections")
+    parser.add_argument("--workers", type=int, default=16, help="event server workers")
+    parser.add_argument("--calls", type=int, default=2000, help="number of call_api requests")
+    parser.add_argument("--threads", type=int, default=8, help="call_api client threads")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake api latency in seconds")
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    for section, values in run(args).items():
+        print(f"[{section}]")
+        for name, value in values.items():
+            print(f"  {name:<20} {value:.2f}" if isinstance(value, float) else f"  {name:<20} {value}")
+
+
+if __name__ == "__main__":
+    main()
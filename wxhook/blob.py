@@ -0,0 +1,186 @@
+import io
+import json
+import mmap
+import typing
+import binascii
+import tempfile
+import threading
+
+# base64字段超过该长度(字符)时才从原始消息中提取为Blob，更小的字段仍为str
+BLOB_MIN_SIZE = 64 * 1024
+# 解码后超过该大小(字节)时写入临时文件并通过mmap访问
+BLOB_SPILL_SIZE = 1024 * 1024
+BLOB_FIELDS = (b"base64Img",)
+
+# 每次解码的base64字符数，必须是4的倍数
+CHUNK_SIZE = 4 * 65536
+
+
+class BufferReader(io.RawIOBase):
+    """在memoryview上按需读取，不复制底层数据"""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self.view) - self.position)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+class Blob:
+    """按需解码的base64二进制数据，较大的数据解码后写入临时文件，通过mmap提供bytes视图"""
+    __slots__ = ("encoded", "file", "mapped", "size", "lock")
+
+    def __init__(self, encoded: typing.Optional[bytes] = None, file: typing.Optional[typing.BinaryIO] = None, size: int = 0):
+        self.encoded = encoded
+        self.file = file
+        self.mapped: typing.Optional[mmap.mmap] = None
+        self.size = size if file is not None else decoded_size(encoded or b"")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_base64(
+        cls,
+        data: typing.Union[bytes, bytearray, memoryview],
+        spill_size: int = BLOB_SPILL_SIZE,
+        spill_dir: typing.Optional[str] = None
+    ) -> "Blob":
+        if decoded_size(data) <= spill_size:
+            return cls(encoded=bytes(data))
+        file = tempfile.TemporaryFile(dir=spill_dir)
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            file.write(binascii.a2b_base64(view[start:start + CHUNK_SIZE]))
+        return cls(file=file, size=file.tell())
+
+    @property
+    def spilled(self) -> bool:
+        return self.file is not None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def __repr__(self) -> str:
+        return f"Blob({self.size} bytes{', spilled' if self.spilled else ''})"
+
+    def view(self) -> memoryview:
+        """只读的bytes视图，落盘的数据通过mmap映射"""
+        if self.file is None:
+            return memoryview(binascii.a2b_base64(self.encoded))
+        with self.lock:
+            if self.mapped is None:
+                self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.mapped)
+
+    def tobytes(self) -> bytes:
+        return self.view().tobytes()
+
+    def open(self) -> typing.BinaryIO:
+        """以只读文件对象访问"""
+        return io.BufferedReader(BufferReader(self.view()))
+
+    def iter_base64(self) -> typing.Iterator[bytes]:
+        if self.file is None:
+            yield self.encoded
+            return
+        view = self.view()
+        step = CHUNK_SIZE // 4 * 3
+        for start in range(0, len(view), step):
+            yield binascii.b2a_base64(view[start:start + step], newline=False)
+
+    def base64(self) -> str:
+        """重新编码为base64字符串，用于转发"""
+        return b"".join(self.iter_base64()).decode("ascii")
+
+    def save(self, path: str) -> None:
+        view = self.view()
+        with open(path, "wb") as file:
+            for start in range(0, len(view), CHUNK_SIZE):
+                file.write(view[start:start + CHUNK_SIZE])
+
+    def close(self) -> None:
+        with self.lock:
+            if self.mapped is not None:
+                self.mapped.close()
+                self.mapped = None
+            if self.file is not None:
+                self.file.close()
+
+
+def decoded_size(data: typing.Union[bytes, bytearray, memoryview]) -> int:
+    length = len(data)
+    if length == 0:
+        return 0
+    padding = (data[length - 1:length] == b"=") + (length > 1 and data[length - 2:length - 1] == b"=")
+    return length // 4 * 3 - padding
+
+
+def find_string(raw: typing.Union[bytes, bytearray], field: bytes) -> typing.Optional[typing.Tuple[int, int]]:
+    """返回字段字符串值(不含引号)在原始消息中的起止位置"""
+    key = raw.find(b'"' + field + b'"')
+    if key < 0:
+        return None
+    index = key + len(field) + 2
+    length = len(raw)
+    while index < length and raw[index] in b" \t\r\n:":
+        index += 1
+    if index >= length or raw[index] != 0x22:
+        return None
+    end = raw.find(b'"', index + 1)
+    if end < 0:
+        return None
+    return index + 1, end
+
+
+def loads_event(
+    raw: typing.Union[bytes, bytearray],
+    min_size: typing.Optional[int] = None,
+    spill_size: int = BLOB_SPILL_SIZE,
+    spill_dir: typing.Optional[str] = None
+) -> dict:
+    """解析事件，min_size不为None时较大的base64字段在json.loads之前从原始字节中切出并包装为Blob，不会被解码成Python字符串"""
+    if min_size is None:
+        return json.loads(raw)
+    blobs = {}
+    for field in BLOB_FIELDS:
+        span = find_string(raw, field)
+        if span is None or span[1] - span[0] < min_size:
+            continue
+        start, end = span
+        value = memoryview(raw)[start:end]
+        if raw.find(b"\\", start, end) >= 0:
+            # base64内容中只可能出现转义的"/"或换行
+            value = bytes(value).replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        blobs[field.decode()] = Blob.from_base64(value, spill_size, spill_dir)
+        del value
+        raw = raw[:start - 1] + b"null" + raw[end + 1:]
+    data = json.loads(raw)
+    data.update(blobs)
+    return data
+
+
+def json_default(value: typing.Any) -> typing.Any:
+    """json.dumps的default参数，Blob序列化为base64字符串"""
+    if isinstance(value, Blob):
+        return value.base64()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
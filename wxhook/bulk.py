@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import typing
+import threading
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .logger import logger
+from .model import Model, Response
+
+
+class SendResult(Model):
+    """批量发送结果"""
+    target: str  # 接收者wxid或群ID
+    ok: bool  # 是否发送成功
+    code: typing.Optional[int] = None  # 接口返回的状态码
+    msg: typing.Optional[str] = None  # 接口返回的消息或异常信息
+    elapsed: float = 0.0  # 耗时(秒)
+    response: typing.Optional[Response] = None  # 接口响应，从断点文件恢复的结果为None
+
+
+class BulkSender:
+    """并发受限、可限速、可取消、支持断点续发的批量发送"""
+
+    def __init__(
+        self,
+        bot,
+        kind: str,
+        targets: typing.Iterable[str],
+        payload: typing.Any,
+        concurrency: int = 4,
+        interval: float = 0.0,
+        checkpoint: typing.Optional[str] = None,
+        progress: typing.Optional[typing.Callable[[int, int, SendResult], typing.Any]] = None,
+        cancel: typing.Optional[threading.Event] = None
+    ):
+        self.send = getattr(bot, f"send_{kind}", None)
+        if not callable(self.send):
+            raise ValueError(f"unknown send kind: {kind}")
+        self.targets = list(dict.fromkeys(targets))
+        if isinstance(payload, dict):
+            self.args, self.kwargs = (), payload
+        elif isinstance(payload, tuple):
+            self.args, self.kwargs = payload, {}
+        else:
+            self.args, self.kwargs = (payload,), {}
+        self.concurrency = concurrency
+        self.interval = interval
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.cancel = cancel or threading.Event()
+        self.lock = threading.Lock()
+        self.next_send = time.monotonic()
+        self.results: typing.Dict[str, SendResult] = {}
+        self.done = 0
+
+    def load_checkpoint(self) -> None:
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return
+        with open(self.checkpoint, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if item.get("ok"):
+                    self.results[item["target"]] = SendResult.from_dict(item)
+
+    def save(self, result: SendResult) -> None:
+        if self.checkpoint is None:
+            return
+        item = result.to_dict()
+        item.pop("response")
+        with open(self.checkpoint, "a", encoding="utf-8") as file:
+            file.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    def wait_turn(self) -> None:
+        if self.interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_send)
+            self.next_send = start + self.interval
+        if start > now:
+            self.cancel.wait(start - now)
+
+    def send_one(self, target: str) -> SendResult:
+        self.wait_turn()
+        if self.cancel.is_set():
+            return SendResult(target=target, ok=False, msg="cancelled")
+        start = time.perf_counter()
+        try:
+            response = self.send(target, *self.args, **self.kwargs)
+            result = SendResult(
+                target=target,
+                ok=response.code > 0,
+                code=response.code,
+                msg=response.msg,
+                elapsed=time.perf_counter() - start,
+                response=response
+            )
+        except Exception as e:
+            logger.error(f"send to {target} failed: {e}")
+            result = SendResult(target=target, ok=False, msg=str(e), elapsed=time.perf_counter() - start)
+        with self.lock:
+            self.save(result)
+        return result
+
+    def finish(self, result: SendResult) -> None:
+        with self.lock:
+            self.results[result.target] = result
+            self.done += 1
+            done = self.done
+        if self.progress is not None:
+            try:
+                self.progress(done, len(self.targets), result)
+            except Exception as e:
+                logger.error(f"progress callback failed: {e}")
+
+    def complete(self, target: str, future: Future) -> None:
+        # send_one本身出错(例如写断点文件失败)时也要记录结果，否则该接收者没有结果
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"send to {target} failed: {e}")
+            result = SendResult(target=target, ok=False, msg=str(e))
+        self.finish(result)
+
+    def run(self) -> typing.List[SendResult]:
+        self.load_checkpoint()
+        self.done = len(self.results)
+        pending = [target for target in self.targets if target not in self.results]
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="wxhook-bulk") as executor:
+            for target in pending:
+                executor.submit(self.send_one, target).add_done_callback(functools.partial(self.complete, target))
+        return [self.results[target] for target in self.targets]
@@ -0,0 +1,266 @@
+import time
+import socket
+import typing
+import threading
+import selectors
+import traceback
+import socketserver
+
+import pyee
+
+from .logger import logger
+from .blob import loads_event
+from .core import Bot
+from .handlers import HandlerRegistry
+from .dispatch import ShardedDispatcher
+from .metrics import Metrics
+from .profiler import HandlerProfiler
+from .router import RouteIndex
+from .transport import HTTPTransport
+from .server import PooledTCPServer, OVERFLOW_BLOCK, read_frame
+
+
+class ClusterRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        cluster = getattr(self.server, "bot")
+        metrics = cluster.metrics
+        try:
+            data = read_frame(self.request)
+            start = time.perf_counter() if metrics is not None else 0.0
+            cluster.on_event(data, self.request.getsockname()[1])
+            self.request.sendall("200 OK".encode())
+            if metrics is not None:
+                metrics.frames.inc()
+                metrics.ack_seconds.observe(time.perf_counter() - start)
+        except Exception:
+            if metrics is not None:
+                metrics.frame_errors.inc()
+            logger.error(traceback.format_exc())
+        finally:
+            self.request.close()
+
+
+class MultiPortServer(PooledTCPServer):
+    """在同一个selector上监听多个端口，所有连接共用一个工作线程池"""
+
+    def __init__(self, host: str, ports: typing.Sequence[int], RequestHandlerClass: typing.Callable, **kwargs):
+        if not ports:
+            raise ValueError("at least one port is required")
+        super().__init__((host, ports[0]), RequestHandlerClass, **kwargs)
+        self.listeners: typing.Dict[int, socket.socket] = {ports[0]: self.socket}
+        self.listeners_changed = False
+        self.serving = threading.Event()
+        self.stopped = threading.Event()
+        self.stopped.set()
+        for port in ports[1:]:
+            self.add_listener(port)
+
+    def add_listener(self, port: int) -> None:
+        if port in self.listeners:
+            return
+        sock = socket.socket(self.address_family, self.socket_type)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.server_address[0], port))
+        sock.listen(self.request_queue_size)
+        self.listeners[port] = sock
+        self.listeners_changed = True
+
+    def accept(self, sock: socket.socket) -> None:
+        try:
+            request, client_address = sock.accept()
+        except OSError:
+            return
+        if not self.verify_request(request, client_address):
+            self.shutdown_request(request)
+            return
+        try:
+            self.process_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self.serving.set()
+        self.stopped.clear()
+        try:
+            while self.serving.is_set():
+                self.listeners_changed = False
+                with selectors.DefaultSelector() as selector:
+                    for sock in self.listeners.values():
+                        selector.register(sock, selectors.EVENT_READ)
+                    while self.serving.is_set() and not self.listeners_changed:
+                        for key, _ in selector.select(poll_interval):
+                            self.accept(key.fileobj)
+                        self.service_actions()
+        finally:
+            self.stopped.set()
+
+    def shutdown(self) -> None:
+        self.serving.clear()
+        self.stopped.wait()
+
+    def server_close(self) -> None:
+        for port, sock in list(self.listeners.items()):
+            if sock is not self.socket:
+                sock.close()
+        super().server_close()
+
+
+class BotCluster(HandlerRegistry):
+    """单进程托管多个微信账号：共用一个监听selector、工作线程池、分发器、handler注册表和HTTP连接池，按端口或pid把事件路由到对应Bot"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        transport: typing.Optional[HTTPTransport] = None,
+        dispatcher: typing.Optional[ShardedDispatcher] = None,
+        metrics: typing.Optional[Metrics] = None,
+        profiler: typing.Optional[HandlerProfiler] = None
+    ):
+        self.host = host
+        self.transport = transport or HTTPTransport()
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.profiler = profiler
+        self.event_emitter = pyee.EventEmitter()
+        self.routes = RouteIndex()
+        self.registrations = {}
+        self.lock = threading.Lock()
+        self.bots: typing.List[Bot] = []
+        self.ports: typing.Dict[int, Bot] = {}
+        self.pids: typing.Dict[int, Bot] = {}
+        self.counters: typing.Dict[int, typing.Dict[str, int]] = {}
+        self.unrouted = 0
+        self.server: typing.Optional[MultiPortServer] = None
+        if metrics is not None:
+            metrics.gauge(
+                "wxhook_server_queue_depth",
+                "Frames waiting for a server worker",
+                lambda: self.server.stats()["queue_depth"] if self.server is not None else 0
+            )
+            metrics.gauge(
+                "wxhook_dispatch_queue_depth",
+                "Events waiting in dispatcher shards by account port",
+                self.dispatch_depths,
+                ("port",)
+            )
+
+    def dispatch_depths(self) -> typing.Dict[tuple, int]:
+        depths = dict.fromkeys(((port,) for port in self.ports), 0)
+        if self.dispatcher is not None:
+            # 共用分发器的会话key为"端口:fromUser"
+            for port, depth in self.dispatcher.depths(lambda key: (int(key.split(":", 1)[0]),)).items():
+                depths[port] = depth
+        return depths
+
+    def add_bot(self, **kwargs) -> Bot:
+        """创建并托管一个账号，参数同Bot，共享组件由集群提供"""
+        kwargs.setdefault("transport", self.transport)
+        kwargs.setdefault("dispatcher", self.dispatcher)
+        kwargs.setdefault("metrics", self.metrics)
+        kwargs.setdefault("profiler", self.profiler)
+        kwargs["event_emitter"] = self.event_emitter
+        kwargs["routes"] = self.routes
+        kwargs["shared"] = True
+        bot = Bot(**kwargs)
+        with self.lock:
+            self.bots.append(bot)
+            self.ports[bot.server_port] = bot
+            if bot.process is not None:
+                self.pids[bot.process.pid] = bot
+            self.counters[bot.server_port] = {"events": 0}
+        if self.server is not None:
+            self.server.add_listener(bot.server_port)
+        return bot
+
+    def route(self, port: typing.Optional[int], data: typing.Optional[dict] = None) -> typing.Optional[Bot]:
+        bot = self.ports.get(port)
+        if bot is None and data is not None:
+            bot = self.pids.get(data.get("pid"))
+        if bot is None and len(self.bots) == 1:
+            bot = self.bots[0]
+        return bot
+
+    def on_event(self, raw_data: bytes, port: typing.Optional[int] = None) -> None:
+        bot = self.route(port)
+        if bot is not None:
+            self.count(bot)
+            bot.on_event(raw_data)
+            return
+        try:
+            data = loads_event(raw_data)
+        except Exception:
+            with self.lock:
+                self.unrouted += 1
+            logger.error(traceback.format_exc())
+            logger.error(raw_data)
+            return
+        bot = self.route(port, data)
+        if bot is None:
+            with self.lock:
+                self.unrouted += 1
+            logger.warning(f"no bot for event on port {port} with pid {data.get('pid')}")
+            return
+        self.count(bot)
+        bot.process_event(data)
+
+    def count(self, bot: Bot) -> None:
+        with self.lock:
+            self.counters[bot.server_port]["events"] += 1
+
+    def stats(self) -> dict:
+        """各账号的事件数、去重、发送队列等统计以及共享组件的状态"""
+        accounts = {}
+        for bot in self.bots:
+            with self.lock:
+                stats = dict(self.counters[bot.server_port])
+            stats["errors"] = bot.errors
+            stats["pid"] = bot.process.pid if bot.process is not None else None
+            stats["remote_port"] = bot.remote_port
+            stats["logged_in"] = bot.logged_in
+            if bot.deduplicator is not None:
+                stats["dedup"] = bot.deduplicator.stats()
+            if bot.outbox is not None:
+                stats["outbox"] = bot.outbox.stats()
+            if bot.archive is not None:
+                stats["archive"] = bot.archive.stats()
+            accounts[bot.server_port] = stats
+        return {
+            "accounts": accounts,
+            "unrouted": self.unrouted,
+            "server": self.server.stats() if self.server is not None else None,
+            "dispatcher": self.dispatcher.stats() if self.dispatcher is not None else None,
+            "transport": self.transport.report(),
+        }
+
+    def exit(self) -> None:
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+        for bot in self.bots:
+            bot.exit()
+        # 共享组件在所有账号退出后只关闭一次
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.profiler is not None:
+            self.profiler.close()
+        self.transport.close()
+
+    def run(self, workers: int = 16, queue_size: int = 1024, overflow: str = OVERFLOW_BLOCK) -> None:
+        try:
+            self.server = MultiPortServer(
+                self.host,
+                list(self.ports),
+                ClusterRequestHandler,
+                workers=workers,
+                queue_size=queue_size,
+                overflow=overflow
+            )
+            self.server.bot = self
+            logger.info(f"Listening Server at {self.host}:{', '.join(map(str, self.ports))}")
+            self.server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            self.exit()
@@ -0,0 +1,259 @@
+import re
+import time
+import shlex
+import typing
+import inspect
+import threading
+import collections
+
+from .logger import logger
+from .events import TEXT_MESSAGE
+from .model import Event
+
+TRUE_VALUES = {"1", "true", "yes", "y", "on", "是"}
+FALSE_VALUES = {"0", "false", "no", "n", "off", "否"}
+
+COOLDOWN_GLOBAL = "global"
+COOLDOWN_ROOM = "room"
+COOLDOWN_SENDER = "sender"
+
+
+class CommandError(Exception):
+    """命令参数或权限错误"""
+
+
+def to_bool(value: str) -> bool:
+    lowered = value.lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    raise ValueError(f"invalid boolean: {value}")
+
+
+def split_args(text: str) -> typing.List[typing.Tuple[str, int]]:
+    """按shell规则分词，返回(词, 该词在原文中的结束位置)，引号不成对时按空白分词"""
+    try:
+        lexer = shlex.shlex(text, posix=True)
+        lexer.whitespace_split = True
+        lexer.commenters = ""
+        tokens = []
+        while True:
+            token = lexer.get_token()
+            if token == lexer.eof:
+                return tokens
+            tokens.append((token, lexer.instream.tell()))
+    except ValueError:
+        return [(match.group(), match.end()) for match in re.finditer(r"\S+", text)]
+
+
+class Parameter:
+    __slots__ = ("name", "convert", "default", "variadic")
+
+    def __init__(self, name: str, annotation: typing.Any, default: typing.Any, variadic: bool):
+        self.name = name
+        self.convert = to_bool if annotation is bool else annotation if annotation in (int, float) else str
+        self.default = default
+        self.variadic = variadic
+
+
+class Command:
+    """一条命令及其参数、冷却时间和访问控制"""
+
+    def __init__(
+        self,
+        name: str,
+        func: typing.Callable,
+        cooldown: float = 0.0,
+        cooldown_scope: str = COOLDOWN_SENDER,
+        rooms: typing.Optional[typing.Iterable[str]] = None,
+        senders: typing.Optional[typing.Iterable[str]] = None,
+        private: bool = True
+    ):
+        if cooldown_scope not in (COOLDOWN_GLOBAL, COOLDOWN_ROOM, COOLDOWN_SENDER):
+            raise ValueError(f"unknown cooldown scope: {cooldown_scope}")
+        self.name = name
+        self.func = func
+        self.cooldown = cooldown
+        self.cooldown_scope = cooldown_scope
+        self.rooms = frozenset(rooms) if rooms is not None else None
+        self.senders = frozenset(senders) if senders is not None else None
+        self.private = private
+        self.parameters = self.inspect(func)
+        self.last_called: typing.OrderedDict[typing.Optional[str], float] = collections.OrderedDict()
+
+    @staticmethod
+    def inspect(func: typing.Callable) -> typing.List[Parameter]:
+        # 前两个参数固定为bot和event，其余参数按类型注解从命令文本中解析
+        try:
+            hints = typing.get_type_hints(func)
+        except Exception:
+            hints = {}
+        parameters = []
+        for parameter in list(inspect.signature(func).parameters.values())[2:]:
+            if parameter.kind in (parameter.KEYWORD_ONLY, parameter.VAR_KEYWORD):
+                continue
+            parameters.append(Parameter(
+                parameter.name,
+                hints.get(parameter.name, str),
+                parameter.default,
+                parameter.kind == parameter.VAR_POSITIONAL
+            ))
+        return parameters
+
+    @property
+    def usage(self) -> str:
+        parts = [self.name]
+        for parameter in self.parameters:
+            if parameter.variadic:
+                parts.append(f"[{parameter.name}...]")
+            elif parameter.default is inspect.Parameter.empty:
+                parts.append(f"<{parameter.name}>")
+            else:
+                parts.append(f"[{parameter.name}]")
+        return " ".join(parts)
+
+    def parse(self, text: str) -> list:
+        spans = split_args(text)
+        tokens = [token for token, _ in spans]
+        args = []
+        consumed = 0
+        for parameter in self.parameters:
+            if parameter.variadic:
+                values, tokens = tokens, []
+            elif tokens:
+                values, tokens = [tokens[0]], tokens[1:]
+                consumed += 1
+            elif parameter.default is not inspect.Parameter.empty:
+                break
+            else:
+                raise CommandError(f"missing argument <{parameter.name}>, usage: {self.usage}")
+            for value in values:
+                try:
+                    args.append(parameter.convert(value))
+                except ValueError:
+                    raise CommandError(f"invalid value for <{parameter.name}>: {value}, usage: {self.usage}")
+        last = self.parameters[-1] if self.parameters else None
+        if tokens and len(args) == len(self.parameters) and last.convert is str and not last.variadic:
+            # 多余的内容并入最后一个字符串参数，直接截取原文以保留空白和换行，例如 "/say hello  world"
+            start = spans[consumed - 2][1] if consumed >= 2 else 0
+            args[-1] = text[start:].strip()
+        return args
+
+    def allowed(self, event: Event, sender: typing.Optional[str]) -> bool:
+        if self.rooms is not None and event.room not in self.rooms:
+            return False
+        if not self.private and not event.is_room:
+            return False
+        if self.senders is not None and sender not in self.senders:
+            return False
+        return True
+
+    def cooldown_key(self, event: Event, sender: typing.Optional[str]) -> typing.Optional[str]:
+        if self.cooldown_scope == COOLDOWN_SENDER:
+            return sender
+        if self.cooldown_scope == COOLDOWN_ROOM:
+            return event.fromUser
+        return None
+
+    def cooling(self, key: typing.Optional[str], now: float, maxsize: int) -> bool:
+        last = self.last_called.get(key)
+        if last is not None and now - last < self.cooldown:
+            return True
+        self.last_called[key] = now
+        self.last_called.move_to_end(key)
+        while len(self.last_called) > maxsize:
+            self.last_called.popitem(last=False)
+        return False
+
+
+class TrieNode:
+    __slots__ = ("children", "command")
+
+    def __init__(self):
+        self.children: typing.Dict[str, "TrieNode"] = {}
+        self.command: typing.Optional[Command] = None
+
+
+class CommandRouter:
+    """基于前缀树的文本命令路由，匹配耗时只与命令长度有关，与命令数量无关"""
+
+    def __init__(self, bot, on_error: typing.Optional[typing.Callable] = None, max_cooldown_keys: int = 10000):
+        self.bot = bot
+        self.on_error = on_error
+        self.max_cooldown_keys = max_cooldown_keys
+        self.root = TrieNode()
+        self.commands: typing.Dict[str, Command] = {}
+        self.lock = threading.Lock()
+        self.counters = {"matched": 0, "denied": 0, "cooling": 0, "errors": 0}
+        bot.handle(TEXT_MESSAGE)(self.on_message)
+
+    def add(self, name: str, func: typing.Callable, aliases: typing.Iterable[str] = (), **kwargs) -> Command:
+        command = Command(name, func, **kwargs)
+        for key in (name, *aliases):
+            if not key or any(char.isspace() for char in key):
+                raise ValueError(f"invalid command name: {key!r}")
+            node = self.root
+            for char in key:
+                node = node.children.setdefault(char, TrieNode())
+            node.command = command
+            self.commands[key] = command
+        return command
+
+    def command(self, name: str, aliases: typing.Iterable[str] = (), **kwargs) -> typing.Callable[[typing.Callable], typing.Callable]:
+        """注册命令，例如 @router.command("/weather", cooldown=10)，参数见Command"""
+        def wrapper(func):
+            self.add(name, func, aliases, **kwargs)
+            return func
+
+        return wrapper
+
+    def match(self, text: str) -> typing.Tuple[typing.Optional[Command], str]:
+        """最长匹配的命令及其后的参数文本，命令后必须是空白或结尾"""
+        node = self.root
+        found, end = None, 0
+        for index, char in enumerate(text):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.command is not None and (index + 1 == len(text) or text[index + 1].isspace()):
+                found, end = node.command, index + 1
+        if found is None:
+            return None, ""
+        return found, text[end:].strip()
+
+    def on_message(self, bot, event: Event) -> None:
+        sender, text = event.split_content()
+        if not text or text[0] not in self.root.children:
+            return
+        command, rest = self.match(text)
+        if command is None:
+            return
+        if not command.allowed(event, sender):
+            self.count("denied")
+            return
+        try:
+            args = command.parse(rest)
+        except CommandError as e:
+            self.count("errors")
+            if self.on_error is not None:
+                self.on_error(bot, event, command, e)
+            else:
+                logger.debug(f"{command.name}: {e}")
+            return
+        if command.cooldown > 0:
+            with self.lock:
+                cooling = command.cooling(command.cooldown_key(event, sender), time.monotonic(), self.max_cooldown_keys)
+            if cooling:
+                self.count("cooling")
+                return
+        self.count("matched")
+        command.func(bot, event, *args)
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, commands=len(self.commands))
@@ -1,18 +1,36 @@
 import os
-import json
+import time
 import typing
+import threading
 import traceback
 import socketserver
 from functools import lru_cache
 
-import psutil
 import pyee
-import requests
 
 from .logger import logger
 from .events import ALL_MESSAGE
-from .model import Event, Account, Contact, ContactDetail, Room, RoomMembers, Table, DB, Response
-from .utils import WeChatManager, start_wechat_with_inject, fake_wechat_version, get_pid, parse_event
+from .transport import HTTPTransport
+from .archive import MessageArchive
+from .blob import BLOB_MIN_SIZE, BLOB_SPILL_SIZE, loads_event
+from .bulk import BulkSender, SendResult
+from .command import CommandRouter
+from .directory import Directory
+from .handlers import HandlerRegistry
+from .dedup import Deduplicator
+from .dispatch import ShardedDispatcher
+from .media import MediaFetcher
+from .metrics import Metrics
+from .outbox import Outbox
+from .profiler import HandlerProfiler
+from .record import EventRecorder
+from .router import RouteIndex
+from .webhook import WebhookForwarder
+from .sns import SnsPager
+from .sql import Cursor, Schema
+from .server import PooledTCPServer, OVERFLOW_BLOCK, read_frame
+from .model import Columns, Event, Account, Contact, ContactDetail, Room, RoomMembers, SnsItem, Table, DB, Response
+from .utils import WeChatManager, open_wechat, fake_wechat_version
 
 
 class RequestHandler(socketserver.BaseRequestHandler):
@@ -20,24 +38,25 @@ class RequestHandler(socketserver.BaseRequestHandler):
         super().__init__(*args, **kwargs)
 
     def handle(self):
+        bot = getattr(self.server, "bot")
+        metrics = bot.metrics
         try:
-            data = b""
-            while True:
-                chunk = self.request.recv(1024)
-                data += chunk
-                if len(chunk) == 0 or chunk[-1] == 0xA:
-                    break
-
-            bot = getattr(self.server, "bot")
+            data = read_frame(self.request)
+            start = time.perf_counter() if metrics is not None else 0.0
             bot.on_event(data)
             self.request.sendall("200 OK".encode())
+            if metrics is not None:
+                metrics.frames.inc()
+                metrics.ack_seconds.observe(time.perf_counter() - start)
         except Exception:
+            if metrics is not None:
+                metrics.frame_errors.inc()
             logger.error(traceback.format_exc())
         finally:
             self.request.close()
 
 
-class Bot:
+class Bot(HandlerRegistry):
 
     def __init__(
         self,
@@ -46,7 +65,18 @@ class Bot:
         on_after_message: typing.Optional[typing.Callable[["Bot", Event], typing.Any]] = None,
         on_start: typing.Optional[typing.Callable[["Bot"], typing.Any]] = None,
         on_stop: typing.Optional[typing.Callable[["Bot"], typing.Any]] = None,
-        faked_version: typing.Optional[str] = None
+        faked_version: typing.Optional[str] = None,
+        transport: typing.Optional[HTTPTransport] = None,
+        dispatcher: typing.Optional[ShardedDispatcher] = None,
+        deduplicator: typing.Union[Deduplicator, bool, None] = None,
+        inject: bool = True,
+        remote_port: typing.Optional[int] = None,
+        server_port: typing.Optional[int] = None,
+        metrics: typing.Optional[Metrics] = None,
+        profiler: typing.Optional[HandlerProfiler] = None,
+        event_emitter: typing.Optional[pyee.EventEmitter] = None,
+        routes: typing.Optional[RouteIndex] = None,
+        shared: bool = False
     ):
         self.version = "3.9.5.81"
         self.server_host = "127.0.0.1"
@@ -57,37 +87,70 @@ class Bot:
         self.on_after_message = on_after_message
         self.on_stop = on_stop
         self.faked_version = faked_version
-        self.event_emitter = pyee.EventEmitter()
+        # 多个账号可共用同一个event_emitter，handler通过第一个参数区分是哪个Bot
+        self.event_emitter = event_emitter or pyee.EventEmitter()
+        self.routes = routes or RouteIndex()
+        self.registrations = {}
+        self.logged_in = False
+        self.login_lock = threading.Lock()
         self.wechat_manager = WeChatManager()
-        self.remote_port, self.server_port = self.wechat_manager.get_port()
+        # registered表示本实例在登记表中有条目，退出时只释放自己登记的端口
+        self.remote_port, self.server_port, self.registered = self.wechat_manager.resolve_ports(remote_port, server_port)
         self.BASE_URL = f"http://{self.remote_host}:{self.remote_port}"
+        self.transport = transport or HTTPTransport()
+        self.dispatcher = dispatcher
+        self.deduplicator = Deduplicator() if deduplicator is True else deduplicator or None
+        self.outbox: typing.Optional[Outbox] = None
+        self.commands: typing.Optional[CommandRouter] = None
+        self.media: typing.Optional[MediaFetcher] = None
+        self.directory = Directory(self)
+        self.schema = Schema(self)
         self.webhook_url = None
+        self.webhook_forwarder: typing.Optional[WebhookForwarder] = None
+        self.archive: typing.Optional[MessageArchive] = None
+        self.recorder: typing.Optional[EventRecorder] = None
+        self.server: typing.Optional[PooledTCPServer] = None
+        # 默认base64Img保持为str，enable_blobs之后较大的数据才包装为Blob
+        self.blob_min_size: typing.Optional[int] = None
+        self.blob_spill_size = BLOB_SPILL_SIZE
+        # 未启用时各处只做一次None判断，handler也不会被包装
+        self.metrics = metrics
+        self.profiler = profiler
+        # shared为True时transport/dispatcher/metrics/profiler由BotCluster注册指标和关闭
+        self.shared = shared
+        self.errors = 0
+        self.errors_lock = threading.Lock()
+        if metrics is not None and not shared:
+            metrics.gauge(
+                "wxhook_server_queue_depth",
+                "Frames waiting for a server worker",
+                lambda: self.server.stats()["queue_depth"] if self.server is not None else 0
+            )
+            metrics.gauge(
+                "wxhook_dispatch_queue_depth",
+                "Events waiting in dispatcher shards",
+                lambda: sum(shard["depth"] for shard in self.dispatcher.stats()) if self.dispatcher is not None else 0
+            )
         self.DATA_SAVE_PATH = None
         self.WXHELPER_PATH = None
         self.FILE_SAVE_PATH = None
         self.IMAGE_SAVE_PATH = None
         self.VIDEO_SAVE_PATH = None
 
-        try:
-            code, output = start_wechat_with_inject(self.remote_port)
-        except Exception:
-            code, output = get_pid(self.remote_port)
-
-        if code == 1:
-            raise Exception(output)
+        # inject为False时不启动/注入微信，直接连接remote_port上已运行的wxhelper(或测试替身)
+        self.process = open_wechat(self.remote_port) if inject else None
 
-        self.process = psutil.Process(int(output))
-
-        if self.faked_version is not None:
+        if self.faked_version is not None and self.process is not None:
             if fake_wechat_version(self.process.pid, self.version, faked_version) == 0:
                 logger.success(f"wechat version faked: {self.version} -> {faked_version}")
             else:
                 logger.error(f"wechat version fake failed.")
 
         logger.info(f"API Server at 0.0.0.0:{self.remote_port}")
-        self.wechat_manager.add(self.process.pid, self.remote_port, self.server_port)
+        if self.process is not None:
+            self.wechat_manager.add(self.process.pid, self.remote_port, self.server_port)
+            self.registered = True
         self.call_hook_func(self.on_start, self)
-        self.handle(ALL_MESSAGE, once=True)(self.init_bot)
         self.hook_sync_msg(self.server_host, self.server_port)
 
     @staticmethod
@@ -95,6 +158,13 @@ class Bot:
         if callable(func):
             return func(*args, **kwargs)
 
+    def login(self, event: Event) -> None:
+        with self.login_lock:
+            if self.logged_in:
+                return
+            self.logged_in = True
+        self.init_bot(self, event)
+
     def init_bot(self, bot: "Bot", event: Event) -> None:
         self.DATA_SAVE_PATH = bot.info.dataSavePath
         self.WXHELPER_PATH = os.path.join(self.DATA_SAVE_PATH, "wxhelper")
@@ -103,18 +173,65 @@ class Bot:
         self.VIDEO_SAVE_PATH = os.path.join(self.WXHELPER_PATH, "video")
         self.call_hook_func(self.on_login, bot, event)
 
-    def set_webhook_url(self, webhook_url: str) -> None:
+    def enable_outbox(self, **kwargs) -> Outbox:
+        """启用限速发送队列，参数见Outbox"""
+        if self.outbox is None:
+            self.outbox = Outbox(self, **kwargs)
+        return self.outbox
+
+    def enable_media(self, **kwargs) -> MediaFetcher:
+        """启用媒体获取流水线，参数见MediaFetcher"""
+        if self.media is None:
+            self.media = MediaFetcher(self, **kwargs)
+        return self.media
+
+    def enable_blobs(self, min_size: int = BLOB_MIN_SIZE, spill_size: int = BLOB_SPILL_SIZE) -> None:
+        """较大的base64Img不再解码为str，而是包装为按需解码的Blob，参数见loads_event"""
+        self.blob_min_size = min_size
+        self.blob_spill_size = spill_size
+
+    def command(self, name: str, aliases: typing.Iterable[str] = (), **kwargs) -> typing.Callable[[typing.Callable], typing.Callable]:
+        """注册文本命令，例如 @bot.command("/weather", cooldown=10)，参数见CommandRouter.command"""
+        if self.commands is None:
+            self.commands = CommandRouter(self)
+        return self.commands.command(name, aliases, **kwargs)
+
+    def set_archive(self, path: str, **kwargs) -> MessageArchive:
+        """启用本地消息归档，参数见MessageArchive"""
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = MessageArchive(path, **kwargs)
+        return self.archive
+
+    def set_recorder(self, path: str, **kwargs) -> EventRecorder:
+        """录制收到的原始消息，可用EventReplayer重放，参数见EventRecorder"""
+        recorder, self.recorder = self.recorder, EventRecorder(path, **kwargs)
+        if recorder is not None:
+            recorder.close()
+        return self.recorder
+
+    def set_webhook_url(self, webhook_url: str, **kwargs) -> None:
+        """设置消息回调地址，事件由后台线程批量转发，参数见WebhookForwarder"""
+        if self.webhook_forwarder is not None:
+            self.webhook_forwarder.close()
         self.webhook_url = webhook_url
+        self.webhook_forwarder = WebhookForwarder(webhook_url, **kwargs)
 
     def webhook(self, event: dict) -> None:
-        if self.webhook_url is not None:
-            try:
-                requests.post(self.webhook_url, json=event)
-            except Exception:
-                pass
+        if self.webhook_forwarder is not None:
+            self.webhook_forwarder.put(event)
 
     def call_api(self, api: str, *args, **kwargs) -> dict:
-        return requests.request("POST", self.BASE_URL + api, *args, **kwargs).json()
+        if self.metrics is None:
+            return self.transport.request(self.BASE_URL, api, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return self.transport.request(self.BASE_URL, api, *args, **kwargs)
+        except Exception:
+            self.metrics.api_errors.inc(api)
+            raise
+        finally:
+            self.metrics.api_seconds.observe(time.perf_counter() - start, api)
 
     def hook_sync_msg(
         self,
@@ -132,28 +249,28 @@ class Bot:
             "url": url,
             "timeout": timeout
         }
-        return Response(**self.call_api("/api/hookSyncMsg", json=data))
+        return Response.from_dict(self.call_api("/api/hookSyncMsg", json=data))
 
     def unhook_sync_msg(self) -> Response:
         """取消hook同步消息"""
-        return Response(**self.call_api("/api/unhookSyncMsg"))
+        return Response.from_dict(self.call_api("/api/unhookSyncMsg"))
 
     def hook_log(self) -> Response:
         """hook日志"""
-        return Response(**self.call_api("/api/hookLog"))
+        return Response.from_dict(self.call_api("/api/hookLog"))
 
     def unhook_log(self) -> Response:
         """取消hook日志"""
-        return Response(**self.call_api("/api/unhookLog"))
+        return Response.from_dict(self.call_api("/api/unhookLog"))
 
     def check_login(self) -> Response:
         """检查登录状态"""
-        return Response(**self.call_api("/api/checkLogin"))
+        return Response.from_dict(self.call_api("/api/checkLogin"))
 
     @lru_cache
     def get_self_info(self) -> Account:
         """获取用户信息"""
-        return Account(**self.call_api("/api/userInfo")["data"])
+        return Account.from_dict(self.call_api("/api/userInfo")["data"])
 
     def send_text(self, wxid: str, msg: str) -> Response:
         """发送文本消息"""
@@ -161,7 +278,7 @@ class Bot:
             "wxid": wxid,
             "msg": msg
         }
-        return Response(**self.call_api("/api/sendTextMsg", json=data))
+        return Response.from_dict(self.call_api("/api/sendTextMsg", json=data))
 
     def send_image(self, wxid: str, image_path: str) -> Response:
         """发送图片消息"""
@@ -169,7 +286,7 @@ class Bot:
             "wxid": wxid,
             "imagePath": image_path
         }
-        return Response(**self.call_api("/api/sendImagesMsg", json=data))
+        return Response.from_dict(self.call_api("/api/sendImagesMsg", json=data))
 
     def send_emotion(self, wxid: str, file_path: str) -> Response:
         """发送表情消息"""
@@ -177,7 +294,7 @@ class Bot:
             "wxid": wxid,
             "filePath": file_path
         }
-        return Response(**self.call_api("/api/sendCustomEmotion", json=data))
+        return Response.from_dict(self.call_api("/api/sendCustomEmotion", json=data))
 
     def send_file(self, wxid: str, file_path: str) -> Response:
         """发送文件消息"""
@@ -185,7 +302,7 @@ class Bot:
             "wxid": wxid,
             "filePath": file_path
         }
-        return Response(**self.call_api("/api/sendFileMsg", json=data))
+        return Response.from_dict(self.call_api("/api/sendFileMsg", json=data))
 
     def send_applet(
         self,
@@ -209,7 +326,7 @@ class Bot:
             "mainImg": main_img,
             "indexPage": index_page
         }
-        return Response(**self.call_api("/api/sendApplet", json=data))
+        return Response.from_dict(self.call_api("/api/sendApplet", json=data))
 
     def send_room_at(self, room_id: str, wxids: typing.List[str], msg: str) -> Response:
         """发送群@消息"""
@@ -218,7 +335,7 @@ class Bot:
             "wxids": ",".join(wxids),
             "msg": msg
         }
-        return Response(**self.call_api("/api/sendAtText", json=data))
+        return Response.from_dict(self.call_api("/api/sendAtText", json=data))
 
     def send_pat(self, room_id: str, wxid: str) -> Response:
         """发送拍一拍消息"""
@@ -226,46 +343,73 @@ class Bot:
             "receiver": room_id,
             "wxid": wxid
         }
-        return Response(**self.call_api("/api/sendPatMsg", json=data))
+        return Response.from_dict(self.call_api("/api/sendPatMsg", json=data))
 
-    def get_contacts(self) -> typing.List[Contact]:
-        """获取联系人列表"""
-        return [Contact(**item) for item in self.call_api("/api/getContactList")["data"]]
+    def send_many(
+        self,
+        kind: str,
+        targets: typing.Iterable[str],
+        payload: typing.Any,
+        concurrency: int = 4,
+        interval: float = 0.0,
+        checkpoint: typing.Optional[str] = None,
+        progress: typing.Optional[typing.Callable[[int, int, SendResult], typing.Any]] = None,
+        cancel: typing.Optional[threading.Event] = None
+    ) -> typing.List[SendResult]:
+        """批量发送消息，kind对应send_<kind>方法，payload为接收者之后的参数"""
+        return BulkSender(
+            self,
+            kind,
+            targets,
+            payload,
+            concurrency=concurrency,
+            interval=interval,
+            checkpoint=checkpoint,
+            progress=progress,
+            cancel=cancel
+        ).run()
+
+    def get_contacts(self, columnar: bool = False) -> typing.Union[typing.List[Contact], Columns]:
+        """获取联系人列表，columnar为True时返回列式存储的Columns"""
+        items = self.call_api("/api/getContactList")["data"]
+        if columnar:
+            return Columns(Contact, items)
+        return [Contact.from_dict(item) for item in items]
 
     def get_contact(self, wxid: str) -> ContactDetail:
         """获取联系人详情"""
         data = {
             "wxid": wxid
         }
-        return ContactDetail(**self.call_api("/api/getContactProfile", json=data)["data"])
+        return ContactDetail.from_dict(self.call_api("/api/getContactProfile", json=data)["data"])
 
     def create_room(self, member_ids: typing.List[str]) -> Response:
         """创建群聊"""
         data = {
             "memberIds": ",".join(member_ids)
         }
-        return Response(**self.call_api("/api/createChatRoom", json=data))
+        return Response.from_dict(self.call_api("/api/createChatRoom", json=data))
 
     def quit_room(self, room_id: str) -> Response:
         """退出群聊"""
         data = {
             "chatRoomId": room_id
         }
-        return Response(**self.call_api("/api/quitChatRoom", json=data))
+        return Response.from_dict(self.call_api("/api/quitChatRoom", json=data))
 
     def get_room(self, room_id: str) -> Room:
         """获取群详情"""
         data = {
             "chatRoomId": room_id
         }
-        return Room(**self.call_api("/api/getChatRoomDetailInfo", json=data)["data"])
+        return Room.from_dict(self.call_api("/api/getChatRoomDetailInfo", json=data)["data"])
 
     def get_room_members(self, room_id: str) -> RoomMembers:
         """获取群成员列表"""
         data = {
             "chatRoomId": room_id
         }
-        return RoomMembers(**self.call_api("/api/getMemberFromChatRoom", json=data)["data"])
+        return RoomMembers.from_dict(self.call_api("/api/getMemberFromChatRoom", json=data)["data"])
 
     def add_room_member(self, room_id: str, member_ids: typing.List[str]) -> Response:
         """添加群成员"""
@@ -273,7 +417,7 @@ class Bot:
             "chatRoomId": room_id,
             "memberIds": ",".join(member_ids)
         }
-        return Response(**self.call_api("/api/addMemberToChatRoom", json=data))
+        return Response.from_dict(self.call_api("/api/addMemberToChatRoom", json=data))
 
     def delete_room_member(self, room_id: str, member_ids: typing.List[str]) -> Response:
         """删除群成员"""
@@ -281,7 +425,7 @@ class Bot:
             "chatRoomId": room_id,
             "memberIds": ",".join(member_ids)
         }
-        return Response(**self.call_api("/api/delMemberFromChatRoom", json=data))
+        return Response.from_dict(self.call_api("/api/delMemberFromChatRoom", json=data))
 
     def invite_room_member(self, room_id: str, member_ids: typing.List[str]) -> Response:
         """邀请群成员"""
@@ -289,7 +433,7 @@ class Bot:
             "chatRoomId": room_id,
             "memberIds": ",".join(member_ids)
         }
-        return Response(**self.call_api("/api/InviteMemberToChatRoom", json=data))
+        return Response.from_dict(self.call_api("/api/InviteMemberToChatRoom", json=data))
 
     def modify_member_nickname(self, room_id: str, wxid: str, nickname: str) -> Response:
         """修改群成员昵称"""
@@ -298,14 +442,14 @@ class Bot:
             "wxid": wxid,
             "nickName": nickname
         }
-        return Response(**self.call_api("/api/modifyNickname", json=data))
+        return Response.from_dict(self.call_api("/api/modifyNickname", json=data))
 
     def top_msg(self, msg_id: int) -> Response:
         """设置群置顶消息"""
         data = {
             "msgId": msg_id
         }
-        return Response(**self.call_api("/api/topMsg", json=data))
+        return Response.from_dict(self.call_api("/api/topMsg", json=data))
 
     def remove_top_msg(self, room_id: str, msg_id: int) -> Response:
         """移除群置顶消息"""
@@ -313,7 +457,7 @@ class Bot:
             "chatRoomId": room_id,
             "msgId": msg_id
         }
-        return Response(**self.call_api("/api/removeTopMsg", json=data))
+        return Response.from_dict(self.call_api("/api/removeTopMsg", json=data))
 
     def forward_msg(self, msg_id: int, wxid: str) -> Response:
         """转发消息"""
@@ -321,25 +465,36 @@ class Bot:
             "msgId": msg_id,
             "wxid": wxid
         }
-        return Response(**self.call_api("/api/forwardMsg", json=data))
+        return Response.from_dict(self.call_api("/api/forwardMsg", json=data))
 
     def get_sns_first_page(self) -> Response:
         """获取朋友圈首页"""
-        return Response(**self.call_api("/api/getSNSFirstPage"))
+        return Response.from_dict(self.call_api("/api/getSNSFirstPage"))
 
     def get_sns_next_page(self, sns_id: int) -> Response:
         """获取朋友圈下一页"""
         data = {
             "snsId": sns_id
         }
-        return Response(**self.call_api("/api/getSNSNextPage", json=data))
+        return Response.from_dict(self.call_api("/api/getSNSNextPage", json=data))
+
+    def iter_sns(
+        self,
+        limit: typing.Optional[int] = None,
+        since: typing.Optional[int] = None,
+        since_id: typing.Optional[int] = None,
+        timeout: float = 30.0,
+        prefetch: bool = True
+    ) -> typing.Iterator[SnsItem]:
+        """按从新到旧遍历朋友圈，since/since_id为createTime/snsId水位线，遇到不晚于水位线的动态即停止"""
+        return iter(SnsPager(self, limit=limit, since=since, since_id=since_id, timeout=timeout, prefetch=prefetch))
 
     def collect_msg(self, msg_id: int) -> Response:
         """收藏消息"""
         data = {
             "msgId": msg_id
         }
-        return Response(**self.call_api("/api/addFavFromMsg", json=data))
+        return Response.from_dict(self.call_api("/api/addFavFromMsg", json=data))
 
     def collect_image(self, wxid: str, image_path: str) -> Response:
         """收藏图片"""
@@ -347,14 +502,14 @@ class Bot:
             "wxid": wxid,
             "imagePath": image_path
         }
-        return Response(**self.call_api("/api/addFavFromImage", json=data))
+        return Response.from_dict(self.call_api("/api/addFavFromImage", json=data))
 
     def download_attachment(self, msg_id: int) -> Response:
         """下载附件"""
         data = {
             "msgId": msg_id
         }
-        return Response(**self.call_api("/api/downloadAttach", json=data))
+        return Response.from_dict(self.call_api("/api/downloadAttach", json=data))
 
     def forward_public_msg(
         self,
@@ -376,7 +531,7 @@ class Bot:
             "thumbUrl": thumb_url,
             "digest": digest,
         }
-        return Response(**self.call_api("/api/forwardPublicMsg", json=data))
+        return Response.from_dict(self.call_api("/api/forwardPublicMsg", json=data))
 
     def forward_public_msg_by_msg_id(self, wxid: str, msg_id: int) -> Response:
         """转发公众号消息通过消息ID"""
@@ -384,7 +539,7 @@ class Bot:
             "wxid": wxid,
             "msg_id": msg_id
         }
-        return Response(**self.call_api("/api/forwardPublicMsgByMsgId", json=data))
+        return Response.from_dict(self.call_api("/api/forwardPublicMsgByMsgId", json=data))
 
     def decode_image(self, file_path: str, store_dir: str) -> Response:
         """解码图片"""
@@ -392,7 +547,7 @@ class Bot:
             "filePath": file_path,
             "storeDir": store_dir
         }
-        return Response(**self.call_api("/api/decodeImage", json=data))
+        return Response.from_dict(self.call_api("/api/decodeImage", json=data))
 
     def get_voice_by_msg_id(self, msg_id: int, store_dir: str) -> Response:
         """获取语音通过消息ID"""
@@ -400,20 +555,20 @@ class Bot:
             "msgId": msg_id,
             "storeDir": store_dir
         }
-        return Response(**self.call_api("/api/getVoiceByMsgId", json=data))
+        return Response.from_dict(self.call_api("/api/getVoiceByMsgId", json=data))
 
     def ocr(self, image_path: str) -> Response:
         """图片文本识别"""
         data = {
             "imagePath": image_path
         }
-        return Response(**self.call_api("/api/ocr", json=data))
+        return Response.from_dict(self.call_api("/api/ocr", json=data))
 
     def get_db_info(self) -> typing.List[DB]:
         """获取数据库句柄"""
         return [
             DB(databaseName=item["databaseName"], handle=item["handle"], tables=[
-                Table(**sub_item)
+                Table.from_dict(sub_item)
                 for sub_item in item["tables"]
             ])
             for item in self.call_api("/api/getDBInfo")
@@ -425,50 +580,140 @@ class Bot:
             "dbHandle": db_handle,
             "sql": sql
         }
-        return Response(**self.call_api("/api/execSql", json=data))
+        return Response.from_dict(self.call_api("/api/execSql", json=data))
+
+    def query(
+        self,
+        db_handle: typing.Optional[int],
+        sql: str,
+        batch_size: int = 500,
+        key: str = "rowid",
+        typed: bool = True
+    ) -> Cursor:
+        """分页执行SELECT，返回逐行产出元组的游标，db_handle为None时根据表名从缓存的库结构中查找"""
+        return Cursor(self, db_handle, sql, batch_size=batch_size, key=key, typed=typed)
 
     def test(self) -> Response:
         """测试"""
-        return Response(**self.call_api("/api/test"))
+        return Response.from_dict(self.call_api("/api/test"))
 
     @property
     def info(self) -> Account:
         return self.get_self_info()
 
+    def count_error(self) -> None:
+        with self.errors_lock:
+            self.errors += 1
+        if self.metrics is not None:
+            self.metrics.event_errors.inc()
+
     def on_event(self, raw_data: bytes) -> None:
+        recorder = self.recorder
+        if recorder is not None:
+            try:
+                recorder.record(raw_data)
+            except Exception as e:
+                logger.error(f"record event failed: {e}")
         try:
-            data = json.loads(raw_data)
-            event = Event(**parse_event(data))
+            data = loads_event(raw_data, self.blob_min_size, self.blob_spill_size)
+        except Exception:
+            self.count_error()
+            logger.error(traceback.format_exc())
+            logger.error(raw_data)
+            return
+        self.process_event(data)
+
+    def process_event(self, data: dict) -> None:
+        try:
+            event = Event.from_dict(data)
+            if self.deduplicator is not None and self.deduplicator.seen(event):
+                logger.debug(f"duplicate event suppressed: {event.msgId}")
+                return
             logger.debug(event)
+            if self.metrics is not None:
+                self.metrics.events.inc(event.type)
+        except Exception:
+            self.count_error()
+            logger.error(traceback.format_exc())
+            logger.error(data)
+            return
+        try:
+            if self.dispatcher is not None:
+                # 共用分发器时按账号区分会话，不同账号同一联系人的事件互不阻塞
+                key = f"{self.server_port}:{event.fromUser}" if self.shared else event.fromUser
+                on_drop = self.forget_event if self.deduplicator is not None else None
+                self.dispatcher.submit(key, self.dispatch_event, event, data, on_drop=on_drop)
+            else:
+                self.dispatch_event(event, data)
+        except Exception:
+            self.forget_event(event, data)
+            self.count_error()
+            logger.error(traceback.format_exc())
+            logger.error(data)
+
+    def forget_event(self, event: Event, data: dict) -> None:
+        """事件没有进入分发时撤销去重记录，wxhelper重推时仍会处理"""
+        if self.deduplicator is not None:
+            self.deduplicator.forget(event)
+
+    def dispatch_event(self, event: Event, data: dict) -> None:
+        try:
+            self.directory.on_event(event)
+            if self.archive is not None:
+                self.archive.put(event)
             self.call_hook_func(self.on_before_message, self, event)
+            if not self.logged_in:
+                self.login(event)
             self.event_emitter.emit(str(ALL_MESSAGE), self, event)
             self.event_emitter.emit(str(event.type), self, event)
+            if self.routes.tables:
+                self.routes.dispatch(self, (str(ALL_MESSAGE), str(event.type)), event)
             self.call_hook_func(self.on_after_message, self, event)
             self.webhook(data)
         except Exception:
+            self.count_error()
             logger.error(traceback.format_exc())
-            logger.error(raw_data)
-
-    def handle(self, events: typing.Union[typing.List[str], str, None] = None, once: bool = False) -> typing.Callable[[typing.Callable], None]:
-        def wrapper(func):
-            listen = self.event_emitter.on if not once else self.event_emitter.once
-            if not events:
-                listen(str(ALL_MESSAGE), func)
-            else:
-                for event in events if isinstance(events, list) else [events]:
-                    listen(str(event), func)
-
-        return wrapper
+            logger.error(event)
 
     def exit(self) -> None:
         self.call_hook_func(self.on_stop, self)
-        self.process.terminate()
-
-    def run(self) -> None:
+        if self.server is not None:
+            self.server.server_close()
+        if self.dispatcher is not None and not self.shared:
+            self.dispatcher.close()
+        if self.outbox is not None:
+            self.outbox.close(timeout=5)
+        if self.media is not None:
+            self.media.close(wait=False)
+        if self.webhook_forwarder is not None:
+            self.webhook_forwarder.close(timeout=5)
+        if self.archive is not None:
+            self.archive.close(timeout=5)
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+        if not self.shared:
+            if self.metrics is not None:
+                self.metrics.close()
+            if self.profiler is not None:
+                self.profiler.close()
+            self.transport.close()
+        if self.process is not None:
+            self.process.terminate()
+        if self.registered:
+            self.wechat_manager.release(self.remote_port)
+
+    def run(self, workers: int = 16, queue_size: int = 1024, overflow: str = OVERFLOW_BLOCK) -> None:
         try:
-            server = socketserver.ThreadingTCPServer((self.server_host, self.server_port), RequestHandler)
-            server.bot = self
+            self.server = PooledTCPServer(
+                (self.server_host, self.server_port),
+                RequestHandler,
+                workers=workers,
+                queue_size=queue_size,
+                overflow=overflow
+            )
+            self.server.bot = self
             logger.info(f"Listening Server at {self.server_host}:{self.server_port}")
-            server.serve_forever()
+            self.server.serve_forever()
         except (KeyboardInterrupt, SystemExit):
             self.exit()
@@ -0,0 +1,122 @@
+import math
+import time
+import typing
+import hashlib
+import threading
+import collections
+
+from .model import Event
+
+
+class BloomFilter:
+    """固定大小的布隆过滤器"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str) -> typing.Iterator[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for index in range(self.hashes):
+            yield (h1 + index * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class Deduplicator:
+    """按msgId去重(无msgId时依次使用msgSequence、内容哈希)，内存占用固定"""
+
+    def __init__(
+        self,
+        capacity: int = 10000,
+        window: typing.Optional[float] = None,
+        bloom: bool = False,
+        bloom_capacity: int = 1000000,
+        error_rate: float = 0.001
+    ):
+        self.capacity = capacity
+        self.window = window
+        self.lock = threading.Lock()
+        self.recent: typing.OrderedDict[str, float] = collections.OrderedDict()
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        # 两个过滤器轮换，当前过滤器写满后丢弃较旧的一个，保证内存不随运行时间增长；
+        # 键从recent淘汰时才写入过滤器，仍在recent中的键可以被forget撤销
+        self.blooms = [BloomFilter(bloom_capacity, error_rate), BloomFilter(bloom_capacity, error_rate)] if bloom else None
+        self.checked = 0
+        self.suppressed = 0
+
+    @staticmethod
+    def key(event: Event) -> typing.Optional[str]:
+        if event.msgId:
+            return f"id:{event.msgId}"
+        if event.msgSequence:
+            return f"seq:{event.fromUser}:{event.msgSequence}"
+        content = event.raw("content")
+        if content is None and event.createTime is None:
+            return None
+        digest = hashlib.blake2b(
+            repr((event.type, event.fromUser, event.toUser, event.createTime, content, event.raw("signature"))).encode("utf-8"),
+            digest_size=16
+        )
+        return f"hash:{digest.hexdigest()}"
+
+    def remember(self, key: str) -> None:
+        if self.blooms is None:
+            return
+        if self.blooms[0].count >= self.bloom_capacity:
+            self.blooms = [BloomFilter(self.bloom_capacity, self.error_rate), self.blooms[0]]
+        self.blooms[0].add(key)
+
+    def expire(self, now: float) -> None:
+        while self.recent and len(self.recent) > self.capacity:
+            key, _ = self.recent.popitem(last=False)
+            self.remember(key)
+        if self.window is not None:
+            while self.recent:
+                key, seen_at = next(iter(self.recent.items()))
+                if now - seen_at <= self.window:
+                    break
+                del self.recent[key]
+                self.remember(key)
+
+    def seen(self, event: Event) -> bool:
+        """事件是否已处理过，未处理过的事件会被记录"""
+        key = self.key(event)
+        if key is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.checked += 1
+            self.expire(now)
+            duplicate = key in self.recent
+            if not duplicate and self.blooms is not None:
+                duplicate = key in self.blooms[0] or key in self.blooms[1]
+            if duplicate:
+                self.suppressed += 1
+                return True
+            self.recent[key] = now
+            return False
+
+    def forget(self, event: Event) -> None:
+        """撤销seen对事件的记录，用于事件未能进入分发(如被分发器丢弃)时，重推的同一事件不会被当作重复"""
+        key = self.key(event)
+        if key is None:
+            return
+        with self.lock:
+            self.recent.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"checked": self.checked, "suppressed": self.suppressed, "size": len(self.recent)}
@@ -0,0 +1,178 @@
+import time
+import typing
+import threading
+import collections
+
+from .events import NOTICE_MESSAGE, SYSTEM_MESSAGE
+from .model import Event, Contact, ContactDetail, Room, RoomMembers
+
+_MISSING = object()
+
+# 群成员ID分隔符
+MEMBER_SEPARATOR = "^G"
+
+
+def is_room(wxid: typing.Optional[str]) -> bool:
+    return bool(wxid) and wxid.endswith("@chatroom")
+
+
+class TTLCache:
+    """带过期时间和容量上限的LRU缓存"""
+
+    def __init__(self, maxsize: int, ttl: float, on_evict: typing.Optional[typing.Callable[[str], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.data: typing.OrderedDict[str, typing.Tuple[float, typing.Any]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> typing.Any:
+        item = self.data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                self.pop(key)
+            self.misses += 1
+            return _MISSING
+        self.data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: str, value: typing.Any) -> None:
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            evicted, _ = self.data.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def pop(self, key: str) -> None:
+        if self.data.pop(key, None) is not None and self.on_evict is not None:
+            self.on_evict(key)
+
+    def clear(self) -> None:
+        for key in list(self.data):
+            self.pop(key)
+
+    def stats(self) -> dict:
+        return {"size": len(self.data), "hits": self.hits, "misses": self.misses}
+
+
+class Directory:
+    """联系人、群聊及群成员的缓存目录，按wxid和群ID索引，收到通知/系统消息时自动失效"""
+
+    def __init__(self, bot, ttl: float = 600, maxsize: int = 10000, room_maxsize: int = 2000):
+        self.bot = bot
+        self.lock = threading.RLock()
+        self.contacts = TTLCache(maxsize, ttl)
+        self.contact_list = TTLCache(1, ttl)
+        self.rooms = TTLCache(room_maxsize, ttl)
+        self.members = TTLCache(room_maxsize, ttl, on_evict=self.unindex_room)
+        self.room_index: typing.Dict[str, typing.FrozenSet[str]] = {}
+        self.member_index: typing.Dict[str, typing.Set[str]] = collections.defaultdict(set)
+
+    def index_room(self, room_id: str, members: RoomMembers) -> None:
+        self.unindex_room(room_id)
+        member_ids = frozenset(wxid for wxid in (members.members or "").split(MEMBER_SEPARATOR) if wxid)
+        self.room_index[room_id] = member_ids
+        for wxid in member_ids:
+            self.member_index[wxid].add(room_id)
+
+    def unindex_room(self, room_id: str) -> None:
+        for wxid in self.room_index.pop(room_id, ()):
+            rooms = self.member_index.get(wxid)
+            if rooms is not None:
+                rooms.discard(room_id)
+                if not rooms:
+                    del self.member_index[wxid]
+
+    def get_contacts(self) -> typing.List[Contact]:
+        """获取联系人列表(缓存)"""
+        with self.lock:
+            contacts = self.contact_list.get("")
+        if contacts is _MISSING:
+            contacts = self.bot.get_contacts()
+            with self.lock:
+                self.contact_list.set("", contacts)
+        return contacts
+
+    def get_contact(self, wxid: str) -> ContactDetail:
+        """获取联系人详情(缓存)"""
+        with self.lock:
+            contact = self.contacts.get(wxid)
+        if contact is _MISSING:
+            contact = self.bot.get_contact(wxid)
+            with self.lock:
+                self.contacts.set(wxid, contact)
+        return contact
+
+    def get_room(self, room_id: str) -> Room:
+        """获取群详情(缓存)"""
+        with self.lock:
+            room = self.rooms.get(room_id)
+        if room is _MISSING:
+            room = self.bot.get_room(room_id)
+            with self.lock:
+                self.rooms.set(room_id, room)
+        return room
+
+    def get_room_members(self, room_id: str) -> RoomMembers:
+        """获取群成员列表(缓存)"""
+        with self.lock:
+            members = self.members.get(room_id)
+        if members is _MISSING:
+            members = self.bot.get_room_members(room_id)
+            with self.lock:
+                self.members.set(room_id, members)
+                self.index_room(room_id, members)
+        return members
+
+    def get_room_member_ids(self, room_id: str) -> typing.FrozenSet[str]:
+        """获取群成员wxid集合"""
+        self.get_room_members(room_id)
+        with self.lock:
+            return self.room_index.get(room_id, frozenset())
+
+    def is_room_member(self, room_id: str, wxid: str) -> bool:
+        return wxid in self.get_room_member_ids(room_id)
+
+    def get_member_rooms(self, wxid: str) -> typing.Set[str]:
+        """已缓存的群中包含该成员的群ID"""
+        with self.lock:
+            return set(self.member_index.get(wxid, ()))
+
+    def invalidate_room(self, room_id: str) -> None:
+        with self.lock:
+            self.rooms.pop(room_id)
+            self.members.pop(room_id)
+
+    def invalidate_contact(self, wxid: str) -> None:
+        with self.lock:
+            self.contacts.pop(wxid)
+            self.contact_list.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.contacts.clear()
+            self.contact_list.clear()
+            self.rooms.clear()
+            self.members.clear()
+
+    def on_event(self, event: Event) -> None:
+        """入群、退群、改名等通知/系统消息使对应缓存失效"""
+        if event.type not in (NOTICE_MESSAGE, SYSTEM_MESSAGE) or not event.fromUser:
+            return
+        if is_room(event.fromUser):
+            self.invalidate_room(event.fromUser)
+        else:
+            self.invalidate_contact(event.fromUser)
+
+    def stats(self) -> dict:
+        """各缓存的大小与命中/未命中次数"""
+        with self.lock:
+            return {
+                "contacts": self.contacts.stats(),
+                "contact_list": self.contact_list.stats(),
+                "rooms": self.rooms.stats(),
+                "room_members": self.members.stats(),
+            }
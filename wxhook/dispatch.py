@@ -0,0 +1,169 @@
+import zlib
+import typing
+import threading
+import traceback
+import collections
+
+from .logger import logger
+from .server import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST
+
+
+class Shard:
+
+    def __init__(self, index: int):
+        self.index = index
+        self.condition = threading.Condition()
+        # 有待处理事件的会话，按轮转顺序排列，每个会话一个队列
+        self.pending: typing.OrderedDict[typing.Optional[str], collections.deque] = collections.OrderedDict()
+        self.depth = 0
+        self.closed = False
+        self.processed = 0
+        self.dropped = 0
+        self.keys: typing.Counter[str] = collections.Counter()
+
+
+class ShardedDispatcher:
+    """按会话分片的事件分发器，同一会话内的事件顺序执行，不同会话并行执行，同一分片内的会话轮流执行"""
+
+    def __init__(
+        self,
+        shards: int = 8,
+        queue_size: int = 1024,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+        max_tracked_keys: int = 1024,
+        max_pending: int = 256
+    ):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        if queue_size < 1 or max_pending < 1:
+            raise ValueError("queue_size and max_pending must be at least 1")
+        self.overflow = overflow
+        self.queue_size = queue_size
+        self.max_pending = max_pending
+        self.max_tracked_keys = max_tracked_keys
+        self.shards = [Shard(index) for index in range(shards)]
+        self.threads = []
+        for shard in self.shards:
+            thread = threading.Thread(target=self.worker, args=(shard,), name=f"wxhook-shard-{shard.index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def shard_of(self, key: typing.Optional[str]) -> Shard:
+        return self.shards[zlib.crc32((key or "").encode("utf-8")) % len(self.shards)]
+
+    @staticmethod
+    def drop(shard: Shard, key: typing.Optional[str]) -> None:
+        pending = shard.pending[key]
+        _, args, on_drop = pending.popleft()
+        if not pending:
+            del shard.pending[key]
+        shard.depth -= 1
+        shard.dropped += 1
+        if on_drop is not None:
+            try:
+                on_drop(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def submit(
+        self,
+        key: typing.Optional[str],
+        func: typing.Callable,
+        *args,
+        on_drop: typing.Optional[typing.Callable] = None
+    ) -> None:
+        """提交事件，会话积压达到max_pending或分片积压达到queue_size时，drop_oldest丢弃该会话(分片满时为积压最多的会话)最早的事件并以相同参数调用其on_drop，block等待积压减少"""
+        shard = self.shard_of(key)
+        with shard.condition:
+            if shard.closed:
+                raise RuntimeError("dispatcher is closed")
+            shard.keys[key] += 1
+            if len(shard.keys) > self.max_tracked_keys:
+                shard.keys = collections.Counter(dict(shard.keys.most_common(self.max_tracked_keys // 2)))
+            if self.overflow == OVERFLOW_BLOCK:
+                while len(shard.pending.get(key, ())) >= self.max_pending or shard.depth >= self.queue_size:
+                    shard.condition.wait()
+                    # 等待期间分发器被关闭时不再入队，避免调用方一直阻塞
+                    if shard.closed:
+                        raise RuntimeError("dispatcher is closed")
+            else:
+                if len(shard.pending.get(key, ())) >= self.max_pending:
+                    self.drop(shard, key)
+                if shard.depth >= self.queue_size:
+                    self.drop(shard, max(shard.pending, key=lambda pending_key: len(shard.pending[pending_key])))
+            pending = shard.pending.get(key)
+            if pending is None:
+                pending = shard.pending[key] = collections.deque()
+            pending.append((func, args, on_drop))
+            shard.depth += 1
+            shard.condition.notify_all()
+
+    def worker(self, shard: Shard) -> None:
+        while True:
+            with shard.condition:
+                while not shard.pending and not shard.closed:
+                    shard.condition.wait()
+                if not shard.pending:
+                    break
+                key, pending = next(iter(shard.pending.items()))
+                func, args, _ = pending.popleft()
+                if pending:
+                    shard.pending.move_to_end(key)
+                else:
+                    del shard.pending[key]
+                shard.depth -= 1
+                shard.condition.notify_all()
+            try:
+                func(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+            finally:
+                with shard.condition:
+                    shard.processed += 1
+
+    def stats(self) -> typing.List[dict]:
+        """各分片的队列深度、积压会话数、处理数、丢弃数"""
+        stats = []
+        for shard in self.shards:
+            with shard.condition:
+                stats.append({
+                    "shard": shard.index,
+                    "depth": shard.depth,
+                    "conversations": len(shard.pending),
+                    "processed": shard.processed,
+                    "dropped": shard.dropped,
+                })
+        return stats
+
+    def depths(self, group: typing.Callable[[typing.Optional[str]], typing.Any]) -> typing.Dict[typing.Any, int]:
+        """按group(会话key)汇总各分片的积压事件数，例如集群中按账号统计"""
+        depths: typing.Dict[typing.Any, int] = {}
+        for shard in self.shards:
+            with shard.condition:
+                for key, pending in shard.pending.items():
+                    name = group(key)
+                    depths[name] = depths.get(name, 0) + len(pending)
+        return depths
+
+    def hot_shards(self, top: int = 3, keys: int = 3) -> typing.List[dict]:
+        """按队列深度排序的热点分片，附带该分片中消息最多的会话"""
+        shards = sorted(self.shards, key=lambda shard: (shard.depth, shard.processed), reverse=True)[:top]
+        hot = []
+        for shard in shards:
+            with shard.condition:
+                hot.append({
+                    "shard": shard.index,
+                    "depth": shard.depth,
+                    "processed": shard.processed,
+                    "dropped": shard.dropped,
+                    "hot_keys": shard.keys.most_common(keys),
+                })
+        return hot
+
+    def close(self) -> None:
+        for shard in self.shards:
+            with shard.condition:
+                shard.closed = True
+                shard.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
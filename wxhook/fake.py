@@ -0,0 +1,201 @@
+import json
+import time
+import socket
+import typing
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SUCCESS = {"code": 1, "msg": "success", "data": {}}
+
+
+def default_responses(contacts: int = 100) -> typing.Dict[str, typing.Any]:
+    return {
+        "/api/checkLogin": {"code": 1, "msg": "success", "data": {}},
+        "/api/userInfo": {
+            "code": 1,
+            "msg": "success",
+            "data": {
+                "account": "fake_account",
+                "city": "",
+                "country": "CN",
+                "currentDataPath": tempfile.gettempdir(),
+                "dataSavePath": tempfile.gettempdir(),
+                "dbKey": "",
+                "headImage": "",
+                "mobile": "",
+                "name": "fake",
+                "province": "",
+                "signature": "",
+                "wxid": "wxid_fake",
+            },
+        },
+        "/api/getContactList": {
+            "code": 1,
+            "msg": "success",
+            "data": [
+                {
+                    "customAccount": "",
+                    "encryptName": "",
+                    "nickname": f"contact{index}",
+                    "pinyin": "",
+                    "pinyinAll": "",
+                    "reserved1": 0,
+                    "reserved2": 0,
+                    "type": 3,
+                    "verifyFlag": 0,
+                    "wxid": f"wxid_contact{index}",
+                }
+                for index in range(contacts)
+            ],
+        },
+        "/api/getContactProfile": {
+            "code": 1,
+            "msg": "success",
+            "data": {"account": "", "headImage": "", "nickname": "contact", "v3": "", "wxid": "wxid_contact0"},
+        },
+        "/api/getChatRoomDetailInfo": {
+            "code": 1,
+            "msg": "success",
+            "data": {"admin": "wxid_contact0", "chatRoomId": "1@chatroom", "notice": "", "xml": ""},
+        },
+        "/api/getMemberFromChatRoom": {
+            "code": 1,
+            "msg": "success",
+            "data": {
+                "admin": "wxid_contact0",
+                "adminNickname": "contact0",
+                "chatRoomId": "1@chatroom",
+                "memberNickname": "",
+                "members": "^G".join(f"wxid_contact{index}" for index in range(min(contacts, 50))),
+            },
+        },
+        "/api/getDBInfo": [],
+        "/api/execSql": {"code": 1, "msg": "success", "data": [["count(*)"], ["0"]]},
+    }
+
+
+class FakeWxHelperHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        fake = self.server.fake
+        if fake.latency > 0:
+            time.sleep(fake.latency)
+        payload = json.loads(body) if body else {}
+        fake.record(self.path, payload)
+        response = fake.responses.get(self.path, SUCCESS)
+        if callable(response):
+            # 可调用的响应按请求内容生成，例如用本地SQLite模拟/api/execSql
+            response = response(payload)
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWxHelper:
+    """可在Linux上运行的wxhelper替身：返回预置的/api/*响应(也可以是按请求内容生成响应的函数)，并按指定速率向机器人推送事件"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        responses: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        contacts: int = 100
+    ):
+        self.latency = latency
+        self.responses = default_responses(contacts)
+        self.responses.update(responses or {})
+        self.calls: typing.Dict[str, int] = {}
+        self.push_address: typing.Optional[typing.Tuple[str, int]] = None
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), FakeWxHelperHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def record(self, api: str, payload: dict) -> None:
+        with self.lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+            if api == "/api/hookSyncMsg":
+                self.push_address = (payload.get("ip", "127.0.0.1"), int(payload["port"]))
+
+    def start(self) -> "FakeWxHelper":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-wxhelper", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push(self, event: typing.Union[dict, bytes], address: typing.Optional[typing.Tuple[str, int]] = None) -> float:
+        """像wxhelper一样推送一条事件并等待ack，返回往返耗时"""
+        address = address or self.push_address
+        if address is None:
+            raise RuntimeError("no push address, hook_sync_msg has not been called")
+        frame = event if isinstance(event, bytes) else json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+        start = time.perf_counter()
+        with socket.create_connection(address) as sock:
+            sock.sendall(frame)
+            sock.recv(64)
+        return time.perf_counter() - start
+
+    def replay(
+        self,
+        events: typing.Iterable[typing.Union[dict, bytes, typing.Callable[[], dict]]],
+        rate: typing.Optional[float] = None,
+        concurrency: int = 1,
+        address: typing.Optional[typing.Tuple[str, int]] = None
+    ) -> dict:
+        """按rate(条/秒，None为不限速)推送事件，返回发送数、耗时和ack耗时，事件为可调用对象时在推送前生成"""
+        items = iter(events)
+        lock = threading.Lock()
+        acks: typing.List[float] = []
+        errors = [0]
+        start = time.perf_counter()
+        interval = concurrency / rate if rate else 0.0
+
+        def worker(offset: int) -> None:
+            next_time = start + offset / rate if rate else start
+            while True:
+                with lock:
+                    event = next(items, None)
+                if event is None:
+                    return
+                if interval:
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_time += interval
+                if callable(event):
+                    event = event()
+                try:
+                    elapsed = self.push(event, address)
+                except OSError:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    acks.append(elapsed)
+
+        threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {"sent": len(acks), "errors": errors[0], "seconds": time.perf_counter() - start, "acks": acks}
@@ -0,0 +1,88 @@
+import time
+import typing
+
+from .events import ALL_MESSAGE
+from .model import Event
+from .router import Route
+
+
+class HandlerRegistry:
+    """Bot与BotCluster共用的handler注册逻辑，依赖metrics、profiler、routes、event_emitter、registrations属性"""
+
+    registrations: typing.Dict[typing.Callable, typing.List[typing.Tuple[str, typing.Callable, typing.Optional[Route]]]]
+
+    def wrap_handler(self, func: typing.Callable) -> typing.Callable:
+        """启用指标或性能分析时为handler记录耗时、异常和调用栈"""
+        metrics, profiler = self.metrics, self.profiler
+        if metrics is None and profiler is None:
+            return func
+        name = getattr(func, "__qualname__", repr(func))
+
+        def handler(bot: typing.Any, event: Event) -> typing.Any:
+            invocation = profiler.enter(name, event.type) if profiler is not None else None
+            start = time.perf_counter()
+            try:
+                return func(bot, event)
+            except Exception:
+                if metrics is not None:
+                    metrics.handler_errors.inc(name)
+                raise
+            finally:
+                if metrics is not None:
+                    metrics.handler_seconds.observe(time.perf_counter() - start, name, event.type)
+                if invocation is not None:
+                    profiler.exit(invocation)
+
+        handler.__wrapped__ = func
+        return handler
+
+    def handle(
+        self,
+        events: typing.Union[typing.List[str], str, None] = None,
+        once: bool = False,
+        room: typing.Union[str, typing.Iterable[str], None] = None,
+        sender: typing.Union[str, typing.Iterable[str], None] = None,
+        startswith: typing.Union[str, typing.Iterable[str], None] = None,
+        regex: typing.Union[str, typing.Pattern, None] = None
+    ) -> typing.Callable[[typing.Callable], typing.Callable]:
+        """注册handler，指定room/sender/startswith/regex时只在条件全部满足时调用，条件按群/发送者/内容前缀建立索引"""
+        def wrapper(func):
+            handler = self.wrap_handler(func)
+            # 记录原函数对应的注册项，remove_handler(原函数)可以移除包装后的handler
+            registrations = self.registrations.setdefault(func, [])
+            if room is not None or sender is not None or startswith is not None or regex is not None:
+                for event in events if isinstance(events, list) else [events or ALL_MESSAGE]:
+                    route = self.routes.add(str(event), handler, once, room=room, sender=sender, startswith=startswith, regex=regex)
+                    registrations.append((str(event), handler, route))
+                return func
+            listen = self.event_emitter.on if not once else self.event_emitter.once
+            for event in events if isinstance(events, list) and events else [events or ALL_MESSAGE]:
+                listen(str(event), handler)
+                registrations.append((str(event), handler, None))
+            # 返回原函数，装饰后的名字仍可传给remove_handler
+            return func
+
+        return wrapper
+
+    def remove_handler(self, func: typing.Callable, events: typing.Union[typing.List[str], str, None] = None) -> int:
+        """移除通过handle注册的handler(传入原函数)，events为None时移除全部事件上的注册，返回移除数"""
+        keys = None if events is None else {str(event) for event in (events if isinstance(events, list) else [events])}
+        registrations = self.registrations.get(func, [])
+        removed = 0
+        for registration in list(registrations):
+            key, handler, route = registration
+            if keys is not None and key not in keys:
+                continue
+            registrations.remove(registration)
+            if route is not None:
+                removed += self.routes.remove(key, route)
+                continue
+            try:
+                self.event_emitter.remove_listener(key, handler)
+                removed += 1
+            except KeyError:
+                # once注册的handler触发后已被移除
+                pass
+        if not registrations:
+            self.registrations.pop(func, None)
+        return removed
@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import shutil
+import typing
+import hashlib
+import pathlib
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .logger import logger
+from .model import Model
+from .utils import atomic_write_json
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = FileSystemEventHandler = None
+
+MEDIA_ATTACHMENT = "attachment"
+MEDIA_IMAGE = "image"
+MEDIA_VOICE = "voice"
+
+
+class MediaResult(Model):
+    """媒体文件获取结果"""
+    msgId: int  # 消息ID
+    kind: str  # attachment/image/voice
+    path: str  # 缓存中的文件路径
+    size: int  # 文件大小(字节)
+    digest: str  # 文件内容的sha256
+    cached: bool = False  # 是否直接命中缓存
+
+
+class Waiter:
+    __slots__ = ("directories", "prefixes", "event", "path", "size", "changed_at")
+
+    def __init__(self, directories: typing.Tuple[str, ...], prefixes: typing.Tuple[str, ...]):
+        self.directories = directories
+        self.prefixes = prefixes
+        self.event = threading.Event()
+        self.path: typing.Optional[str] = None
+        self.size = -1
+        self.changed_at = 0.0
+
+
+if FileSystemEventHandler is not None:
+    class WakeupHandler(FileSystemEventHandler):
+
+        def __init__(self, wakeup: threading.Event):
+            self.wakeup = wakeup
+
+        def on_any_event(self, event):
+            self.wakeup.set()
+
+
+class FileWatcher:
+    """等待目录中以指定前缀命名的文件写入完成(大小在settle时间内不再变化)，安装了watchdog时由文件系统事件唤醒，否则轮询"""
+
+    def __init__(self, poll_interval: float = 0.2, settle: float = 0.3):
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.waiters: typing.List[Waiter] = []
+        self.watched: typing.Set[str] = set()
+        self.observer = Observer() if Observer is not None else None
+        if self.observer is not None:
+            self.observer.daemon = True
+            self.observer.start()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="wxhook-media-watcher", daemon=True)
+        self.thread.start()
+
+    def wait(
+        self,
+        directories: typing.Union[str, typing.Iterable[str]],
+        prefixes: typing.Iterable[str],
+        timeout: typing.Optional[float] = None
+    ) -> str:
+        """阻塞直到任一目录中出现写入完成的文件，返回其路径"""
+        directories = (directories,) if isinstance(directories, str) else tuple(directories)
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+        waiter = Waiter(tuple(os.path.abspath(directory) for directory in directories), tuple(prefixes))
+        with self.lock:
+            self.waiters.append(waiter)
+            for directory in waiter.directories:
+                if self.observer is not None and directory not in self.watched:
+                    self.observer.schedule(WakeupHandler(self.wakeup), directory, recursive=False)
+                    self.watched.add(directory)
+        self.wakeup.set()
+        try:
+            if not waiter.event.wait(timeout):
+                raise TimeoutError(f"no file {'|'.join(waiter.prefixes)}* in {', '.join(directories)} after {timeout}s")
+        finally:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        return waiter.path
+
+    def run(self) -> None:
+        while not self.closed:
+            with self.lock:
+                settling = any(waiter.size >= 0 for waiter in self.waiters)
+            if self.observer is None or settling:
+                interval = self.poll_interval if self.observer is None else min(self.poll_interval, self.settle)
+            else:
+                # 有文件系统事件时无需轮询，超时只是兜底
+                interval = 5.0
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("media watcher scan failed")
+
+    def scan(self) -> None:
+        with self.lock:
+            waiters = list(self.waiters)
+        if not waiters:
+            return
+        listings: typing.Dict[str, typing.List[os.DirEntry]] = {}
+        for directory in {directory for waiter in waiters for directory in waiter.directories}:
+            try:
+                listings[directory] = [entry for entry in os.scandir(directory) if entry.is_file()]
+            except FileNotFoundError:
+                listings[directory] = []
+        now = time.monotonic()
+        for waiter in waiters:
+            entry = next(
+                (
+                    entry for directory in waiter.directories for entry in listings[directory]
+                    if entry.name.startswith(waiter.prefixes)
+                ),
+                None
+            )
+            if entry is None:
+                continue
+            size = entry.stat().st_size
+            if size != waiter.size:
+                waiter.size, waiter.changed_at = size, now
+            elif size > 0 and now - waiter.changed_at >= self.settle:
+                waiter.path = entry.path
+                waiter.event.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.wakeup.set()
+        if self.observer is not None:
+            self.observer.stop()
+
+
+class MediaCache:
+    """按内容sha256寻址的本地缓存，总大小超过max_bytes时按最近使用淘汰，索引变更后最多延迟save_interval秒写盘"""
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30, save_interval: float = 1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.timer: typing.Optional[threading.Timer] = None
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            data = {}
+        # keys: "kind:msgId" -> digest文件名；blobs: digest文件名 -> 大小，按最近使用排序
+        self.keys: typing.Dict[str, str] = data.get("keys", {})
+        self.blobs: typing.OrderedDict[str, int] = collections.OrderedDict(data.get("blobs", []))
+        self.size = sum(self.blobs.values())
+
+    def blob_path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+    def get(self, key: str) -> typing.Optional[typing.Tuple[str, int, str]]:
+        with self.lock:
+            name = self.keys.get(key)
+            if name is None or name not in self.blobs:
+                return None
+            path = self.blob_path(name)
+            if not os.path.exists(path):
+                self.drop(name)
+                self.schedule_save()
+                return None
+            self.blobs.move_to_end(name)
+            return path, self.blobs[name], name.split(".")[0]
+
+    def put(self, key: str, source: str) -> typing.Tuple[str, int, str]:
+        """复制文件进缓存，返回缓存路径、大小和sha256"""
+        digest = hashlib.sha256()
+        with open(source, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        name = digest.hexdigest() + os.path.splitext(source)[1].lower()
+        path = self.blob_path(name)
+        with self.lock:
+            if name not in self.blobs or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.copyfile(source, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                size = os.path.getsize(path)
+                self.size += size - self.blobs.get(name, 0)
+                self.blobs[name] = size
+            self.blobs.move_to_end(name)
+            self.keys[key] = name
+            self.evict(keep=name)
+            self.schedule_save()
+            return path, self.blobs[name], name.split(".")[0]
+
+    def drop(self, name: str) -> None:
+        self.size -= self.blobs.pop(name, 0)
+        for key in [key for key, value in self.keys.items() if value == name]:
+            del self.keys[key]
+        try:
+            os.remove(self.blob_path(name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep: str) -> None:
+        for name in list(self.blobs):
+            if self.size <= self.max_bytes:
+                break
+            if name != keep:
+                self.drop(name)
+
+    def save(self) -> None:
+        atomic_write_json(pathlib.Path(self.index_path), {"keys": self.keys, "blobs": list(self.blobs.items())})
+        self.dirty = False
+
+    def schedule_save(self) -> None:
+        """标记索引已变更，由定时器合并写盘，需在锁内调用"""
+        self.dirty = True
+        if self.timer is None:
+            self.timer = threading.Timer(self.save_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.timer = None
+            if self.dirty:
+                try:
+                    self.save()
+                except OSError as e:
+                    logger.error(f"save media cache index failed: {e}")
+
+    def close(self) -> None:
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"files": len(self.blobs), "keys": len(self.keys), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+class MediaFetcher:
+    """媒体获取流水线：按msgId返回Future，在有界线程池中调用接口并等待文件落盘，同一消息的并发请求合并，结果存入内容寻址缓存"""
+
+    def __init__(
+        self,
+        bot,
+        workers: int = 4,
+        timeout: float = 60.0,
+        work_dir: typing.Optional[str] = None,
+        cache_dir: typing.Optional[str] = None,
+        cache_size: int = 1 << 30,
+        poll_interval: float = 0.2,
+        settle: float = 0.3
+    ):
+        self.bot = bot
+        self.timeout = timeout
+        self.work_dir = work_dir
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.cache: typing.Optional[MediaCache] = None
+        self.watcher = FileWatcher(poll_interval, settle)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wxhook-media")
+        self.lock = threading.Lock()
+        self.pending: typing.Dict[str, Future] = {}
+        self.counters = {"requested": 0, "merged": 0, "hits": 0, "fetched": 0, "errors": 0}
+
+    def get_work_dir(self) -> str:
+        # 需要是微信进程可写的目录，默认放在wxhelper目录下
+        if self.work_dir is None:
+            if self.bot.WXHELPER_PATH is None:
+                raise RuntimeError("bot is not logged in yet, work_dir is unknown")
+            self.work_dir = os.path.join(self.bot.WXHELPER_PATH, "media")
+        return self.work_dir
+
+    def get_cache(self) -> MediaCache:
+        if self.cache is None:
+            self.cache = MediaCache(self.cache_dir or os.path.join(self.get_work_dir(), "cache"), self.cache_size)
+        return self.cache
+
+    def fetch(self, msg_id: int, kind: str = MEDIA_ATTACHMENT) -> Future:
+        """获取消息的媒体文件，Future结果为MediaResult"""
+        if kind not in (MEDIA_ATTACHMENT, MEDIA_IMAGE, MEDIA_VOICE):
+            raise ValueError(f"unknown media kind: {kind}")
+        key = f"{kind}:{msg_id}"
+        with self.lock:
+            self.counters["requested"] += 1
+            future = self.pending.get(key)
+            if future is not None:
+                self.counters["merged"] += 1
+                return future
+            cached = self.get_cache().get(key)
+            if cached is not None:
+                self.counters["hits"] += 1
+                future = Future()
+                future.set_result(MediaResult(msgId=msg_id, kind=kind, path=cached[0], size=cached[1], digest=cached[2], cached=True))
+                return future
+            future = self.executor.submit(self.run, msg_id, kind, key)
+            self.pending[key] = future
+        future.add_done_callback(lambda _: self.done(key))
+        return future
+
+    def fetch_attachment(self, msg_id: int) -> Future:
+        return self.fetch(msg_id, MEDIA_ATTACHMENT)
+
+    def fetch_image(self, msg_id: int) -> Future:
+        """下载并解码图片"""
+        return self.fetch(msg_id, MEDIA_IMAGE)
+
+    def fetch_voice(self, msg_id: int) -> Future:
+        return self.fetch(msg_id, MEDIA_VOICE)
+
+    def done(self, key: str) -> None:
+        with self.lock:
+            self.pending.pop(key, None)
+
+    @staticmethod
+    def check(response) -> None:
+        if response.code <= 0:
+            raise RuntimeError(f"wxhelper returned {response.code}: {response.msg}")
+
+    def download(self, msg_id: int, deadline: float) -> str:
+        self.check(self.bot.download_attachment(msg_id))
+        # 附件按消息类型落在image/video/file目录，文件名以msgId开头
+        return self.watcher.wait(
+            [self.bot.IMAGE_SAVE_PATH, self.bot.VIDEO_SAVE_PATH, self.bot.FILE_SAVE_PATH],
+            (f"{msg_id}.", f"{msg_id}_"),
+            max(0.0, deadline - time.monotonic())
+        )
+
+    def run(self, msg_id: int, kind: str, key: str) -> MediaResult:
+        deadline = time.monotonic() + self.timeout
+        try:
+            work_dir = self.get_work_dir()
+            if kind == MEDIA_VOICE:
+                self.check(self.bot.get_voice_by_msg_id(msg_id, work_dir))
+                path = self.watcher.wait(work_dir, (f"{msg_id}.",), self.timeout)
+            else:
+                path = self.download(msg_id, deadline)
+                if kind == MEDIA_IMAGE:
+                    self.check(self.bot.decode_image(path, work_dir))
+                    name = os.path.splitext(os.path.basename(path))[0]
+                    path = self.watcher.wait(work_dir, (f"{name}.",), max(0.0, deadline - time.monotonic()))
+            cached_path, size, digest = self.get_cache().put(key, path)
+        except Exception:
+            with self.lock:
+                self.counters["errors"] += 1
+            raise
+        with self.lock:
+            self.counters["fetched"] += 1
+        return MediaResult(msgId=msg_id, kind=kind, path=cached_path, size=size, digest=digest)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+        stats["watcher"] = "watchdog" if self.watcher.observer is not None else "polling"
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+    def close(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
+        self.watcher.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,179 @@
+import bisect
+import typing
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value: typing.Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: typing.Sequence[str], values: typing.Sequence[typing.Any], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: typing.Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels: typing.Any, value: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values: typing.Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels: typing.Any) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            item = self.values.get(labels)
+            if item is None:
+                item = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            item[0][index] += 1
+            item[1] += value
+            item[2] += 1
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: typing.Callable[[], typing.Union[float, typing.Dict[tuple, float]]],
+        labels: typing.Sequence[str] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labels = tuple(labels)
+
+    def render(self) -> typing.List[str]:
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if not self.labels:
+            lines.append(f"{self.name} {value}")
+            return lines
+        for labels, item in value.items():
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {item}")
+        return lines
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        data = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Metrics:
+    """事件处理与接口调用的计数器和耗时直方图，以Prometheus文本格式输出"""
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.frames = Counter("wxhook_frames_total", "Frames received from wxhelper")
+        self.frame_errors = Counter("wxhook_frame_errors_total", "Frames that failed before the ack was sent")
+        self.ack_seconds = Histogram("wxhook_ack_seconds", "Time from frame received to ack sent", buckets=buckets)
+        self.events = Counter("wxhook_events_total", "Inbound events by message type", ("type",))
+        self.event_errors = Counter("wxhook_event_errors_total", "Events that failed to parse or dispatch")
+        self.handler_seconds = Histogram("wxhook_handler_seconds", "Handler latency", ("handler", "type"), buckets)
+        self.handler_errors = Counter("wxhook_handler_errors_total", "Handler exceptions", ("handler",))
+        self.api_seconds = Histogram("wxhook_api_seconds", "call_api latency by endpoint", ("api",), buckets)
+        self.api_errors = Counter("wxhook_api_errors_total", "call_api failures by endpoint", ("api",))
+        self.collectors: typing.List[typing.Union[Counter, Histogram, Gauge]] = [
+            self.frames,
+            self.frame_errors,
+            self.ack_seconds,
+            self.events,
+            self.event_errors,
+            self.handler_seconds,
+            self.handler_errors,
+            self.api_seconds,
+            self.api_errors,
+        ]
+        self.server: typing.Optional[ThreadingHTTPServer] = None
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        function: typing.Callable[[], typing.Union[float, typing.Dict[tuple, float]]],
+        labels: typing.Sequence[str] = ()
+    ) -> None:
+        """注册在输出时取值的指标，例如队列深度，指定labels时function返回{标签值元组: 值}"""
+        self.collectors.append(Gauge(name, documentation, function, labels))
+
+    def render(self) -> str:
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9108) -> ThreadingHTTPServer:
+        """启动/metrics HTTP服务"""
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self
+        threading.Thread(target=self.server.serve_forever, name="wxhook-metrics", daemon=True).start()
+        return self.server
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,120 @@
+import re
+import time
+import typing
+import sqlite3
+import threading
+
+from .logger import logger
+from .model import Model
+from .sql import Cursor
+
+ROWID_COLUMN = "_rowid_"
+
+
+class SyncReport(Model):
+    """表同步结果"""
+    table: str  # 表名
+    rows: int  # 本次同步的行数
+    seconds: float  # 耗时(秒)
+    rowsPerSecond: float  # 吞吐量(行/秒)
+    watermark: typing.Optional[int] = None  # 同步后的水位
+
+
+class DatabaseMirror:
+    """把微信数据库中的表增量同步到本地SQLite，首次全量复制，之后只拉取水位之上的新行"""
+
+    def __init__(
+        self,
+        bot,
+        path: str,
+        tables: typing.Iterable[str],
+        batch_size: int = 1000,
+        key: str = "rowid"
+    ):
+        self.bot = bot
+        self.path = path
+        self.tables = list(tables)
+        self.batch_size = batch_size
+        self.key = key
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS _wxhook_sync (name TEXT PRIMARY KEY, watermark INTEGER, synced_at REAL, watermark_rowid INTEGER)"
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(_wxhook_sync)")]
+        if "watermark_rowid" not in columns:
+            self.connection.execute("ALTER TABLE _wxhook_sync ADD COLUMN watermark_rowid INTEGER")
+        self.connection.commit()
+
+    @staticmethod
+    def local_name(name: str) -> str:
+        return re.sub(r"\W", "_", name)
+
+    def get_watermark(self, name: str) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+        """返回(键, rowid)水位，键不是rowid时用rowid区分相同键值的行"""
+        row = self.connection.execute("SELECT watermark, watermark_rowid FROM _wxhook_sync WHERE name = ?", (name,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def create_table(self, name: str, create_sql: str) -> None:
+        local = self.local_name(name)
+        definition = create_sql[create_sql.find("("):]
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{local}" {definition}')
+
+    def sync_table(self, name: str) -> SyncReport:
+        """同步单张表，name为表名或 库名.表名"""
+        with self.lock:
+            handle, table = self.bot.schema.find_table(name)
+            self.create_table(name, table.sql)
+            watermark, watermark_rowid = self.get_watermark(name)
+            cursor = Cursor(
+                self.bot,
+                handle,
+                f"SELECT rowid AS {ROWID_COLUMN}, * FROM {table.name}",
+                batch_size=self.batch_size,
+                key=self.key,
+                start=watermark,
+                start_rowid=watermark_rowid
+            )
+            cursor.types = dict(cursor.types, **{ROWID_COLUMN: int})
+            local = self.local_name(name)
+            count = 0
+            start = time.perf_counter()
+            statement = None
+            for rows in cursor.batches():
+                if statement is None:
+                    columns = ", ".join(f'"{column}"' for column in cursor.columns[1:])
+                    placeholders = ", ".join("?" * len(cursor.columns))
+                    statement = f'INSERT OR REPLACE INTO "{local}" (rowid, {columns}) VALUES ({placeholders})'
+                self.connection.executemany(statement, rows)
+                count += len(rows)
+                watermark = int(cursor.last_key)
+                watermark_rowid = int(cursor.last_rowid) if cursor.last_rowid is not None else None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO _wxhook_sync (name, watermark, synced_at, watermark_rowid) VALUES (?, ?, ?, ?)",
+                    (name, watermark, time.time(), watermark_rowid)
+                )
+                self.connection.commit()
+            seconds = time.perf_counter() - start
+            report = SyncReport(
+                table=name,
+                rows=count,
+                seconds=seconds,
+                rowsPerSecond=count / seconds if seconds > 0 else 0.0,
+                watermark=watermark
+            )
+            logger.info(f"mirror {name}: {count} rows in {seconds:.2f}s ({report.rowsPerSecond:.0f} rows/s)")
+            return report
+
+    def sync(self) -> typing.List[SyncReport]:
+        """同步所有配置的表"""
+        return [self.sync_table(name) for name in self.tables]
+
+    def execute(self, sql: str, parameters: typing.Sequence = ()) -> typing.List[tuple]:
+        """在本地镜像上执行查询"""
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
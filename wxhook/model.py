@@ -1,10 +1,173 @@
 import typing
-from dataclasses import dataclass
+from array import array
 from typing import List
 
+from .utils import is_xml, parse_xml, select_xml
 
-@dataclass
-class Account:
+_MISSING = object()
+
+
+class XMLField:
+    """XML字段，保存原始文本，首次访问时解析并缓存"""
+
+    @staticmethod
+    def slot_names(name: str) -> typing.Tuple[str, str]:
+        return f"_{name}_raw", f"_{name}_parsed"
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.raw_name, self.cache_name = self.slot_names(name)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = getattr(instance, self.cache_name, _MISSING)
+        if value is _MISSING:
+            value = getattr(instance, self.raw_name, None)
+            if is_xml(value):
+                try:
+                    value = parse_xml(value)
+                except Exception:
+                    pass
+            setattr(instance, self.cache_name, value)
+        return value
+
+    def __set__(self, instance, value):
+        setattr(instance, self.raw_name, value)
+        # 缓存槽位保持未赋值，pickle/copy时不会带上任何哨兵对象
+        try:
+            delattr(instance, self.cache_name)
+        except AttributeError:
+            pass
+
+
+def _compile_constructors(fields: typing.Tuple[str, ...], defaults: dict) -> typing.Tuple[typing.Callable, classmethod]:
+    params = ", ".join(f"{field}=_defaults[{field!r}]" if field in defaults else field for field in fields)
+    lines = [f"def __init__(self, {params}, **extra):"]
+    lines += [f"    self.{field} = {field}" for field in fields]
+    lines.append("    self.extra = extra or None")
+    lines.append("def from_dict(cls, data):")
+    lines.append("    self = _new(cls)")
+    lines.append("    get = data.get")
+    lines += [
+        f"    self.{field} = get({field!r}, _defaults[{field!r}])" if field in defaults else f"    self.{field} = get({field!r})"
+        for field in fields
+    ]
+    lines.append("    self.extra = None if data.keys() <= _field_set else {k: v for k, v in data.items() if k not in _field_set}")
+    lines.append("    return self")
+    namespace = {"_defaults": defaults, "_new": object.__new__, "_field_set": frozenset(fields)}
+    exec("\n".join(lines), namespace)
+    return namespace["__init__"], classmethod(namespace["from_dict"])
+
+
+class ModelMeta(type):
+    """根据字段注解生成__slots__及预编译的构造函数"""
+
+    def __new__(mcs, name, bases, namespace):
+        annotations = namespace.get("__annotations__")
+        if annotations is None and "__annotate__" in namespace:
+            annotations = namespace["__annotate__"](1)
+        fields = tuple(field for field in annotations or {} if not field.startswith("_"))
+        defaults = {}
+        slots = []
+        for field in fields:
+            value = namespace.get(field, _MISSING)
+            if isinstance(value, XMLField):
+                slots.extend(XMLField.slot_names(field))
+                defaults[field] = None
+                continue
+            if value is not _MISSING:
+                defaults[field] = namespace.pop(field)
+            slots.append(field)
+        namespace.setdefault("__slots__", tuple(slots))
+        cls = super().__new__(mcs, name, bases, namespace)
+        if fields:
+            cls._fields = fields
+            cls.__init__, cls.from_dict = _compile_constructors(fields, defaults)
+        return cls
+
+
+def _to_plain(value: typing.Any, raw: bool) -> typing.Any:
+    if isinstance(value, Model):
+        return value.to_dict(raw)
+    if isinstance(value, list):
+        return [_to_plain(item, raw) for item in value]
+    return value
+
+
+class Model(metaclass=ModelMeta):
+    """模型基类，未知字段保存在extra中"""
+    __slots__ = ("extra",)
+    _fields: typing.Tuple[str, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Model":
+        raise NotImplementedError
+
+    def raw(self, field: str) -> typing.Any:
+        """获取字段未解析的原始值"""
+        descriptor = getattr(type(self), field, None)
+        if isinstance(descriptor, XMLField):
+            return getattr(self, descriptor.raw_name, None)
+        return getattr(self, field)
+
+    def to_dict(self, raw: bool = False) -> dict:
+        get = self.raw if raw else self.__getattribute__
+        data = {field: _to_plain(get(field), raw) for field in self._fields}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={self.raw(field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other: typing.Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(self.raw(field) == other.raw(field) for field in self._fields)
+
+    __hash__ = None
+
+
+class Columns:
+    """列式存储的模型列表，按列保存字段值，整数列使用array，按需构造模型对象"""
+
+    def __init__(self, model: typing.Type[Model], rows: typing.List[dict]):
+        self.model = model
+        self.columns = {}
+        for field in model._fields:
+            values = [row.get(field) for row in rows]
+            if model.__annotations__.get(field) is int:
+                try:
+                    values = array("q", values)
+                except TypeError:
+                    pass
+            self.columns[field] = values
+
+    def column(self, field: str) -> typing.Sequence:
+        return self.columns[field]
+
+    def row(self, index: int) -> Model:
+        return self.model.from_dict({field: values[index] for field, values in self.columns.items()})
+
+    def __len__(self) -> int:
+        return len(self.columns[self.model._fields[0]]) if self.model._fields else 0
+
+    def __getitem__(self, index: int) -> Model:
+        if index < 0:
+            index += len(self)
+        return self.row(index)
+
+    def __iter__(self) -> typing.Iterator[Model]:
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def to_list(self) -> typing.List[Model]:
+        return list(self)
+
+
+class Account(Model):
     """用户"""
     account: str  # 账号名
     city: str  # 所在城市
@@ -20,8 +183,7 @@ class Account:
     wxid: str  # 微信ID
 
 
-@dataclass
-class Contact:
+class Contact(Model):
     """联系人"""
     customAccount: str  # 用户自定义的账号
     encryptName: str  # 加密名称，如果有的话
@@ -35,8 +197,7 @@ class Contact:
     wxid: str  # 用户的微信ID
 
 
-@dataclass
-class ContactDetail:
+class ContactDetail(Model):
     """联系人详情"""
     account: str  # 用户账号，如果未设置则为空字符串
     headImage: str  # 用户的头像图片URL，如果未设置则为空字符串
@@ -45,8 +206,7 @@ class ContactDetail:
     wxid: str  # 用户的微信ID
 
 
-@dataclass
-class Room:
+class Room(Model):
     """群聊"""
     admin: str  # 管理员的用户ID，如果没有管理员则为空字符串
     chatRoomId: str  # 聊天室ID，如果没有指定聊天室则为空字符串
@@ -54,8 +214,7 @@ class Room:
     xml: str  # 聊天室相关的XML信息，通常包含聊天室的详细配置信息，如果没有则为空字符串
 
 
-@dataclass
-class RoomMembers:
+class RoomMembers(Model):
     """群成员"""
     admin: str  # 聊天室管理员的微信ID
     adminNickname: str  # 聊天室管理员的昵称
@@ -64,11 +223,10 @@ class RoomMembers:
     members: str  # 聊天室成员的微信ID列表，各ID之间使用特定字符分隔
 
 
-@dataclass
-class Event:
+class Event(Model):
     """消息事件"""
-    content: typing.Optional[typing.Any] = None  # 消息内容，可能包含用户ID和冒号之后的文本内容
-    base64Img: typing.Optional[str] = None  # 图片base64
+    content: typing.Optional[typing.Any] = XMLField()  # 消息内容，可能包含用户ID和冒号之后的文本内容，XML内容在访问时解析
+    base64Img: typing.Optional[typing.Any] = None  # 图片base64，启用Bot.enable_blobs后较大的数据为按需解码的Blob
     data: typing.Optional[list] = None  # 朋友圈数据
     createTime: typing.Optional[int] = None  # 消息创建时间的UNIX时间戳
     displayFullContent: typing.Optional[str] = None  # 完整的消息内容，如果有的话
@@ -76,13 +234,62 @@ class Event:
     msgId: typing.Optional[int] = None  # 消息的唯一标识符
     msgSequence: typing.Optional[int] = None  # 消息序列号
     pid: typing.Optional[int] = None  # 消息的PID
-    signature: typing.Optional[str] = None  # 消息签名，包含一系列的配置信息
+    signature: typing.Optional[typing.Any] = XMLField()  # 消息签名，包含一系列的配置信息，XML内容在访问时解析
     toUser: typing.Optional[str] = None  # 消息接收者的用户ID
     type: typing.Optional[int] = None  # 消息类型
 
+    def select(self, field: str, *paths: str) -> typing.Dict[str, typing.Optional[str]]:
+        """只解析XML字段中指定的路径，例如 event.select("signature", "msgsource/atuserlist")"""
+        raw = self.raw(field)
+        if not is_xml(raw):
+            return {}
+        return select_xml(raw, *paths)
+
+    @property
+    def is_room(self) -> bool:
+        """是否为群消息"""
+        return bool(self.fromUser) and self.fromUser.endswith("@chatroom")
+
+    @property
+    def room(self) -> typing.Optional[str]:
+        """群ID，私聊消息为None"""
+        return self.fromUser if self.is_room else None
+
+    def split_content(self) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+        content = self.raw("content")
+        if not isinstance(content, str):
+            return None, None
+        if self.is_room:
+            # 群消息内容形如 "wxid_xxx:\n文本"
+            head, separator, text = content.partition(":\n")
+            if separator and len(head) < 64 and not any(char.isspace() for char in head):
+                return head, text
+            return None, content
+        return self.fromUser, content
+
+    @property
+    def sender(self) -> typing.Optional[str]:
+        """实际发送者，群消息为内容前缀中的用户ID"""
+        if not self.is_room:
+            return self.fromUser
+        return self.split_content()[0]
+
+    @property
+    def text(self) -> typing.Optional[str]:
+        """去掉群消息发送者前缀后的文本内容"""
+        return self.split_content()[1]
+
+
+class SnsItem(Model):
+    """朋友圈动态"""
+    snsId: int  # 动态ID
+    senderId: typing.Optional[str] = None  # 发布者wxid
+    createTime: typing.Optional[int] = None  # 发布时间的UNIX时间戳
+    content: typing.Optional[str] = None  # 文本内容
+    xml: typing.Optional[typing.Any] = XMLField()  # 动态详情XML，访问时解析
+
 
-@dataclass
-class Table:
+class Table(Model):
     """表结构"""
     name: str  # 任务名称
     rootpage: str  # 根页面
@@ -90,16 +297,14 @@ class Table:
     tableName: str  # 表名称
 
 
-@dataclass
-class DB:
+class DB(Model):
     """数据库"""
     databaseName: str  # 数据库名称
     handle: int  # 句柄
     tables: List[Table]  # 表列表
 
 
-@dataclass
-class Response:
+class Response(Model):
     """响应"""
     code: int  # 状态码，例如 200
     data: dict  # 用户数据，当前为空对象
@@ -0,0 +1,267 @@
+import time
+import heapq
+import typing
+import itertools
+import threading
+import collections
+from concurrent.futures import Future
+
+from .logger import logger
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class TokenBucket:
+    """令牌桶，rate为每秒生成的令牌数，burst为桶容量"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """距离下一个可用令牌的秒数"""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self.refill(now)
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    __slots__ = ("kind", "wxid", "args", "priority", "futures", "enqueued_at", "ready_at", "parts", "length")
+
+    def __init__(self, kind: str, wxid: str, args: tuple, priority: int, ready_at: float):
+        self.kind = kind
+        self.wxid = wxid
+        self.args = args
+        self.priority = priority
+        self.futures: typing.List[Future] = []
+        self.enqueued_at = time.monotonic()
+        self.ready_at = ready_at
+        self.parts: typing.Optional[typing.List[str]] = None
+        self.length = 0
+
+
+class Outbox:
+    """限速、分优先级的发送队列，每个接收者单独排队，相同接收者的连续文本消息在排队期间(不超过合并窗口)合并为一条发送"""
+
+    def __init__(
+        self,
+        bot,
+        rate: float = 5,
+        burst: float = 10,
+        per_recipient_rate: float = 1,
+        per_recipient_burst: float = 3,
+        coalesce_window: float = 0.3,
+        coalesce_separator: str = "\n",
+        max_coalesce_length: int = 2000,
+        max_recipients: int = 4096
+    ):
+        self.bot = bot
+        self.global_bucket = TokenBucket(rate, burst)
+        self.per_recipient_rate = per_recipient_rate
+        self.per_recipient_burst = per_recipient_burst
+        self.recipient_buckets: typing.OrderedDict[str, TokenBucket] = collections.OrderedDict()
+        self.max_recipients = max_recipients
+        self.coalesce_window = coalesce_window
+        self.coalesce_separator = coalesce_separator
+        self.max_coalesce_length = max_coalesce_length
+        # 每个接收者一个按(优先级, 序号)排序的堆，某个接收者被限速时不影响其他接收者
+        self.queues: typing.Dict[str, typing.List[tuple]] = {}
+        self.depth = 0
+        self.pending_text: typing.Dict[str, typing.Dict[int, OutboundMessage]] = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.counters = {"submitted": 0, "sent": 0, "failed": 0, "coalesced": 0}
+        self.total_wait = 0.0
+        self.thread = threading.Thread(target=self.worker, name="wxhook-outbox", daemon=True)
+        self.thread.start()
+
+    def push(self, message: OutboundMessage) -> None:
+        heapq.heappush(self.queues.setdefault(message.wxid, []), (message.priority, next(self.sequence), message))
+        self.depth += 1
+
+    def close_window(self, wxid: str, now: float) -> None:
+        """结束接收者的文本合并窗口，之后的文本不会再并入非文本消息之前的那条"""
+        for message in self.pending_text.pop(wxid, {}).values():
+            message.ready_at = min(message.ready_at, now)
+
+    def submit(self, kind: str, wxid: str, *args, priority: int = PRIORITY_NORMAL) -> Future:
+        """提交发送任务，kind对应Bot的send_<kind>方法，返回发送结果的Future"""
+        if not callable(getattr(self.bot, f"send_{kind}", None)):
+            raise ValueError(f"unknown send kind: {kind}")
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("outbox is closed")
+            self.counters["submitted"] += 1
+            now = time.monotonic()
+            if kind == "text" and self.coalesce_window > 0:
+                # 文本不额外等待，只有前一条还在排队(通常是被限速)时才并入，合并后的长度不超过max_coalesce_length
+                pending = self.pending_text.setdefault(wxid, {})
+                message = pending.get(priority)
+                length = len(self.coalesce_separator) + len(args[0])
+                if (
+                    message is not None
+                    and now - message.enqueued_at <= self.coalesce_window
+                    and message.length + length <= self.max_coalesce_length
+                ):
+                    message.parts.append(args[0])
+                    message.length += length
+                    message.futures.append(future)
+                    self.counters["coalesced"] += 1
+                    return future
+                message = OutboundMessage(kind, wxid, args, priority, now)
+                message.parts = [args[0]]
+                message.length = len(args[0])
+                pending[priority] = message
+            else:
+                self.close_window(wxid, now)
+                message = OutboundMessage(kind, wxid, args, priority, now)
+            message.futures.append(future)
+            self.push(message)
+            self.condition.notify()
+        return future
+
+    def send_text(self, wxid: str, msg: str, priority: int = PRIORITY_NORMAL) -> Future:
+        return self.submit("text", wxid, msg, priority=priority)
+
+    def send_image(self, wxid: str, image_path: str, priority: int = PRIORITY_NORMAL) -> Future:
+        return self.submit("image", wxid, image_path, priority=priority)
+
+    def send_file(self, wxid: str, file_path: str, priority: int = PRIORITY_NORMAL) -> Future:
+        return self.submit("file", wxid, file_path, priority=priority)
+
+    def send_emotion(self, wxid: str, file_path: str, priority: int = PRIORITY_NORMAL) -> Future:
+        return self.submit("emotion", wxid, file_path, priority=priority)
+
+    def send_room_at(self, room_id: str, wxids: typing.List[str], msg: str, priority: int = PRIORITY_NORMAL) -> Future:
+        return self.submit("room_at", room_id, wxids, msg, priority=priority)
+
+    def recipient_bucket(self, wxid: str) -> TokenBucket:
+        bucket = self.recipient_buckets.get(wxid)
+        if bucket is None:
+            bucket = self.recipient_buckets[wxid] = TokenBucket(self.per_recipient_rate, self.per_recipient_burst)
+            if len(self.recipient_buckets) > self.max_recipients:
+                self.recipient_buckets.popitem(last=False)
+        else:
+            self.recipient_buckets.move_to_end(wxid)
+        return bucket
+
+    def next_ready(self, now: float) -> typing.Tuple[typing.Optional[typing.List[tuple]], typing.Optional[float]]:
+        """在各接收者的队首中选出已就绪的、优先级最高且最早提交的一条所在的队列，没有就绪消息时返回最短等待秒数"""
+        best, wait = None, None
+        for wxid, queue in self.queues.items():
+            message = queue[0][2]
+            bucket = self.recipient_buckets.get(wxid)
+            delay = bucket.delay(now) if bucket is not None else 0.0
+            if not self.closed:
+                delay = max(delay, message.ready_at - now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or queue[0][:2] < best[0][:2]:
+                best = queue
+        return best, wait
+
+    def take(self) -> typing.Optional[OutboundMessage]:
+        """取出下一条可发送的消息，所有接收者都未到合并时间或超出限速时等待"""
+        with self.condition:
+            while True:
+                if not self.queues:
+                    if self.closed:
+                        return None
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                queue, wait = self.next_ready(now)
+                if queue is None:
+                    self.condition.wait(wait)
+                    continue
+                delay = self.global_bucket.delay(now)
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                _, _, message = heapq.heappop(queue)
+                if not queue:
+                    del self.queues[message.wxid]
+                self.depth -= 1
+                self.recipient_bucket(message.wxid).consume(now)
+                self.global_bucket.consume(now)
+                if message.parts is not None:
+                    pending = self.pending_text.get(message.wxid)
+                    if pending is not None and pending.get(message.priority) is message:
+                        del pending[message.priority]
+                        if not pending:
+                            del self.pending_text[message.wxid]
+                    message.args = (self.coalesce_separator.join(message.parts),) + message.args[1:]
+                self.total_wait += now - message.enqueued_at
+                return message
+
+    def worker(self) -> None:
+        while True:
+            message = self.take()
+            if message is None:
+                break
+            try:
+                result = getattr(self.bot, f"send_{message.kind}")(message.wxid, *message.args)
+            except Exception as e:
+                logger.error(f"outbox send {message.kind} to {message.wxid} failed: {e}")
+                with self.condition:
+                    self.counters["failed"] += 1
+                for future in message.futures:
+                    future.set_exception(e)
+            else:
+                with self.condition:
+                    self.counters["sent"] += 1
+                for future in message.futures:
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        """队列深度、各优先级深度、发送/失败/合并计数及平均排队时间"""
+        with self.condition:
+            depth = collections.Counter(item[0] for queue in self.queues.values() for item in queue)
+            sent = self.counters["sent"] + self.counters["failed"]
+            stats = dict(self.counters)
+            stats.update({
+                "depth": self.depth,
+                "recipients": len(self.queues),
+                "depth_by_priority": dict(depth),
+                "avg_wait": self.total_wait / sent if sent else 0.0,
+            })
+        return stats
+
+    def close(self, wait: bool = True, timeout: typing.Optional[float] = None) -> None:
+        """停止接收新消息，wait为True时等待队列中的消息发送完毕，超过timeout秒仍未发完的消息被丢弃，其Future抛出RuntimeError"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if not wait:
+            return
+        self.thread.join(timeout)
+        if not self.thread.is_alive():
+            return
+        with self.condition:
+            messages = [item[2] for queue in self.queues.values() for item in queue]
+            self.queues.clear()
+            self.pending_text.clear()
+            self.depth = 0
+            self.counters["failed"] += len(messages)
+            self.condition.notify_all()
+        if messages:
+            logger.warning(f"outbox closed with {len(messages)} unsent messages")
+        error = RuntimeError("outbox is closed")
+        for message in messages:
+            for future in message.futures:
+                future.set_exception(error)
@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import random
+import typing
+import threading
+import collections
+
+from .logger import logger
+
+
+class Invocation:
+    __slots__ = ("ident", "handler", "type", "start", "sampled", "root", "samples")
+
+    def __init__(self, handler: str, event_type: typing.Any, sampled: bool, root):
+        self.ident = threading.get_ident()
+        self.handler = handler
+        self.type = event_type
+        self.start = time.perf_counter()
+        self.sampled = sampled
+        self.root = root
+        self.samples: typing.Counter[str] = collections.Counter()
+
+
+class HandlerStats:
+    __slots__ = ("count", "total", "max", "slow")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class HandlerProfiler:
+    """handler耗时统计，超过阈值或被抽样的调用由采样线程周期性抓取调用栈，输出可直接生成火焰图的collapsed格式"""
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+        output: typing.Optional[str] = None,
+        max_depth: int = 64
+    ):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.output = output
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.active: typing.Dict[int, Invocation] = {}
+        self.handlers: typing.Dict[str, HandlerStats] = collections.defaultdict(HandlerStats)
+        self.stacks: typing.Counter[str] = collections.Counter()
+        # 待写入output的行，由采样线程在锁外追加到文件，handler线程不做文件IO
+        self.lines: typing.List[str] = []
+        self.closed = threading.Event()
+        self.thread: typing.Optional[threading.Thread] = None
+
+    def enter(self, handler: str, event_type: typing.Any) -> Invocation:
+        """handler开始执行，需在包装函数内调用，调用栈在包装函数处截断"""
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        invocation = Invocation(handler, event_type, sampled, sys._getframe(1))
+        with self.lock:
+            self.active[id(invocation)] = invocation
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.sampler, name="wxhook-profiler", daemon=True)
+                self.thread.start()
+        return invocation
+
+    def exit(self, invocation: Invocation) -> float:
+        """handler执行结束，返回耗时"""
+        elapsed = time.perf_counter() - invocation.start
+        slow = elapsed >= self.threshold
+        with self.lock:
+            self.active.pop(id(invocation), None)
+            stats = self.handlers[invocation.handler]
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.slow += slow
+            samples = invocation.samples
+            if samples:
+                prefix = f"type {invocation.type};{invocation.handler};"
+                for stack, count in samples.items():
+                    self.stacks[prefix + stack] += count
+                    if self.output is not None:
+                        self.lines.append(f"{prefix}{stack} {count}\n")
+        if slow:
+            logger.warning(f"slow handler {invocation.handler} took {elapsed:.3f}s on event type {invocation.type}")
+        return elapsed
+
+    def capture(self, frame, root) -> str:
+        names = []
+        while frame is not None and frame is not root and len(names) < self.max_depth:
+            names.append(frame_name(frame))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def flush(self) -> None:
+        with self.lock:
+            lines, self.lines = self.lines, []
+        if lines:
+            try:
+                with open(self.output, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            except OSError as e:
+                logger.error(f"write profiler output failed: {e}")
+
+    def sampler(self) -> None:
+        while not self.closed.wait(self.interval):
+            self.sample()
+            self.flush()
+
+    def sample(self) -> None:
+        now = time.perf_counter()
+        with self.lock:
+            targets = [
+                invocation for invocation in self.active.values()
+                if invocation.sampled or now - invocation.start >= self.threshold
+            ]
+        if not targets:
+            return
+        frames = sys._current_frames()
+        captured = []
+        for invocation in targets:
+            frame = frames.get(invocation.ident)
+            if frame is not None:
+                captured.append((invocation, self.capture(frame, invocation.root)))
+        del frames
+        # exit在锁内读取样本，只记录仍在执行的调用，已结束的调用的栈直接丢弃
+        with self.lock:
+            for invocation, stack in captured:
+                if self.active.get(id(invocation)) is invocation:
+                    invocation.samples[stack] += 1
+
+    def report(self, top: typing.Optional[int] = None) -> str:
+        """累计的collapsed stacks，每行为 `type <事件类型>;<handler>;<栈帧...> <样本数>`"""
+        with self.lock:
+            items = self.stacks.most_common(top)
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+
+    def stats(self) -> typing.Dict[str, dict]:
+        """各handler的调用次数、平均/最大耗时和慢调用次数"""
+        with self.lock:
+            return {
+                name: {
+                    "count": stats.count,
+                    "avg": stats.total / stats.count if stats.count else 0.0,
+                    "max": stats.max,
+                    "slow": stats.slow,
+                }
+                for name, stats in self.handlers.items()
+            }
+
+    def close(self) -> None:
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
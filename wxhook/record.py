@@ -0,0 +1,179 @@
+import os
+import mmap
+import time
+import zlib
+import socket
+import struct
+import typing
+import argparse
+import threading
+
+from .logger import logger
+
+MAGIC = b"WXHR\x01"
+# 记录头：接收时间(UNIX时间戳)、负载长度、标志位
+RECORD_HEADER = struct.Struct("<dIB")
+FLAG_ZLIB = 1
+
+
+class EventRecorder:
+    """把wxhelper推送的原始消息连同接收时间追加写入长度前缀格式的日志，可选zlib压缩，后台线程每flush_interval秒刷盘"""
+
+    def __init__(
+        self,
+        path: str,
+        compress: bool = False,
+        level: int = 1,
+        min_compress_size: int = 256,
+        flush_interval: float = 1.0
+    ):
+        self.path = path
+        self.compress = compress
+        self.level = level
+        self.min_compress_size = min_compress_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, "rb") as file:
+                if file.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{path} is not a wxhook event log")
+        self.file = open(path, "ab")
+        if not exists:
+            self.file.write(MAGIC)
+        self.counters = {"records": 0, "bytes": 0, "raw_bytes": 0}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.flusher, name="wxhook-recorder", daemon=True)
+        self.thread.start()
+
+    def record(self, frame: typing.Union[bytes, bytearray], timestamp: typing.Optional[float] = None) -> None:
+        flags = 0
+        payload = frame
+        if self.compress and len(frame) >= self.min_compress_size:
+            payload = zlib.compress(frame, self.level)
+            flags |= FLAG_ZLIB
+        header = RECORD_HEADER.pack(time.time() if timestamp is None else timestamp, len(payload), flags)
+        with self.lock:
+            self.file.write(header)
+            self.file.write(payload)
+            self.counters["records"] += 1
+            self.counters["bytes"] += len(header) + len(payload)
+            self.counters["raw_bytes"] += len(frame)
+
+    def flusher(self) -> None:
+        # 定时刷盘，没有新消息时缓冲区中的记录也不会一直留在内存里
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"flush event log failed: {e}")
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+                self.file.close()
+
+
+class EventReplayer:
+    """通过mmap读取事件日志，按原速、N倍速或最快速度重放到Bot.on_event或TCP端口"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a wxhook event log")
+
+    def __iter__(self) -> typing.Iterator[typing.Tuple[float, bytes]]:
+        """依次返回(接收时间, 原始消息)，末尾写了一半的记录会被忽略"""
+        offset = len(MAGIC)
+        size = len(self.map)
+        while offset + RECORD_HEADER.size <= size:
+            timestamp, length, flags = RECORD_HEADER.unpack_from(self.map, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > size:
+                break
+            payload = self.map[offset:offset + length]
+            offset += length
+            yield timestamp, zlib.decompress(payload) if flags & FLAG_ZLIB else payload
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    @staticmethod
+    def send(address: typing.Tuple[str, int], frame: bytes) -> None:
+        # 事件服务按换行判断消息结束
+        with socket.create_connection(address) as sock:
+            sock.sendall(frame if frame.endswith(b"\n") else frame + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            sock.recv(64)
+
+    def replay(
+        self,
+        target: typing.Union[typing.Callable[[bytes], typing.Any], typing.Tuple[str, int]],
+        speed: typing.Optional[float] = 1.0,
+        start: typing.Optional[float] = None,
+        end: typing.Optional[float] = None
+    ) -> dict:
+        """重放日志，target为可调用对象(如bot.on_event)或(host, port)，speed为None时不等待，start/end为接收时间范围"""
+        deliver = target if callable(target) else lambda frame: self.send(target, frame)
+        count = errors = 0
+        first = None
+        began = time.perf_counter()
+        for timestamp, frame in self:
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end:
+                break
+            if first is None:
+                first = timestamp
+            if speed:
+                delay = (timestamp - first) / speed - (time.perf_counter() - began)
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                deliver(frame)
+                count += 1
+            except Exception as e:
+                errors += 1
+                logger.error(f"replay failed: {e}")
+        seconds = time.perf_counter() - began
+        return {"events": count, "errors": errors, "seconds": seconds, "rate": count / seconds if seconds > 0 else 0.0}
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="replay a wxhook event log to an event server")
+    parser.add_argument("path", help="event log written by EventRecorder")
+    parser.add_argument("--host", default="127.0.0.1", help="event server host")
+    parser.add_argument("--port", type=int, required=True, help="event server port")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 for as fast as possible")
+    args = parser.parse_args(argv)
+
+    replayer = EventReplayer(args.path)
+    try:
+        result = replayer.replay((args.host, args.port), speed=args.speed or None)
+    finally:
+        replayer.close()
+    for name, value in result.items():
+        print(f"{name:<10} {value:.2f}" if isinstance(value, float) else f"{name:<10} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import re
+import typing
+import threading
+import itertools
+
+from .model import Event
+
+Values = typing.Union[str, typing.Iterable[str], None]
+
+
+def to_set(values: Values) -> typing.Optional[typing.FrozenSet[str]]:
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return frozenset([values])
+    return frozenset(values)
+
+
+class Route:
+    """带过滤条件的handler"""
+    __slots__ = ("func", "rooms", "senders", "prefixes", "regex", "once", "order")
+
+    def __init__(
+        self,
+        func: typing.Callable,
+        room: Values = None,
+        sender: Values = None,
+        startswith: Values = None,
+        regex: typing.Union[str, typing.Pattern, None] = None,
+        once: bool = False,
+        order: int = 0
+    ):
+        self.func = func
+        self.rooms = to_set(room)
+        self.senders = to_set(sender)
+        self.prefixes = tuple(to_set(startswith)) if startswith is not None else None
+        self.regex = re.compile(regex) if isinstance(regex, str) else regex
+        self.once = once
+        self.order = order
+
+    def matches(self, event: Event, room: typing.Optional[str], sender: typing.Optional[str], text: typing.Optional[str]) -> bool:
+        if self.rooms is not None and room not in self.rooms:
+            return False
+        if self.senders is not None and sender not in self.senders:
+            return False
+        if self.prefixes is not None and (text is None or not text.startswith(self.prefixes)):
+            return False
+        if self.regex is not None and (text is None or self.regex.search(text) is None):
+            return False
+        return True
+
+
+class RouteTable:
+    """同一事件类型下的路由：每条路由只挂在一个索引上(群 > 发送者 > 内容前缀 > 其余)，查找时先取候选再校验其余条件"""
+
+    def __init__(self):
+        self.by_room: typing.Dict[str, typing.List[Route]] = {}
+        self.by_sender: typing.Dict[str, typing.List[Route]] = {}
+        self.by_prefix: typing.Dict[str, typing.List[Route]] = {}
+        self.prefix_lengths: typing.Tuple[int, ...] = ()
+        self.rest: typing.List[Route] = []
+
+    @staticmethod
+    def insert(index: typing.Dict[str, typing.List[Route]], keys: typing.Iterable[str], route: Route) -> None:
+        # 复制后替换，查找无需加锁
+        for key in keys:
+            index[key] = index.get(key, []) + [route]
+
+    @staticmethod
+    def delete(index: typing.Dict[str, typing.List[Route]], route: Route) -> None:
+        for key, routes in list(index.items()):
+            if route in routes:
+                routes = [item for item in routes if item is not route]
+                if routes:
+                    index[key] = routes
+                else:
+                    del index[key]
+
+    def add(self, route: Route) -> None:
+        if route.rooms is not None:
+            self.insert(self.by_room, route.rooms, route)
+        elif route.senders is not None:
+            self.insert(self.by_sender, route.senders, route)
+        elif route.prefixes is not None:
+            self.insert(self.by_prefix, route.prefixes, route)
+            self.prefix_lengths = tuple(sorted({len(prefix) for prefix in self.by_prefix}))
+        else:
+            self.rest = self.rest + [route]
+
+    def remove(self, route: Route) -> None:
+        self.delete(self.by_room, route)
+        self.delete(self.by_sender, route)
+        self.delete(self.by_prefix, route)
+        self.prefix_lengths = tuple(sorted({len(prefix) for prefix in self.by_prefix}))
+        self.rest = [item for item in self.rest if item is not route]
+
+    def candidates(self, room: typing.Optional[str], sender: typing.Optional[str], text: typing.Optional[str]) -> typing.List[Route]:
+        candidates = []
+        if room is not None and self.by_room:
+            candidates.extend(self.by_room.get(room, ()))
+        if sender is not None and self.by_sender:
+            candidates.extend(self.by_sender.get(sender, ()))
+        if text is not None and self.by_prefix:
+            for length in self.prefix_lengths:
+                if length > len(text):
+                    break
+                candidates.extend(self.by_prefix.get(text[:length], ()))
+        candidates.extend(self.rest)
+        return candidates
+
+    def __bool__(self) -> bool:
+        return bool(self.by_room or self.by_sender or self.by_prefix or self.rest)
+
+
+class RouteIndex:
+    """按事件类型分表的路由索引，只调用条件全部满足的handler"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables: typing.Dict[str, RouteTable] = {}
+        self.counter = itertools.count()
+
+    def add(self, key: str, func: typing.Callable, once: bool = False, **filters) -> Route:
+        route = Route(func, once=once, order=next(self.counter), **filters)
+        with self.lock:
+            self.tables.setdefault(key, RouteTable()).add(route)
+        return route
+
+    def remove(self, key: str, route: Route) -> bool:
+        with self.lock:
+            table = self.tables.get(key)
+            if table is None or route.order < 0:
+                return False
+            table.remove(route)
+            # order置为-1表示已移除，避免once路由被并发触发两次
+            route.order = -1
+            return True
+
+    def match(self, keys: typing.Iterable[str], event: Event) -> typing.List[typing.Tuple[str, Route]]:
+        tables = [(key, self.tables[key]) for key in keys if key in self.tables]
+        if not tables:
+            return []
+        room = event.room
+        sender, text = event.split_content()
+        matched = []
+        seen = set()
+        for key, table in tables:
+            for route in table.candidates(room, sender, text):
+                if route not in seen and route.matches(event, room, sender, text):
+                    seen.add(route)
+                    matched.append((key, route))
+        matched.sort(key=lambda item: item[1].order)
+        return matched
+
+    def dispatch(self, bot, keys: typing.Iterable[str], event: Event) -> int:
+        """调用匹配的handler，返回调用数"""
+        count = 0
+        for key, route in self.match(keys, event):
+            if route.once and not self.remove(key, route):
+                continue
+            route.func(bot, event)
+            count += 1
+        return count
+
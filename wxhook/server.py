@@ -0,0 +1,250 @@
+import queue
+import struct
+import typing
+import tempfile
+import threading
+import traceback
+import socketserver
+
+from .logger import logger
+
+# 队列满时阻塞接收线程，由TCP背压让wxhelper放慢推送
+OVERFLOW_BLOCK = "block"
+# 队列满时丢弃最早排队的连接(不回复ack)
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+# 队列满时由溢出线程读取消息写入磁盘，空闲时再处理，溢出线程也积压时拒绝连接
+OVERFLOW_SPILL = "spill"
+
+# 溢出记录头：消息长度、接收端口
+FRAME_HEADER = struct.Struct("<IH")
+
+
+def read_frame(sock, chunk_size: int = 65536) -> bytearray:
+    """读取一条以换行结尾的消息，直接返回接收缓冲区以免大消息再复制一份"""
+    buffer = bytearray()
+    while True:
+        chunk = sock.recv(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        if chunk[-1] == 0xA:
+            break
+    return buffer
+
+
+class SpillFile:
+    """以长度前缀格式保存溢出消息的临时文件"""
+
+    def __init__(self, directory: typing.Optional[str] = None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def push(self, frame: bytes, port: int = 0) -> None:
+        with self.lock:
+            self.file.seek(self.write_offset)
+            self.file.write(FRAME_HEADER.pack(len(frame), port))
+            self.file.write(frame)
+            self.write_offset = self.file.tell()
+            self.count += 1
+
+    def pop(self) -> typing.Optional[typing.Tuple[bytes, int]]:
+        with self.lock:
+            if self.count == 0:
+                return None
+            self.file.seek(self.read_offset)
+            size, port = FRAME_HEADER.unpack(self.file.read(FRAME_HEADER.size))
+            frame = self.file.read(size)
+            self.read_offset = self.file.tell()
+            self.count -= 1
+            if self.count == 0:
+                self.file.seek(0)
+                self.file.truncate()
+                self.read_offset = self.write_offset = 0
+            return frame, port
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SpilledRequest:
+    """以socket接口包装溢出文件中的消息，交给RequestHandler处理，与正常连接走同一路径"""
+
+    def __init__(self, frame: bytes, sockname: typing.Tuple[str, int]):
+        self.frame = frame
+        self.offset = 0
+        self.sockname = sockname
+
+    def recv(self, size: int) -> bytes:
+        chunk = self.frame[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    def sendall(self, data: bytes) -> None:
+        # 写入溢出文件时已回复ack
+        pass
+
+    def getsockname(self) -> typing.Tuple[str, int]:
+        return self.sockname
+
+    def close(self) -> None:
+        pass
+
+
+class PooledTCPServer(socketserver.TCPServer):
+    """固定数量工作线程 + 有界队列的事件服务，替代每连接一个线程的ThreadingTCPServer"""
+
+    daemon_threads = True
+    # block策略下由内核backlog缓冲等待accept的连接
+    request_queue_size = 128
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        server_address: typing.Tuple[str, int],
+        RequestHandlerClass: typing.Callable,
+        workers: int = 16,
+        queue_size: int = 1024,
+        overflow: str = OVERFLOW_BLOCK,
+        spill_dir: typing.Optional[str] = None,
+        read_timeout: typing.Optional[float] = 30.0,
+        bind_and_activate: bool = True
+    ):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.bot = None
+        self.overflow = overflow
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.spill = SpillFile(spill_dir) if overflow == OVERFLOW_SPILL else None
+        self.spill_queue: typing.Optional[queue.Queue] = queue.Queue(maxsize=queue_size) if self.spill is not None else None
+        self.read_timeout = read_timeout
+        self.counter_lock = threading.Lock()
+        self.counters = {"accepted": 0, "processed": 0, "dropped": 0, "spilled": 0, "errors": 0}
+        self.threads = []
+        # 先初始化状态再绑定端口，绑定失败时server_close不会因属性缺失而报错
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        for index in range(workers):
+            thread = threading.Thread(target=self.worker, name=f"wxhook-worker-{index}", daemon=self.daemon_threads)
+            thread.start()
+            self.threads.append(thread)
+        self.spill_thread: typing.Optional[threading.Thread] = None
+        if self.spill is not None:
+            self.spill_thread = threading.Thread(target=self.spill_reader, name="wxhook-spill", daemon=self.daemon_threads)
+            self.spill_thread.start()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.counter_lock:
+            self.counters[name] += value
+
+    def process_request(self, request, client_address) -> None:
+        self.incr("accepted")
+        # 读取超时避免卡住的连接长期占用工作线程
+        request.settimeout(self.read_timeout)
+        item = (request, client_address)
+        if self.overflow == OVERFLOW_BLOCK:
+            self.queue.put(item)
+            return
+
+        try:
+            self.queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            try:
+                dropped, _ = self.queue.get_nowait()
+                self.shutdown_request(dropped)
+                self.incr("dropped")
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.shutdown_request(request)
+                self.incr("dropped")
+        else:
+            # 接收线程不读取消息，交给溢出线程
+            try:
+                self.spill_queue.put_nowait(item)
+            except queue.Full:
+                self.shutdown_request(request)
+                self.incr("dropped")
+
+    def spill_reader(self) -> None:
+        while True:
+            item = self.spill_queue.get()
+            if item is None:
+                break
+            request, _ = item
+            try:
+                self.spill.push(read_frame(request), request.getsockname()[1])
+                request.sendall("200 OK".encode())
+                self.incr("spilled")
+            except Exception:
+                logger.error(traceback.format_exc())
+                self.incr("errors")
+            finally:
+                self.shutdown_request(request)
+
+    def worker(self) -> None:
+        while True:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                request, client_address = item
+                try:
+                    self.finish_request(request, client_address)
+                    self.incr("processed")
+                except Exception:
+                    self.handle_error(request, client_address)
+                    self.incr("errors")
+                finally:
+                    self.shutdown_request(request)
+            if self.spill is not None and self.queue.empty():
+                self.drain_spill()
+
+    def drain_spill(self) -> None:
+        while self.queue.empty():
+            record = self.spill.pop()
+            if record is None:
+                break
+            frame, port = record
+            request = SpilledRequest(frame, (self.server_address[0], port))
+            try:
+                self.finish_request(request, request.getsockname())
+                self.incr("processed")
+            except Exception:
+                self.handle_error(request, request.getsockname())
+                self.incr("errors")
+
+    def stats(self) -> dict:
+        """队列深度与接收、处理、丢弃、溢出计数"""
+        with self.counter_lock:
+            stats = dict(self.counters)
+        stats.update({
+            "workers": len(self.threads),
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "spill_depth": self.spill.count if self.spill is not None else 0,
+            "spill_queue_depth": self.spill_queue.qsize() if self.spill_queue is not None else 0,
+        })
+        return stats
+
+    def server_close(self) -> None:
+        super().server_close()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.spill_thread is not None:
+            self.spill_queue.put(None)
+            self.spill_thread.join()
+        if self.spill is not None:
+            self.spill.close()
@@ -0,0 +1,92 @@
+import queue
+import typing
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .events import ALL_MESSAGE
+from .model import Event, SnsItem
+
+
+class SnsPager:
+    """朋友圈分页迭代：自动记录游标，处理当前页时后台预取下一页，遇到时间或ID水位线提前停止"""
+
+    def __init__(
+        self,
+        bot,
+        limit: typing.Optional[int] = None,
+        since: typing.Optional[int] = None,
+        since_id: typing.Optional[int] = None,
+        timeout: float = 30.0,
+        prefetch: bool = True
+    ):
+        self.bot = bot
+        self.limit = limit
+        self.since = since
+        self.since_id = since_id
+        self.timeout = timeout
+        self.prefetch = prefetch
+        self.cursor: typing.Optional[int] = None
+        self.pages = 0
+        self.count = 0
+        self.pushed: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+
+    def on_event(self, bot, event: Event) -> None:
+        # wxhelper通过hook_sync_msg推送的朋友圈数据在data字段中
+        if bot is self.bot and isinstance(event.data, list):
+            self.pushed.put(event.data)
+
+    def fetch(self, sns_id: typing.Optional[int]) -> typing.List[SnsItem]:
+        """获取一页，sns_id为None时获取首页"""
+        with self.lock:
+            while not self.pushed.empty():
+                self.pushed.get_nowait()
+            response = self.bot.get_sns_first_page() if sns_id is None else self.bot.get_sns_next_page(sns_id)
+            if response.code <= 0:
+                raise RuntimeError(f"wxhelper returned {response.code}: {response.msg}")
+            items = response.data if isinstance(response.data, list) else None
+            if items is None:
+                try:
+                    items = self.pushed.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"no sns page pushed within {self.timeout}s")
+            return [SnsItem.from_dict(item) for item in items]
+
+    def reached(self, item: SnsItem) -> bool:
+        if self.since is not None and item.createTime is not None and item.createTime <= self.since:
+            return True
+        if self.since_id is not None and item.snsId <= self.since_id:
+            return True
+        return False
+
+    def __iter__(self) -> typing.Iterator[SnsItem]:
+        emitter = self.bot.event_emitter
+        emitter.on(str(ALL_MESSAGE), self.on_event)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wxhook-sns")
+        try:
+            future: Future = executor.submit(self.fetch, None)
+            while True:
+                page = future.result()
+                self.pages += 1
+                if not page:
+                    return
+                last = page[-1].snsId
+                # 本页已触及水位线或上限时不再预取
+                done = last == self.cursor or any(self.reached(item) for item in page) or (
+                    self.limit is not None and self.count + len(page) >= self.limit
+                )
+                self.cursor = last
+                if not done and self.prefetch:
+                    future = executor.submit(self.fetch, last)
+                for item in page:
+                    if self.reached(item) or (self.limit is not None and self.count >= self.limit):
+                        return
+                    self.count += 1
+                    yield item
+                if done:
+                    return
+                if not self.prefetch:
+                    future = executor.submit(self.fetch, last)
+        finally:
+            emitter.remove_listener(str(ALL_MESSAGE), self.on_event)
+            executor.shutdown(wait=False)
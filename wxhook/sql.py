@@ -0,0 +1,230 @@
+import re
+import typing
+import threading
+
+from .model import DB, Table
+
+SELECT_PATTERN = re.compile(
+    r"^\s*select\s+(?P<columns>.+?)\s+from\s+(?P<table>[\w\"`\[\].]+)(?:\s+where\s+(?P<where>.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL
+)
+FROM_PATTERN = re.compile(r"\bfrom\s+(?P<table>[\w\"`\[\].]+)", re.IGNORECASE)
+IDENTIFIER_PATTERN = re.compile(r'"[^"]*"|`[^`]*`|\[[^\]]*\]|[^.]+')
+UNPAGEABLE_PATTERN = re.compile(r"\b(order\s+by|group\s+by|limit|union|join|having)\b", re.IGNORECASE)
+AGGREGATE_PATTERN = re.compile(r"\bdistinct\b|\b(count|sum|avg|min|max|total|group_concat)\s*\(", re.IGNORECASE)
+KEY_ALIAS = "__wxhook_key"
+ROWID_ALIAS = "__wxhook_rowid"
+ROWID_NAMES = ("rowid", "_rowid_", "oid")
+
+
+def column_types(create_sql: str) -> typing.Dict[str, type]:
+    """根据建表语句推断各列的python类型"""
+    start, end = create_sql.find("("), create_sql.rfind(")")
+    if start < 0 or end < 0:
+        return {}
+    types = {}
+    depth = 0
+    column = []
+    for char in create_sql[start + 1:end] + ",":
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            tokens = "".join(column).split()
+            column = []
+            if len(tokens) < 2 or tokens[0].upper() in ("PRIMARY", "UNIQUE", "CHECK", "FOREIGN", "CONSTRAINT"):
+                continue
+            declared = tokens[1].upper()
+            name = tokens[0].strip("\"`[]")
+            if "INT" in declared:
+                types[name] = int
+            elif any(word in declared for word in ("REAL", "FLOA", "DOUB")):
+                types[name] = float
+            elif any(word in declared for word in ("CHAR", "CLOB", "TEXT")):
+                types[name] = str
+        else:
+            column.append(char)
+    return types
+
+
+def split_table(reference: str) -> typing.Tuple[typing.Optional[str], str]:
+    """把FROM后的表引用拆成(限定名, 表名)，例如 main.MSG、"MicroMsg.db"."Contact"，并去掉引号"""
+    parts = [part.strip("\"`[]") for part in IDENTIFIER_PATTERN.findall(reference)]
+    if not parts:
+        raise ValueError(f"invalid table name: {reference}")
+    return ".".join(parts[:-1]) or None, parts[-1]
+
+
+class Schema:
+    """缓存get_db_info返回的数据库结构，按表名查找句柄无需每次请求"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.lock = threading.Lock()
+        self.databases: typing.Optional[typing.List[DB]] = None
+        self.tables: typing.Dict[str, typing.Tuple[int, Table]] = {}
+        self.types: typing.Dict[typing.Tuple[int, str], typing.Dict[str, type]] = {}
+
+    def load(self, refresh: bool = False) -> typing.List[DB]:
+        with self.lock:
+            if self.databases is None or refresh:
+                self.databases = self.bot.get_db_info()
+                self.tables = {}
+                self.types = {}
+                for db in self.databases:
+                    for table in db.tables:
+                        self.tables.setdefault(table.name, (db.handle, table))
+                        self.tables[f"{db.databaseName}.{table.name}"] = (db.handle, table)
+            return self.databases
+
+    def get_handle(self, database_name: str) -> int:
+        for db in self.load():
+            if db.databaseName == database_name:
+                return db.handle
+        raise KeyError(database_name)
+
+    def find_table(self, name: str) -> typing.Tuple[int, Table]:
+        """按表名(或 库名.表名)查找所在数据库句柄和表结构，限定名不是库名(如main)时按表名查找"""
+        self.load()
+        if name in self.tables:
+            return self.tables[name]
+        qualifier, table = split_table(name)
+        if qualifier is not None and table in self.tables:
+            return self.tables[table]
+        raise KeyError(name)
+
+    def get_column_types(self, handle: int, name: str) -> typing.Dict[str, type]:
+        self.load()
+        key = (handle, name)
+        if key not in self.types:
+            types = {}
+            for db in self.databases:
+                if db.handle == handle:
+                    for table in db.tables:
+                        if table.name == name:
+                            types = column_types(table.sql or "")
+            self.types[key] = types
+        return self.types[key]
+
+
+class Cursor:
+    """对exec_sql的分页游标，按键(默认rowid)分批拉取，逐行返回元组"""
+
+    def __init__(
+        self,
+        bot,
+        db_handle: typing.Optional[int],
+        sql: str,
+        batch_size: int = 500,
+        key: str = "rowid",
+        start: typing.Optional[int] = None,
+        typed: bool = True,
+        start_rowid: typing.Optional[int] = None
+    ):
+        self.bot = bot
+        self.sql = sql
+        self.batch_size = batch_size
+        self.key = key
+        self.last_key = start
+        self.last_rowid = start_rowid
+        # 键不是rowid时可能有重复值，按(键, rowid)分页，批次边界落在相同键值之间时也不会漏行
+        self.tiebreak = key.lower() not in ROWID_NAMES
+        self.columns: typing.Optional[typing.List[str]] = None
+        self.converters: typing.Optional[typing.List[typing.Optional[type]]] = None
+        self.match = SELECT_PATTERN.match(sql)
+        if self.match is not None and self.match.group("where") and UNPAGEABLE_PATTERN.search(self.match.group("where")):
+            self.match = None
+        if self.match is not None and AGGREGATE_PATTERN.search(self.match.group("columns")):
+            self.match = None
+        # 不能分页的语句(如聚合、JOIN)也按FROM后的第一个表查找句柄
+        found = FROM_PATTERN.search(sql)
+        reference = self.match.group("table") if self.match is not None else found.group("table") if found else None
+        if db_handle is None:
+            if reference is None:
+                raise ValueError("db_handle is required when the table can not be resolved from sql")
+            qualifier, table = split_table(reference)
+            db_handle, _ = bot.schema.find_table(table if qualifier is None else f"{qualifier}.{table}")
+        self.db_handle = db_handle
+        self.types = {}
+        if typed and self.match is not None:
+            self.types = bot.schema.get_column_types(db_handle, split_table(reference)[1])
+
+    def page_sql(self) -> str:
+        columns, table, where = self.match.group("columns", "table", "where")
+        conditions = []
+        if self.last_key is not None:
+            last_key = int(self.last_key)
+            if self.tiebreak and self.last_rowid is not None:
+                conditions.append(f"({self.key} > {last_key} OR ({self.key} = {last_key} AND rowid > {int(self.last_rowid)}))")
+            else:
+                conditions.append(f"{self.key} > {last_key}")
+        if where:
+            conditions.append(f"({where})")
+        if self.tiebreak:
+            sql = f"SELECT {self.key} AS {KEY_ALIAS}, rowid AS {ROWID_ALIAS}, {columns} FROM {table}"
+            order = f"{self.key}, rowid"
+        else:
+            sql = f"SELECT {self.key} AS {KEY_ALIAS}, {columns} FROM {table}"
+            order = self.key
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql + f" ORDER BY {order} LIMIT {self.batch_size}"
+
+    def execute(self, sql: str) -> typing.List[list]:
+        response = self.bot.exec_sql(self.db_handle, sql)
+        if not isinstance(response.data, list):
+            raise Exception(f"exec sql failed: {response.msg}")
+        return response.data
+
+    @staticmethod
+    def convert_value(convert: typing.Optional[type], value: typing.Any) -> typing.Any:
+        if convert is None or value is None or value == "":
+            return value
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return value
+
+    def convert(self, row: list) -> tuple:
+        convert_value = self.convert_value
+        return tuple(convert_value(convert, value) for convert, value in zip(self.converters, row))
+
+    def set_columns(self, header: typing.List[str]) -> None:
+        self.columns = list(header)
+        self.converters = [self.types.get(column) for column in self.columns]
+
+    def batches(self) -> typing.Iterator[typing.List[tuple]]:
+        """逐批返回行元组"""
+        if self.match is None:
+            data = self.execute(self.sql)
+            if data:
+                self.set_columns(data[0])
+                yield [self.convert(row) for row in data[1:]]
+            return
+
+        offset = 2 if self.tiebreak else 1
+        while True:
+            data = self.execute(self.page_sql())
+            if not data:
+                return
+            if self.columns is None:
+                self.set_columns(data[0][offset:])
+            rows = data[1:]
+            if not rows:
+                return
+            self.last_key = rows[-1][0]
+            if self.tiebreak:
+                self.last_rowid = rows[-1][1]
+            yield [self.convert(row[offset:]) for row in rows]
+            if len(rows) < self.batch_size:
+                return
+
+    def columnar(self) -> typing.Iterator[typing.Dict[str, list]]:
+        """逐批返回列式数据 {列名: 值列表}"""
+        for rows in self.batches():
+            yield {column: list(values) for column, values in zip(self.columns, zip(*rows))} if rows else {column: [] for column in self.columns}
+
+    def __iter__(self) -> typing.Iterator[tuple]:
+        for rows in self.batches():
+            yield from rows
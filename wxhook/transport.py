@@ -0,0 +1,165 @@
+import time
+import typing
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .logger import logger
+
+# 只读接口，失败后重试不会产生副作用
+IDEMPOTENT_APIS = frozenset([
+    "/api/checkLogin",
+    "/api/userInfo",
+    "/api/getContactList",
+    "/api/getContactProfile",
+    "/api/getChatRoomDetailInfo",
+    "/api/getMemberFromChatRoom",
+    "/api/getSNSFirstPage",
+    "/api/getSNSNextPage",
+    "/api/getDBInfo",
+    "/api/test",
+])
+
+
+class LatencyStats:
+    """接口耗时统计"""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: typing.List[float] = []
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+            if len(self.samples) < self.window:
+                self.samples.append(elapsed)
+            else:
+                self.samples[self._index] = elapsed
+                self._index = (self._index + 1) % self.window
+
+    def add_error(self, retry: bool = False) -> None:
+        with self._lock:
+            self.errors += 1
+            if retry:
+                self.retries += 1
+
+    @staticmethod
+    def percentile(ordered: typing.List[float], percent: float) -> float:
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.samples)
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "retries": self.retries,
+                "avg": self.total / self.count if self.count else 0.0,
+                "max": self.max,
+                "p50": self.percentile(ordered, 50),
+                "p99": self.percentile(ordered, 99),
+            }
+
+
+class HTTPTransport:
+    """基于连接池的wxhelper HTTP客户端，复用长连接并提供超时、重试和耗时统计"""
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: float = 3,
+        read_timeout: float = 30,
+        retries: int = 2,
+        backoff: float = 0.1,
+        idle_timeout: float = 60,
+        idempotent_apis: typing.Iterable[str] = IDEMPOTENT_APIS
+    ):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.idempotent_apis = frozenset(idempotent_apis)
+        self.stats: typing.Dict[str, LatencyStats] = {}
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._active = 0
+        self.session = self.create_session()
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def acquire(self) -> requests.Session:
+        """登记一次进行中的请求并返回要使用的session，空闲超时且没有进行中的请求时才重建连接池，避免使用已被服务端断开的连接"""
+        now = time.monotonic()
+        with self._lock:
+            if self._active == 0 and self.idle_timeout is not None and now - self._last_used > self.idle_timeout:
+                logger.debug("http transport idle, reset connection pool")
+                self.session.close()
+                self.session = self.create_session()
+            self._last_used = now
+            self._active += 1
+            return self.session
+
+    def release(self) -> None:
+        with self._lock:
+            self._active -= 1
+            self._last_used = time.monotonic()
+
+    def get_stats(self, api: str) -> LatencyStats:
+        stats = self.stats.get(api)
+        if stats is None:
+            with self._lock:
+                stats = self.stats.setdefault(api, LatencyStats())
+        return stats
+
+    def request(self, base_url: str, api: str, *args, **kwargs) -> dict:
+        kwargs.setdefault("timeout", self.timeout)
+        stats = self.get_stats(api)
+        attempts = 1 + (self.retries if api in self.idempotent_apis else 0)
+        session = self.acquire()
+        try:
+            for attempt in range(attempts):
+                start = time.perf_counter()
+                try:
+                    response = session.request("POST", base_url + api, *args, **kwargs)
+                    result = response.json()
+                except (requests.ConnectionError, requests.Timeout):
+                    retry = attempt + 1 < attempts
+                    stats.add_error(retry)
+                    if not retry:
+                        raise
+                    time.sleep(self.backoff * (2 ** attempt))
+                except Exception:
+                    stats.add_error()
+                    raise
+                else:
+                    stats.add(time.perf_counter() - start)
+                    return result
+        finally:
+            self.release()
+
+    def report(self) -> typing.Dict[str, dict]:
+        """各接口调用次数、错误数及耗时分位数"""
+        return {api: stats.to_dict() for api, stats in list(self.stats.items())}
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,12 +1,21 @@
+import io
 import os
 import json
+import time
 import typing
 import pathlib
+import tempfile
+import contextlib
 import subprocess
 
 import psutil
 import xmltodict
 
+try:
+    from lxml import etree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
 BASE_DIR = pathlib.Path(__file__).resolve().parent
 TOOLS = BASE_DIR / "tools"
 DLL = TOOLS / "wxhook.dll"
@@ -25,12 +34,12 @@ def fake_wechat_version(pid: int, old_version: str, new_version: str) -> int:
     return int(result.stdout)
 
 
-def get_processes(process_name: str) -> typing.List[psutil.Process]:
-    processes = []
-    for process in psutil.process_iter():
-        if process.name().lower() == process_name.lower():
-            processes.append(process)
-    return processes
+def get_create_time(pid: int) -> typing.Optional[float]:
+    """进程创建时间，进程不存在时返回None"""
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return None
 
 
 def get_pid(port: int) -> typing.Tuple[int, int]:
@@ -38,82 +47,211 @@ def get_pid(port: int) -> typing.Tuple[int, int]:
     return 0, int(output.split("\n")[0].split("LISTENING")[-1])
 
 
+def open_wechat(port: int) -> psutil.Process:
+    try:
+        code, output = start_wechat_with_inject(port)
+    except Exception:
+        code, output = get_pid(port)
+
+    if code == 1:
+        raise Exception(output)
+
+    return psutil.Process(int(output))
+
+
+def is_xml(text: typing.Any) -> bool:
+    return isinstance(text, str) and text[:64].lstrip().startswith("<")
+
+
 def parse_xml(xml: str) -> dict:
     return xmltodict.parse(xml)
 
 
+def select_xml(xml: str, *paths: str) -> typing.Dict[str, typing.Optional[str]]:
+    """流式解析XML，只返回指定路径(如msgsource/atuserlist)的文本，全部找到后立即停止"""
+    wanted = set(paths)
+    result = {}
+    stack = []
+    for action, element in ElementTree.iterparse(io.BytesIO(xml.encode("utf-8")), events=("start", "end")):
+        if action == "start":
+            stack.append(element.tag)
+            continue
+        path = "/".join(stack)
+        if path in wanted and path not in result:
+            result[path] = element.text
+            if len(result) == len(wanted):
+                break
+        stack.pop()
+        element.clear()
+    return result
+
+
 def parse_event(event: dict, fields=None) -> dict:
     for field in fields or ["content", "signature"]:
         try:
-            if field in event:
+            if is_xml(event.get(field)):
                 event[field] = parse_xml(event[field])
         except Exception:
             pass
     return event
 
 
+def default_state_dir() -> pathlib.Path:
+    return pathlib.Path(os.environ.get("WXHOOK_STATE_DIR") or pathlib.Path.home() / ".wxhook")
+
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path) -> typing.Iterator[None]:
+    """跨进程的排他文件锁"""
+    with open(path, "a+b") as file:
+        if os.name == "nt":
+            import msvcrt
+            file.seek(0)
+            delay = 0.01
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    # 非阻塞加锁失败后退避重试，避免空转占满CPU
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.5)
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_json(path: pathlib.Path, data: typing.Any) -> None:
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent, prefix=path.name, suffix=".tmp", delete=False) as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(file.name, path)
+
+
 class WeChatManager:
+    """端口/实例登记表，保存在状态目录(WXHOOK_STATE_DIR，默认~/.wxhook)中，读写均在文件锁内完成"""
 
-    def __init__(self):
+    def __init__(self, state_dir: typing.Union[str, pathlib.Path, None] = None):
         # remote port: 19001 ~ 37999
         # socket port: 18999 ~ 1
         # http port:   38999 ~ 57997
-        self.filename = BASE_DIR / "tools" / "wxhook.json"
-        if not os.path.exists(self.filename):
-            self.init_file()
-        else:
-            self.clean()
-
-    def init_file(self) -> None:
-        with open(self.filename, "w", encoding="utf-8") as file:
-            json.dump({
-                "increase_remote_port": 19000,
-                "wechat": []
-            }, file)
+        self.state_dir = pathlib.Path(state_dir) if state_dir is not None else default_state_dir()
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.filename = self.state_dir / "wxhook.json"
+        self.lock_filename = self.state_dir / "wxhook.lock"
 
     def read(self) -> dict:
-        with open(self.filename, "r", encoding="utf-8") as file:
-            data = json.load(file)
+        try:
+            with open(self.filename, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            data = {}
+        data.setdefault("wechat", [])
         return data
 
     def write(self, data: dict) -> None:
-        with open(self.filename, "w", encoding="utf-8") as file:
-            json.dump(data, file)
-
-    def refresh(self, pid_list: typing.List[int]) -> None:
-        data = self.read()
-        cleaned_data = []
-        remote_port_list = [19000]
-        for item in data["wechat"]:
-            if item["pid"] in pid_list:
-                remote_port_list.append(item["remote_port"])
-                cleaned_data.append(item)
-
-        data["increase_remote_port"] = max(remote_port_list)
-        data["wechat"] = cleaned_data
-        self.write(data)
+        atomic_write_json(self.filename, data)
 
-    def clean(self) -> None:
-        pid_list = [process.pid for process in get_processes("WeChat.exe")]
-        self.refresh(pid_list)
+    @staticmethod
+    def is_alive(item: dict) -> bool:
+        # 已注入的实例看微信进程，只预留了端口的看预留端口的Python进程；pid可能被复用，同时比对进程创建时间
+        if item.get("pid"):
+            pid, created = item["pid"], item.get("created")
+        else:
+            pid, created = item.get("owner"), item.get("owner_created")
+        if not pid:
+            return False
+        actual = get_create_time(pid)
+        if actual is None:
+            return False
+        if created is None:
+            # 旧版本登记的条目没有创建时间
+            return True
+        return abs(actual - created) < 1
 
-    def get_remote_port(self) -> int:
-        data = self.read()
-        return data["increase_remote_port"] + 1
+    def refresh(self, data: dict) -> dict:
+        data["wechat"] = [item for item in data["wechat"] if self.is_alive(item)]
+        return data
+
+    def clean(self) -> None:
+        with file_lock(self.lock_filename):
+            self.write(self.refresh(self.read()))
 
     def get_listen_port(self, remote_port: int) -> int:
         return 19000 - (remote_port - 19000)
 
+    def get_remote_port(self, listen_port: int) -> int:
+        return 19000 + (19000 - listen_port)
+
+    def resolve_ports(
+        self,
+        remote_port: typing.Optional[int],
+        server_port: typing.Optional[int]
+    ) -> typing.Tuple[int, int, bool]:
+        """两个端口都未指定时预留一组端口(第三项为True，退出时需要release)，只指定一个时按固定映射推算另一个"""
+        if remote_port is None and server_port is None:
+            remote_port, server_port = self.get_port()
+            return remote_port, server_port, True
+        if server_port is None:
+            server_port = self.get_listen_port(remote_port)
+        if remote_port is None:
+            remote_port = self.get_remote_port(server_port)
+        return remote_port, server_port, False
+
     def get_port(self) -> typing.Tuple[int, int]:
-        remote_port = self.get_remote_port()
-        return remote_port, self.get_listen_port(remote_port)
+        """预留一组未被占用的端口，已退出实例的端口会被重新使用"""
+        with file_lock(self.lock_filename):
+            data = self.refresh(self.read())
+            used = {item["remote_port"] for item in data["wechat"]}
+            remote_port = 19001
+            while remote_port in used:
+                remote_port += 1
+            server_port = self.get_listen_port(remote_port)
+            data["wechat"].append({
+                "pid": None,
+                "owner": os.getpid(),
+                "owner_created": get_create_time(os.getpid()),
+                "remote_port": remote_port,
+                "server_port": server_port
+            })
+            self.write(data)
+        return remote_port, server_port
 
     def add(self, pid: int, remote_port: int, server_port: int) -> None:
-        data = self.read()
-        data["increase_remote_port"] = remote_port
-        data["wechat"].append({
-            "pid": pid,
-            "remote_port": remote_port,
-            "server_port": server_port
-        })
-        self.write(data)
+        with file_lock(self.lock_filename):
+            data = self.refresh(self.read())
+            for item in data["wechat"]:
+                if item["remote_port"] == remote_port:
+                    item.update(pid=pid, created=get_create_time(pid), server_port=server_port)
+                    break
+            else:
+                data["wechat"].append({
+                    "pid": pid,
+                    "created": get_create_time(pid),
+                    "owner": os.getpid(),
+                    "owner_created": get_create_time(os.getpid()),
+                    "remote_port": remote_port,
+                    "server_port": server_port
+                })
+            self.write(data)
+
+    def release(self, remote_port: int) -> None:
+        """释放本进程登记的端口"""
+        owner = os.getpid()
+        with file_lock(self.lock_filename):
+            data = self.read()
+            data["wechat"] = [
+                item for item in data["wechat"]
+                if item["remote_port"] != remote_port or item.get("owner") != owner
+            ]
+            self.write(data)
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import queue
+import typing
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .logger import logger
+from .blob import json_default
+from .utils import parse_event
+
+# 接收方限流或请求超时，按退避(或Retry-After)重试，其余4xx视为已送达
+RETRY_STATUS = (408, 429)
+
+
+def retry_after(response: requests.Response) -> typing.Optional[float]:
+    """解析Retry-After头，支持秒数和HTTP日期"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class WebhookForwarder:
+    """后台批量转发事件到webhook，失败时退避重试，接收方不可用时写入磁盘，恢复后补发"""
+
+    def __init__(
+        self,
+        url: str,
+        batch_size: int = 1,
+        batch_interval: float = 0.5,
+        queue_size: int = 10000,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: typing.Union[float, typing.Tuple[float, float]] = (3, 10),
+        spill_path: typing.Optional[str] = None,
+        max_retry_after: float = 60.0,
+        overflow_size: int = 10000
+    ):
+        self.url = url
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.spill_path = spill_path
+        self.max_retry_after = max_retry_after
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # 队列满时的事件先放在这里(最多overflow_size条)，由工作线程解析后写入磁盘，put本身不做解析和文件IO
+        self.overflow: typing.List[dict] = []
+        self.overflow_size = overflow_size
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.lock = threading.Lock()
+        self.counters = {"queued": 0, "delivered": 0, "failed": 0, "spilled": 0, "dropped": 0, "retries": 0}
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.closed = False
+        self.thread = threading.Thread(target=self.worker, name="wxhook-webhook", daemon=True)
+        self.thread.start()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+
+    def put(self, event: dict) -> None:
+        try:
+            self.queue.put_nowait((time.monotonic(), event))
+            self.incr("queued")
+        except queue.Full:
+            with self.lock:
+                if self.spill_path is not None and len(self.overflow) < self.overflow_size:
+                    self.overflow.append(event)
+                else:
+                    self.counters["dropped"] += 1
+
+    def spill_overflow(self) -> None:
+        with self.lock:
+            events, self.overflow = self.overflow, []
+        if events:
+            self.spill([parse_event(event) for event in events])
+
+    def collect(self) -> typing.List[typing.Tuple[float, dict]]:
+        """收集一批事件，达到batch_size或等待超过batch_interval后返回"""
+        try:
+            item = self.queue.get(timeout=self.batch_interval)
+        except queue.Empty:
+            return []
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                try:
+                    self.queue.put_nowait(None)
+                except queue.Full:
+                    pass
+                break
+            batch.append(item)
+        return batch
+
+    def post(self, events: typing.List[dict]) -> bool:
+        payload = events[0] if self.batch_size == 1 and len(events) == 1 else events
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * (2 ** attempt)
+            try:
+                response = self.session.post(
+                    self.url,
+                    data=json.dumps(payload, ensure_ascii=False, default=json_default).encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                    timeout=self.timeout
+                )
+                if response.status_code < 500 and response.status_code not in RETRY_STATUS:
+                    return True
+                wait = retry_after(response)
+                if wait is not None:
+                    delay = min(max(delay, wait), self.max_retry_after)
+                logger.debug(f"webhook post returned {response.status_code}")
+            except Exception as e:
+                logger.debug(f"webhook post failed: {e}")
+            if attempt < self.retries:
+                self.incr("retries")
+                time.sleep(delay)
+        return False
+
+    def spill(self, events: typing.List[dict], lines: typing.Iterable[str] = ()) -> None:
+        """事件追加写入磁盘，lines为已序列化的事件行(补发失败时剩余的行)"""
+        count = len(events)
+        with self.lock:
+            with open(self.spill_path, "a", encoding="utf-8") as file:
+                for event in events:
+                    file.write(json.dumps(event, ensure_ascii=False, default=json_default) + "\n")
+                for line in lines:
+                    if line.strip():
+                        file.write(line if line.endswith("\n") else line + "\n")
+                        count += 1
+            self.counters["spilled"] += count
+
+    def replay_spill(self) -> None:
+        """接收方恢复后逐行读取磁盘中的事件按批补发，失败时把当前批次和剩余的行写回"""
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return
+        with self.lock:
+            replay_path = self.spill_path + ".replay"
+            os.replace(self.spill_path, replay_path)
+        size = max(self.batch_size, 1)
+        with open(replay_path, "r", encoding="utf-8") as file:
+            batch = []
+            for line in itertools.chain(file, [None]):
+                if line is not None:
+                    if not line.strip():
+                        continue
+                    batch.append(json.loads(line))
+                    if len(batch) < size:
+                        continue
+                if not batch:
+                    break
+                if not self.post(batch):
+                    self.spill(batch, file)
+                    break
+                self.incr("delivered", len(batch))
+                batch = []
+        os.remove(replay_path)
+
+    def worker(self) -> None:
+        while not (self.closed and self.queue.empty()):
+            batch = self.collect()
+            self.spill_overflow()
+            if not batch:
+                continue
+            events = [parse_event(event) for _, event in batch]
+            if self.post(events):
+                self.incr("delivered", len(events))
+                now = time.monotonic()
+                self.last_lag = now - batch[0][0]
+                self.max_lag = max(self.max_lag, self.last_lag)
+                self.replay_spill()
+            elif self.spill_path is not None:
+                self.spill(events)
+            else:
+                self.incr("failed", len(events))
+        self.spill_overflow()
+
+    def stats(self) -> dict:
+        """队列深度、投递/失败/溢出计数与投递延迟"""
+        with self.lock:
+            stats = dict(self.counters)
+        stats.update({
+            "depth": self.queue.qsize(),
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        })
+        return stats
+
+    def close(self, timeout: typing.Optional[float] = None) -> None:
+        self.closed = True
+        # 队列已满时不放入结束标记，工作线程在closed后清空队列即退出
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning(f"webhook forwarder still delivering {self.queue.qsize()} queued events")
+        else:
+            self.session.close()